@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+"""
+Measures what creating the per-request Context costs, the way
+ContextHandler.initialize does it.
+
+    python perf/context_benchmark.py
+    python perf/context_benchmark.py -c thumbor.conf
+
+"eager" is how contexts used to be built: a FiltersFactory of their own
+and every module instantiated upfront. "shared" reuses the factory of
+the server context and only instantiates the result storage, as a
+result storage hit does.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from thumbor.config import Config
+from thumbor.context import Context, ContextImporter, ServerParameters
+from thumbor.importer import Importer
+
+
+def eager(server_context):
+    context = Context(
+        server=server_context.server,
+        config=server_context.config,
+        importer=server_context.modules.importer,
+    )
+    for name in ContextImporter.LAZY_MODULES:
+        getattr(context.modules, name)
+
+    return context
+
+
+def shared(server_context):
+    context = Context(
+        server=server_context.server,
+        config=server_context.config,
+        importer=server_context.modules.importer,
+        filters_factory=server_context.filters_factory,
+    )
+    getattr(context.modules, "result_storage")
+
+    return context
+
+
+def measure(build, server_context, rounds):
+    # warm up caches and lazily imported modules
+    build(server_context)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    contexts = [build(server_context) for _ in range(rounds)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    allocated = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    del contexts
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        build(server_context)
+    took = time.perf_counter() - start
+
+    return allocated / rounds, blocks / rounds, took / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark per-request contexts")
+    parser.add_argument("-c", "--conf", default=None, help="thumbor configuration file")
+    parser.add_argument("-r", "--rounds", type=int, default=2000, help="contexts built per mode")
+    options = parser.parse_args()
+
+    config = Config.load(options.conf) if options.conf else Config()
+    importer = Importer(config)
+    importer.import_modules()
+    server = ServerParameters(8888, "localhost", options.conf, None, "error", None)
+    server_context = Context(server=server, config=config, importer=importer)
+
+    print(f"{len(importer.filters)} filters, {options.rounds} contexts per mode")
+    for name, build in (("eager", eager), ("shared", shared)):
+        allocated, blocks, took = measure(build, server_context, options.rounds)
+        print(f"{name:>8}: {allocated:8.0f} bytes {blocks:6.0f} blocks {took:8.1f} us per request")
+
+
+if __name__ == "__main__":
+    main()
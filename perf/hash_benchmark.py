@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+"""
+Compares the FILE_CACHE_HASHER options on a realistic mix of sizes.
+
+    python perf/hash_benchmark.py                  # perf/static sample images
+    python perf/hash_benchmark.py -c /var/cache/thumbor/storage
+
+With -c the sizes are sampled from the data files of an existing cache
+root, as recorded in its reference log.
+"""
+
+import argparse
+import os
+import random
+import time
+
+from thumbor.cache.hasher import HASHERS, get_hasher
+from thumbor.cache.ref_log import RefLog
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+def sample_sizes(cache_root, samples):
+    if cache_root is None:
+        return [
+            os.path.getsize(os.path.join(STATIC_DIR, name))
+            for name in sorted(os.listdir(STATIC_DIR))
+        ]
+
+    state, _, _ = RefLog(cache_root).replay()
+    sizes = list(state.blobs.values())
+    if not sizes:
+        raise SystemExit(f"no data files recorded in the reference log of {cache_root}")
+
+    return random.sample(sizes, min(samples, len(sizes)))
+
+
+def benchmark(hasher, payloads, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for payload in payloads:
+            hasher.digest(payload)
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark file cache hashers")
+    parser.add_argument("-c", "--cache", default=None, help="cache root to sample sizes from")
+    parser.add_argument("-s", "--samples", type=int, default=200, help="sizes sampled from the cache")
+    parser.add_argument("-r", "--rounds", type=int, default=20, help="times every payload is hashed")
+    options = parser.parse_args()
+
+    sizes = sample_sizes(options.cache, options.samples)
+    payloads = [os.urandom(size) for size in sizes]
+    total = sum(sizes) * options.rounds
+
+    print(f"{len(sizes)} payloads, mean size {sum(sizes) // len(sizes)} bytes, {options.rounds} rounds")
+    for name in HASHERS:
+        hasher = get_hasher(name)
+        if hasher.name != name:
+            print(f"{name:>8}: not installed")
+            continue
+
+        took = benchmark(hasher, payloads, options.rounds)
+        per_put = took / (len(payloads) * options.rounds) * 1e6
+        print(f"{name:>8}: {total / took / (1 << 20):8.0f} MB/s {per_put:8.1f} us per put")
+
+
+if __name__ == "__main__":
+    main()
@@ -60,6 +60,7 @@ EXTRA_LIBS_REQUIREMENTS = [
     "pycurl==7.*,>=7.45.2",
     "pillow-avif-plugin==1.*,>=1.4.1",
     "pillow-heif==0.*,>=0.14.0",
+    "xxhash==3.*,>=3.4.1",
 ]
 
 ALL_REQUIREMENTS = OPENCV_REQUIREMENTS + EXTRA_LIBS_REQUIREMENTS
@@ -171,6 +172,7 @@ def run_setup(extension_modules=None):
                 "thumbor-url=thumbor.url_composer:main",
                 "thumbor-config=thumbor.config:generate_config",
                 "thumbor-doctor=thumbor.doctor:main",
+                "thumbor-cache=thumbor.cache.console:main",
             ],
         },
         ext_modules=extension_modules,
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from preggy import expect
+
+from thumbor.cache.expire_file import ExpireFile
+from thumbor.cache.expire_index import (
+    HEADER,
+    INITIAL_SLOTS,
+    SLOT,
+    ExpireIndex,
+    ExpireIndexEntry,
+)
+from thumbor.result_descriptor import ResultDescriptor
+
+
+class ExpireIndexTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.index = ExpireIndex(self.root.name)
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_returns_none_without_index(self):
+        expect(self.index.get("missing")).to_be_null()
+
+    def test_can_put_and_get(self):
+        now = time.time()
+        self.index.put("abc", ExpireIndexEntry(now, 60, None))
+
+        entry = self.index.get("abc")
+
+        expect(entry.written_at).to_equal(now)
+        expect(entry.max_age).to_equal(60)
+        expect(entry.max_age_shared).to_be_null()
+        expect(self.index.get("abd")).to_be_null()
+
+    def test_overwrites_existing_entry(self):
+        self.index.put("abc", ExpireIndexEntry(1, 60, None))
+        self.index.put("abc", ExpireIndexEntry(2, 30, 120))
+
+        entry = self.index.get("abc")
+
+        expect(entry.max_age).to_equal(30)
+        expect(entry.max_age_shared).to_equal(120)
+        expect(len(self.index.entries())).to_equal(1)
+
+    def test_grows_beyond_initial_slots(self):
+        names = [f"name-{i}" for i in range(INITIAL_SLOTS * 4)]
+        for i, name in enumerate(names):
+            self.index.put(name, ExpireIndexEntry(i, i, None))
+
+        for i, name in enumerate(names):
+            expect(self.index.get(name).max_age).to_equal(i)
+
+        expect(len(self.index.entries())).to_equal(len(names))
+        expect(os.listdir(self.root.name)).to_equal([".expire_index"])
+
+    def test_can_remove_entry(self):
+        self.index.put("abc", ExpireIndexEntry(1, 60, None))
+        self.index.put("abd", ExpireIndexEntry(1, 60, None))
+        self.index.remove("abc")
+
+        expect(self.index.get("abc")).to_be_null()
+        expect(self.index.get("abd")).not_to_be_null()
+        expect(list(self.index.entries())).to_equal([ExpireIndex.key("abd")])
+
+    def test_stores_result_descriptor(self):
+        descriptor = ResultDescriptor("image/gif", True, 300, 200, digest=b"\x01" * 16)
+        self.index.put("abc", ExpireIndexEntry(1, 60, None, descriptor))
+        self.index.put("abd", ExpireIndexEntry(1, 60, None))
+
+        entry = self.index.get("abc")
+
+        expect(entry.descriptor.mime).to_equal("image/gif")
+        expect(entry.descriptor.animated).to_be_true()
+        expect(entry.descriptor.width).to_equal(300)
+        expect(entry.descriptor.height).to_equal(200)
+        expect(entry.descriptor.digest).to_equal(b"\x01" * 16)
+        expect(self.index.get("abd").descriptor).to_be_null()
+
+    def test_reuses_removed_slots(self):
+        for _ in range(INITIAL_SLOTS * 2):
+            self.index.put("abc", ExpireIndexEntry(1, 60, None))
+            self.index.remove("abc")
+
+        expect(os.path.getsize(self.index.path)).to_equal(HEADER.size + INITIAL_SLOTS * SLOT.size)
+
+
+class ExpireFileTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.link = os.path.join(self.root.name, "abcdef")
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_can_save_and_load(self):
+        expire_file = ExpireFile()
+        expire_file.set_max_age(60)
+        expire_file.set_max_age_shared(120)
+        expire_file.save(self.link)
+
+        loaded = ExpireFile()
+
+        expect(loaded.load(self.link)).to_be_true()
+        expect(loaded.max_age).to_equal(60)
+        expect(loaded.max_age_shared).to_equal(120)
+        expect(loaded.is_expired()).to_be_false()
+
+    def test_migrates_legacy_sidecar_file(self):
+        legacy_path = self.link + ExpireFile.LEGACY_EXT
+        with open(legacy_path, "w") as legacy_file:
+            legacy_file.write("60,120")
+        os.utime(legacy_path, (1000, 1000))
+
+        loaded = ExpireFile()
+
+        expect(loaded.load(self.link)).to_be_false()
+        expect(loaded.migrate(self.link)).to_be_true()
+        expect(loaded.max_age).to_equal(60)
+        expect(loaded.max_age_shared).to_equal(120)
+        expect(loaded.change_date.timestamp()).to_equal(1000)
+        expect(loaded.is_expired()).to_be_true()
+        expect(os.path.exists(legacy_path)).to_be_false()
+        expect(ExpireIndex(self.root.name).get("abcdef").max_age).to_equal(60)
+
+    def test_remove_deletes_entry_and_legacy_file(self):
+        legacy_path = self.link + ExpireFile.LEGACY_EXT
+        with open(legacy_path, "w") as legacy_file:
+            legacy_file.write("60")
+        ExpireFile(60).save(self.link)
+
+        ExpireFile.remove(self.link)
+
+        expect(ExpireFile().load(self.link)).to_be_false()
+        expect(os.path.exists(legacy_path)).to_be_false()
@@ -0,0 +1,336 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from preggy import expect
+
+from thumbor.cache.file_cache import FileCache
+from thumbor.cache.memory_cache import MemoryCache
+from thumbor.cache.write_behind import WriteBehind
+from thumbor.result_descriptor import ResultDescriptor
+
+
+class FileCacheTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        MemoryCache.reset()
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def get_cache(self, memory_max_bytes=0):
+        return FileCache("RESULT_STORAGE", self.root.name, 0, memory_max_bytes)
+
+    def path(self, name):
+        return os.path.join(self.root.name, "ab", "cd", name)
+
+    def test_can_put_and_get(self):
+        cache = self.get_cache()
+        cache.put(self.path("a"), b"data", 60, None)
+
+        res = cache.get(self.path("a"))
+
+        expect(res.found).to_be_true()
+        expect(res.data).to_equal(b"data")
+        expect(res.max_age).to_equal(60)
+        expect(res.last_modified).not_to_be_null()
+
+    def test_expired_entries_are_not_found(self):
+        cache = self.get_cache()
+        cache.put(self.path("a"), b"data", -1, None)
+
+        expect(cache.get(self.path("a")).found).to_be_false()
+
+    def test_returns_stale_entries_within_grace(self):
+        cache = self.get_cache()
+        cache.put(self.path("a"), b"data", -5, None)
+
+        expect(cache.get_from_disk(self.path("a"), grace=2).found).to_be_false()
+
+        res = cache.get_from_disk(self.path("a"), grace=60)
+        expect(res.found).to_be_true()
+        expect(res.data).to_equal(b"data")
+        expect(res.stale_for).to_be_greater_than(4)
+
+    def test_only_one_caller_revalidates(self):
+        cache = self.get_cache()
+
+        expect(cache.claim_revalidation(self.path("a"))).to_be_true()
+        expect(cache.claim_revalidation(self.path("a"))).to_be_false()
+        expect(cache.claim_revalidation(self.path("b"))).to_be_true()
+
+        cache.put(self.path("a"), b"data", 60, None)
+        expect(cache.claim_revalidation(self.path("a"))).to_be_true()
+
+    def test_jitters_max_age_when_writing(self):
+        cache = FileCache("RESULT_STORAGE", self.root.name, 0, jitter=0.5)
+
+        with mock.patch("thumbor.cache.expire_file.random.random", return_value=0.5):
+            cache.put(self.path("a"), b"data", 1000, 2000)
+
+        res = cache.get(self.path("a"))
+        expect(res.max_age).to_equal(750)
+        expect(res.max_age_shared).to_equal(1500)
+
+    def test_refreshes_entries_close_to_expiration_early(self):
+        cache = FileCache("RESULT_STORAGE", self.root.name, 0, early_refresh=100)
+        cache.put(self.path("a"), b"data", 60, None)
+        metrics = mock.Mock()
+
+        with mock.patch("thumbor.cache.expire_file.random.random", return_value=0.5):
+            expect(cache.get(self.path("a"), metrics=metrics).found).to_be_false()
+            metrics.incr.assert_called_with("result_storage.early_refresh")
+
+            cache.early_refresh = 10
+            expect(cache.get(self.path("a"), metrics=metrics).found).to_be_true()
+
+    def test_refreshes_memory_entries_early(self):
+        cache = FileCache("RESULT_STORAGE", self.root.name, 0, 1024, early_refresh=100)
+        cache.put(self.path("a"), b"data", 60, None)
+
+        with mock.patch("thumbor.cache.expire_file.random.random", return_value=0.5):
+            expect(cache.get_from_memory(self.path("a")).found).to_be_false()
+
+    def test_opens_large_entries_for_streaming(self):
+        cache = self.get_cache(memory_max_bytes=1024)
+        cache.put(self.path("a"), b"x" * 100, 60, None)
+        cache.memory_cache.remove(self.path("a"))
+
+        res = cache.get_from_disk(self.path("a"), stream_min_bytes=100)
+        with res.file:
+            expect(res.size).to_equal(100)
+            expect(res.data).to_equal(b"x" * FileCache.STREAM_HEAD_BYTES)
+            expect(res.file.read()).to_equal(b"x" * (100 - FileCache.STREAM_HEAD_BYTES))
+
+        expect(cache.get_from_memory(self.path("a"))).to_be_null()
+
+        res = cache.get_from_disk(self.path("a"), stream_min_bytes=101)
+        expect(res.file).to_be_null()
+        expect(res.data).to_equal(b"x" * 100)
+
+    def test_keeps_result_descriptor(self):
+        cache = self.get_cache(memory_max_bytes=1024)
+        descriptor = ResultDescriptor("image/png", False, 10, 20)
+        cache.put(self.path("a"), b"data", 60, None, descriptor=descriptor)
+
+        from_memory = cache.get_from_memory(self.path("a"))
+        cache.memory_cache.remove(self.path("a"))
+        from_disk = cache.get_from_disk(self.path("a"))
+
+        for res in (from_memory, from_disk):
+            expect(res.descriptor.mime).to_equal("image/png")
+            expect(res.descriptor.width).to_equal(10)
+            expect(res.descriptor.length).to_equal(4)
+
+        cache.put(self.path("b"), b"data", 60, None)
+        expect(cache.get(self.path("b")).descriptor).to_be_null()
+
+    def test_does_not_read_entries_the_client_has(self):
+        cache = self.get_cache()
+        cache.put(self.path("a"), b"data", 60, None, descriptor=ResultDescriptor("image/png"))
+        digest = cache.hasher.digest(b"data")
+
+        res = cache.get_from_disk(self.path("a"), if_none_match=frozenset((digest,)))
+
+        expect(res.found).to_be_true()
+        expect(res.not_modified).to_be_true()
+        expect(res.data).to_equal(b"")
+        expect(res.descriptor.digest).to_equal(digest)
+        expect(res.last_modified).not_to_be_null()
+
+        res = cache.get_from_disk(self.path("a"), if_none_match=frozenset((b"other",)))
+
+        expect(res.not_modified).to_be_false()
+        expect(res.data).to_equal(b"data")
+
+    def test_reuses_digest_of_descriptor_by_same_hasher(self):
+        cache = self.get_cache()
+        digest = cache.hasher.digest(b"data")
+        descriptor = ResultDescriptor("image/png").with_digest(digest, cache.hasher.name)
+
+        with mock.patch.object(cache.hasher, "digest") as hasher_digest:
+            cache.put(self.path("a"), b"data", 60, None, descriptor=descriptor)
+
+        hasher_digest.assert_not_called()
+        expect(cache.get(self.path("a")).descriptor.digest).to_equal(digest)
+
+        other = ResultDescriptor("image/png").with_digest(b"other", "xxhash")
+        cache.put(self.path("b"), b"data", 60, None, descriptor=other)
+        expect(cache.get(self.path("b")).descriptor.digest).to_equal(digest)
+
+    def test_refreshes_expired_entries_without_writing_data(self):
+        cache = self.get_cache()
+        cache.put(self.path("a"), b"data", -5, None)
+        metrics = mock.Mock()
+
+        with mock.patch.object(cache, "ensure_data_file_exists") as write_data:
+            expect(cache.refresh(self.path("a"), 60, None, metrics)).to_be_true()
+
+        write_data.assert_not_called()
+        res = cache.get(self.path("a"))
+        expect(res.found).to_be_true()
+        expect(res.max_age).to_equal(60)
+        metrics.incr.assert_called_with("result_storage.refreshed")
+        expect(cache.refresh(self.path("b"), 60, None)).to_be_false()
+
+    def test_keeps_validators_next_to_entries(self):
+        cache = self.get_cache()
+        validators = {"Etag": '"abc"', "Last-Modified": "Tue, 15 Nov 1994 12:45:26 GMT"}
+        cache.put(self.path("a"), b"data", -5, None, validators=validators)
+
+        expect(cache.get_validators(self.path("a"))).to_equal(validators)
+        expect(cache.ref_log.stats().links).to_equal(1)
+
+        cache.put(self.path("a"), b"other", -5, None, validators={})
+        expect(cache.get_validators(self.path("a"))).to_be_null()
+
+        cache.refresh(self.path("a"), 60, None, validators=validators)
+        expect(cache.get_validators(self.path("a"))).to_equal(validators)
+
+        cache.remove(self.path("a"))
+
+        expect(os.path.exists(self.path("a") + FileCache.VALIDATORS_EXT)).to_be_false()
+        expect(cache.get_validators(self.path("a"))).to_be_null()
+
+    def test_dedups_data_files(self):
+        cache = self.get_cache()
+        cache.put(self.path("a"), b"data", 60, None)
+        cache.put(self.path("b"), b"data", 60, None)
+
+        expect(os.stat(self.path("a")).st_nlink).to_equal(3)
+
+    def test_serves_from_memory_without_touching_disk(self):
+        cache = self.get_cache(memory_max_bytes=1024)
+        metrics = mock.Mock()
+        cache.put(self.path("a"), b"data", 60, 120, metrics=metrics)
+
+        with mock.patch("builtins.open") as open_mock:
+            res = cache.get(self.path("a"), metrics=metrics)
+
+        expect(open_mock.called).to_be_false()
+        expect(res.data).to_equal(b"data")
+        expect(res.max_age_shared).to_equal(120)
+        metrics.incr.assert_called_with("result_storage.memory_cache.hit")
+
+    def test_loads_into_memory_on_disk_hit(self):
+        self.get_cache().put(self.path("a"), b"data", 60, None)
+        cache = self.get_cache(memory_max_bytes=1024)
+        metrics = mock.Mock()
+
+        cache.get(self.path("a"), metrics=metrics)
+        metrics.incr.assert_called_with("result_storage.memory_cache.miss")
+
+        cache.get(self.path("a"), metrics=metrics)
+        metrics.incr.assert_called_with("result_storage.memory_cache.hit")
+
+    def test_reports_evictions(self):
+        cache = self.get_cache(memory_max_bytes=6)
+        metrics = mock.Mock()
+        cache.put(self.path("a"), b"aaaa", 60, None, metrics=metrics)
+        cache.put(self.path("b"), b"bbbb", 60, None, metrics=metrics)
+
+        metrics.incr.assert_called_with("result_storage.memory_cache.eviction", 1)
+
+    def test_remove_invalidates_memory(self):
+        cache = self.get_cache(memory_max_bytes=1024)
+        cache.put(self.path("a"), b"data", 60, None)
+        cache.remove(self.path("a"))
+
+        expect(cache.get(self.path("a")).found).to_be_false()
+        expect(cache.exists(self.path("a"))[0]).to_be_false()
+
+    def test_instances_are_shared(self):
+        FileCache.reset()
+        cache = FileCache.instance("STORAGE", self.root.name + "/", 60)
+
+        expect(FileCache.instance("STORAGE", self.root.name, 60)).to_equal(cache)
+        expect(FileCache.instance("STORAGE", self.root.name, 120)).not_to_equal(cache)
+        expect(FileCache.instance("RESULT_STORAGE", self.root.name, 60)).not_to_equal(cache)
+
+    def test_link_path_layout(self):
+        # sha1("image.jpg") = 42573d7391a7bc9dcdef39375562aa088c386c85
+        storage = FileCache("STORAGE", self.root.name + "/", 0)
+        result_storage = FileCache("RESULT_STORAGE", self.root.name, 0, link_depth=2)
+
+        expect(storage.link_path("image.jpg")).to_equal(
+            f"{self.root.name}/42/573d7391a7bc9dcdef39375562aa088c386c85"
+        )
+        expect(result_storage.link_path("image.jpg", "default")).to_equal(
+            f"{self.root.name}/default/42/57/3d7391a7bc9dcdef39375562aa088c386c85"
+        )
+
+
+
+class AtomicWriteTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        MemoryCache.reset()
+
+    def tearDown(self):
+        WriteBehind.reset()
+        self.root.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.root.name, "ab", name)
+
+    def test_replaces_link_without_leaving_temporary_files(self):
+        cache = FileCache("STORAGE", self.root.name, 0, fsync=True)
+        cache.put(self.path("a"), b"first", 60, None)
+        cache.put(self.path("a"), b"second", 60, None)
+
+        expect(cache.get(self.path("a")).data).to_equal(b"second")
+        expect(sorted(os.listdir(os.path.dirname(self.path("a"))))).to_equal(
+            [".expire_index", "a"]
+        )
+
+    def test_fsyncs_directories_of_renamed_files(self):
+        cache = FileCache("STORAGE", self.root.name, 0, fsync=True)
+
+        with mock.patch.object(cache, "fsync_dir", wraps=cache.fsync_dir) as fsync_dir:
+            cache.put(self.path("a"), b"data", 60, None)
+
+        fsync_dir.assert_any_call(os.path.dirname(self.path("a")))
+        fsync_dir.assert_any_call(os.path.dirname(cache.data_file_path(b"data")))
+
+    def test_keeps_old_link_if_write_fails(self):
+        cache = FileCache("STORAGE", self.root.name, 0)
+        cache.put(self.path("a"), b"first", 60, None)
+
+        with mock.patch("os.replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                cache.put(self.path("a"), b"second", 60, None)
+
+        expect(cache.get(self.path("a")).data).to_equal(b"first")
+        expect([n for n in os.listdir(os.path.dirname(self.path("a"))) if n.endswith(".tmp")]).to_be_empty()
+
+    def test_writes_behind(self):
+        write_behind = WriteBehind(1, 10)
+        cache = FileCache("STORAGE", self.root.name, 0, write_behind=write_behind)
+        metrics = mock.Mock()
+
+        expect(cache.put_behind(self.path("a"), b"data", 60, None, metrics)).to_be_true()
+        write_behind.shutdown()
+
+        expect(cache.get(self.path("a")).data).to_equal(b"data")
+        metrics.incr.assert_called_with("storage.write_behind.queued")
+
+    def test_drops_writes_when_queue_is_full(self):
+        write_behind = WriteBehind(1, 0)
+        cache = FileCache("STORAGE", self.root.name, 0, 1024, write_behind=write_behind)
+        metrics = mock.Mock()
+
+        expect(cache.put_behind(self.path("a"), b"data", 60, None, metrics)).to_be_false()
+
+        metrics.incr.assert_called_with("storage.write_behind.dropped")
+        expect(cache.get(self.path("a")).data).to_equal(b"data")
+        expect(os.path.exists(self.path("a"))).to_be_false()
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import hashlib
+import tempfile
+from unittest import TestCase, mock
+
+from preggy import expect
+
+from thumbor.cache.file_cache import FileCache
+from thumbor.cache.hasher import Blake2bHasher, CacheKeyHasher, Sha1Hasher, get_hasher
+from thumbor.cache.ref_log import RefLog
+
+
+class ShortHasher(CacheKeyHasher):
+    name = "short"
+
+    def digest(self, data: bytes) -> bytes:
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class HasherTestCase(TestCase):
+    def setUp(self):
+        get_hasher.cache_clear()
+
+    def tearDown(self):
+        get_hasher.cache_clear()
+
+    def test_get_hasher(self):
+        expect(get_hasher("sha1")).to_be_instance_of(Sha1Hasher)
+        expect(get_hasher("blake2b")).to_be_instance_of(Blake2bHasher)
+        expect(get_hasher(None)).to_be_null()
+
+        with expect.error_to_happen(ValueError):
+            get_hasher("md5")
+
+    def test_falls_back_to_blake2b_without_xxhash(self):
+        with mock.patch("thumbor.cache.hasher.xxhash", None):
+            expect(get_hasher("xxhash")).to_be_instance_of(Blake2bHasher)
+
+    def test_warns_once_without_xxhash(self):
+        with mock.patch("thumbor.cache.hasher.xxhash", None), mock.patch(
+            "thumbor.cache.hasher.logger"
+        ) as logger:
+            expect(get_hasher("xxhash") is get_hasher("xxhash")).to_be_true()
+
+        expect(logger.warning.call_count).to_equal(1)
+
+    def test_sha1_keeps_existing_paths(self):
+        expect(Sha1Hasher().hexdigest(b"image.jpg")).to_equal(hashlib.sha1(b"image.jpg").hexdigest())
+
+
+class FileCacheHasherTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def test_reads_entries_written_with_legacy_hasher(self):
+        old = FileCache("STORAGE", self.root.name, 0)
+        old.put(old.link_path("image.jpg"), b"data", 60, None)
+        cache = FileCache("STORAGE", self.root.name, 0, 1024, hasher=Blake2bHasher(), legacy_hasher=Sha1Hasher())
+
+        path = cache.link_path("image.jpg")
+        legacy_path = cache.legacy_link_path("image.jpg")
+
+        expect(path).not_to_equal(legacy_path)
+        expect(legacy_path).to_equal(old.link_path("image.jpg"))
+        expect(cache.get_from_disk(path).found).to_be_false()
+        expect(cache.get_from_disk(path, legacy_path=legacy_path).data).to_equal(b"data")
+        expect(cache.get_from_memory(path).data).to_equal(b"data")
+        expect(cache.exists(path, legacy_path)[0]).to_be_true()
+
+    def test_same_legacy_hasher_is_ignored(self):
+        cache = FileCache("STORAGE", self.root.name, 0, legacy_hasher=Sha1Hasher())
+
+        expect(cache.legacy_link_path("image.jpg")).to_be_null()
+
+    def test_ref_log_keeps_short_digests(self):
+        cache = FileCache("STORAGE", self.root.name, 0, hasher=ShortHasher())
+        path = cache.link_path("a")
+        cache.put(path, b"data", 60, None)
+        cache.remove(path)
+
+        deleted, _ = RefLog(self.root.name).compact(collect=True)
+
+        expect(deleted).to_equal(1)
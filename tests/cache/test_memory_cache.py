@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import time
+from unittest import TestCase
+
+from preggy import expect
+
+from thumbor.cache.memory_cache import MemoryCache, MemoryCacheEntry
+
+
+def entry(data, ttl=60):
+    return MemoryCacheEntry(data, ttl, None, time.time() + ttl, time.time())
+
+
+class MemoryCacheTestCase(TestCase):
+    def test_can_get_stored_entry(self):
+        cache = MemoryCache(100)
+        cache.put("/a", entry(b"abc"))
+
+        expect(cache.get("/a").data).to_equal(b"abc")
+        expect(cache.hits).to_equal(1)
+        expect(cache.size).to_equal(3)
+
+    def test_counts_misses(self):
+        cache = MemoryCache(100)
+
+        expect(cache.get("/a")).to_be_null()
+        expect(cache.misses).to_equal(1)
+
+    def test_evicts_least_recently_used_entries(self):
+        cache = MemoryCache(10)
+        cache.put("/a", entry(b"aaaa"))
+        cache.put("/b", entry(b"bbbb"))
+        cache.get("/a")
+
+        evicted = cache.put("/c", entry(b"cccc"))
+
+        expect(evicted).to_equal(1)
+        expect(cache.evictions).to_equal(1)
+        expect(cache.get("/b")).to_be_null()
+        expect(cache.get("/a")).not_to_be_null()
+        expect(cache.get("/c")).not_to_be_null()
+        expect(cache.size).to_equal(8)
+
+    def test_does_not_store_entries_bigger_than_budget(self):
+        cache = MemoryCache(2)
+
+        expect(cache.put("/a", entry(b"aaa"))).to_equal(0)
+        expect(len(cache)).to_equal(0)
+
+    def test_entry_bigger_than_budget_replaces_stored_one(self):
+        cache = MemoryCache(2)
+        cache.put("/a", entry(b"aa"))
+
+        expect(cache.put("/a", entry(b"aaa"))).to_equal(0)
+        expect(cache.get("/a")).to_be_null()
+        expect(cache.size).to_equal(0)
+
+    def test_drops_expired_entries(self):
+        cache = MemoryCache(100)
+        cache.put("/a", entry(b"aaa", ttl=-1))
+
+        expect(cache.get("/a")).to_be_null()
+        expect(len(cache)).to_equal(0)
+        expect(cache.size).to_equal(0)
+
+    def test_can_remove_entry(self):
+        cache = MemoryCache(100)
+        cache.put("/a", entry(b"aaa"))
+        cache.remove("/a")
+
+        expect(cache.get("/a")).to_be_null()
+        expect(cache.size).to_equal(0)
+
+    def test_instance_is_shared(self):
+        MemoryCache.reset()
+        first = MemoryCache.instance("RESULT_STORAGE", "/tmp/a", 100)
+
+        expect(MemoryCache.instance("RESULT_STORAGE", "/tmp/a", 100)).to_equal(first)
+        expect(MemoryCache.instance("STORAGE", "/tmp/a", 100)).not_to_equal(first)
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from preggy import expect
+
+from thumbor.cache.expire_file import ExpireFile
+from thumbor.cache.expire_index import ExpireIndex, ExpireIndexEntry
+from thumbor.cache.file_cache import FileCache
+from thumbor.cache.prune_cache import Checkpoint, Pruner, PruneStats, parse_size
+
+
+class PruneCacheTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.cache_root = os.path.join(self.root.name, "result_storage")
+        self.cache = FileCache("RESULT_STORAGE", self.cache_root, 0)
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def link(self, shard, name):
+        return os.path.join(self.cache_root, shard, name)
+
+    def put(self, shard, name, data, max_age, written_at=None):
+        path = self.link(shard, name)
+        self.cache.put(path, data, max_age, None)
+
+        if written_at is not None:
+            index, index_name = ExpireIndex.for_link(path)
+            index.put(index_name, ExpireIndexEntry(written_at, max_age, None))
+
+        return path
+
+    def test_removes_expired_links_and_data_files(self):
+        expired = self.put("aa", "expired", b"old", -1)
+        alive = self.put("bb", "alive", b"new", 3600)
+
+        stats = Pruner(self.root.name).run()
+
+        expect(os.path.exists(expired)).to_be_false()
+        expect(os.path.exists(alive)).to_be_true()
+        expect(stats.links).to_equal(2)
+        expect(stats.expired).to_equal(1)
+        expect(stats.orphans).to_equal(1)
+        expect(stats.bytes_freed).to_equal(3)
+        expect(stats.bytes_kept).to_equal(3)
+
+    def test_keeps_stale_entries(self):
+        now = time.time()
+        stale = self.put("aa", "stale", b"stale", 60, now - 120)
+        expired = self.put("bb", "expired", b"expired", 60, now - 7200)
+
+        stats = Pruner(self.root.name, keep_stale=3600).run()
+
+        expect(os.path.exists(stale)).to_be_true()
+        expect(os.path.exists(expired)).to_be_false()
+        expect(stats.expired).to_equal(1)
+
+    def test_keeps_data_files_linked_elsewhere(self):
+        self.put("aa", "expired", b"same", -1)
+        alive = self.put("bb", "alive", b"same", 3600)
+
+        stats = Pruner(self.cache_root).run()
+
+        expect(stats.orphans).to_equal(0)
+        with open(alive, "rb") as alive_file:
+            expect(alive_file.read()).to_equal(b"same")
+
+    def test_migrates_legacy_expire_files(self):
+        path = self.put("aa", "legacy", b"old", 3600)
+        ExpireIndex.for_link(path)[0].remove("legacy")
+        with open(path + ExpireFile.LEGACY_EXT, "w") as legacy_file:
+            legacy_file.write("0")
+        os.utime(path + ExpireFile.LEGACY_EXT, (1000, 1000))
+
+        stats = Pruner(self.root.name).run()
+
+        expect(stats.expired).to_equal(1)
+        expect(os.path.exists(path)).to_be_false()
+        expect(os.path.exists(path + ExpireFile.LEGACY_EXT)).to_be_false()
+
+    def test_evicts_oldest_entries_over_budget(self):
+        now = time.time()
+        oldest = self.put("aa", "oldest", b"a" * 100, 86400, now - 7200 * 3)
+        older = self.put("aa", "older", b"b" * 100, 86400, now - 7200 * 2)
+        newest = self.put("bb", "newest", b"c" * 100, 86400, now)
+
+        stats = Pruner(self.root.name, max_bytes=150).run()
+
+        expect(os.path.exists(oldest)).to_be_false()
+        expect(os.path.exists(older)).to_be_false()
+        expect(os.path.exists(newest)).to_be_true()
+        expect(stats.evicted).to_equal(2)
+        expect(stats.bytes_kept).to_equal(100)
+
+    def test_skips_links_removed_while_pruning(self):
+        now = time.time()
+        gone = self.put("aa", "gone", b"a" * 100, 86400, now)
+        kept = self.put("aa", "kept", b"b" * 100, 86400, now)
+        stat = os.stat
+
+        def remove_then_stat(path, *args, **kwargs):
+            if path == gone and os.path.lexists(gone):
+                os.remove(gone)
+            return stat(path, *args, **kwargs)
+
+        with mock.patch("os.stat", side_effect=remove_then_stat):
+            stats = Pruner(self.root.name, max_bytes=1000).run()
+
+        expect(os.path.exists(kept)).to_be_true()
+        expect(stats.links).to_equal(2)
+
+    def test_skips_directories_recorded_in_checkpoint(self):
+        skipped = self.put("aa", "expired", b"old", -1)
+        pruned = self.put("bb", "expired", b"old2", -1)
+        checkpoint_path = os.path.join(self.root.name, "checkpoint")
+        Checkpoint(checkpoint_path).mark_done("links", os.path.dirname(skipped), PruneStats())
+
+        Pruner(self.root.name, checkpoint=Checkpoint(checkpoint_path)).run()
+
+        expect(os.path.exists(skipped)).to_be_true()
+        expect(os.path.exists(pruned)).to_be_false()
+        expect(os.path.exists(checkpoint_path)).to_be_false()
+
+    def test_ignores_truncated_checkpoint_line(self):
+        checkpoint_path = os.path.join(self.root.name, "checkpoint")
+        with open(checkpoint_path, "w") as checkpoint_file:
+            checkpoint_file.write('{"pass": "links", "di')
+
+        expect(Checkpoint(checkpoint_path).done).to_be_empty()
+
+    def test_can_parse_size(self):
+        expect(parse_size("1024")).to_equal(1024)
+        expect(parse_size("2K")).to_equal(2048)
+        expect(parse_size("1.5GB")).to_equal(int(1.5 * (1 << 30)))
+
+    def test_removes_stale_temporary_files_only(self):
+        path = self.put("aa", "alive", b"new", 3600)
+        stale = path + ".abc" + FileCache.TMP_EXT
+        fresh = path + ".def" + FileCache.TMP_EXT
+        for tmp_path in (stale, fresh):
+            with open(tmp_path, "wb") as tmp_file:
+                tmp_file.write(b"partial")
+        os.utime(stale, (1000, 1000), follow_symlinks=False)
+        os.utime(fresh, (time.time(), time.time()), follow_symlinks=False)
+
+        Pruner(self.root.name).run()
+
+        expect(os.path.exists(fresh)).to_be_true()
+        expect(os.path.exists(stale)).to_be_false()
+
+    def test_walks_data_files_of_roots_without_complete_log(self):
+        expired = self.put("aa", "expired", b"old", -1)
+        self.put("bb", "alive", b"new", 3600)
+        os.remove(os.path.join(self.cache_root, ".ref_log"))
+
+        stats = Pruner(self.root.name).run()
+
+        expect(os.path.exists(expired)).to_be_false()
+        expect(os.path.exists(self.cache.data_file_path(b"old"))).to_be_false()
+        expect(stats.orphans).to_equal(1)
+        expect(stats.bytes_kept).to_equal(3)
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import os
+import tempfile
+from unittest import TestCase
+
+from preggy import expect
+
+from thumbor.cache.console import format_size
+from thumbor.cache.file_cache import FileCache
+from thumbor.cache.ref_log import REF_LOG_NAME, RefLog
+
+
+class RefLogTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.cache = FileCache("STORAGE", self.root.name, 0)
+        self.ref_log = RefLog(self.root.name)
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def put(self, key, data):
+        path = self.cache.link_path(key)
+        self.cache.put(path, data, 60, None)
+        return path
+
+    def test_new_root_gets_complete_log(self):
+        self.put("a", b"data")
+
+        expect(self.ref_log.is_complete()).to_be_true()
+
+    def test_counts_links_and_bytes_saved(self):
+        self.put("a", b"data")
+        self.put("b", b"data")
+        self.put("c", b"other data")
+
+        stats = self.ref_log.stats()
+
+        expect(stats.links).to_equal(3)
+        expect(stats.blobs).to_equal(2)
+        expect(stats.orphans).to_equal(0)
+        expect(stats.logical_bytes).to_equal(18)
+        expect(stats.stored_bytes).to_equal(14)
+        expect(stats.bytes_saved).to_equal(4)
+        expect(stats.sizes).to_equal({2: 1, 4: 1})
+
+    def test_replacing_a_link_moves_the_reference(self):
+        path = self.put("a", b"first")
+        self.cache.put(path, b"second", 60, None)
+
+        stats = self.ref_log.stats()
+
+        expect(stats.links).to_equal(1)
+        expect(stats.orphans).to_equal(1)
+
+    def test_collects_orphans_and_compacts(self):
+        removed = self.put("a", b"removed")
+        self.put("b", b"kept")
+        self.cache.remove(removed)
+
+        deleted, freed = self.ref_log.compact(collect=True)
+
+        expect((deleted, freed)).to_equal((1, 7))
+        expect(os.path.exists(self.cache.data_file_path(b"removed"))).to_be_false()
+        expect(os.path.exists(self.cache.data_file_path(b"kept"))).to_be_true()
+        expect(self.ref_log.stats().links).to_equal(1)
+        # one header and one record for the remaining link
+        expect(os.path.getsize(self.ref_log.path)).to_equal(56)
+
+    def test_keeps_data_files_the_log_does_not_know_are_linked(self):
+        removed = self.put("a", b"data")
+        self.cache.remove(removed)
+        os.link(self.cache.data_file_path(b"data"), os.path.join(self.root.name, "elsewhere"))
+
+        deleted, _ = self.ref_log.compact(collect=True)
+
+        expect(deleted).to_equal(0)
+        expect(os.path.exists(self.cache.data_file_path(b"data"))).to_be_true()
+
+    def test_appends_after_compaction_go_to_the_new_log(self):
+        self.put("a", b"data")
+        self.ref_log.compact()
+        self.put("b", b"data")
+
+        expect(self.ref_log.stats().links).to_equal(2)
+
+    def test_rebuilds_log_of_existing_cache(self):
+        self.put("a", b"data")
+        self.put("b", b"data")
+        self.put("c", b"orphan")
+        os.remove(self.cache.link_path("c"))
+        os.remove(self.ref_log.path)
+
+        expect(self.ref_log.is_complete()).to_be_false()
+        RefLog(self.root.name).ensure_exists()
+        expect(self.ref_log.is_complete()).to_be_false()
+
+        self.ref_log.rebuild()
+        stats = self.ref_log.stats()
+
+        expect(self.ref_log.is_complete()).to_be_true()
+        expect(stats.links).to_equal(2)
+        expect(stats.orphans).to_equal(1)
+        expect(REF_LOG_NAME in os.listdir(self.root.name)).to_be_true()
+
+    def test_format_size(self):
+        expect(format_size(512)).to_equal("512B")
+        expect(format_size(1024)).to_equal("1K")
+        expect(format_size(1536)).to_equal("1.5K")
+        expect(format_size(128 << 20)).to_equal("128M")
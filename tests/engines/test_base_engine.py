@@ -73,6 +73,13 @@ class BaseEngineTestCase(TestCase):
     def test_create_engine(self):
         expect(self.engine).to_be_instance_of(BaseEngine)
 
+    def test_computes_transparency_once(self):
+        self.engine.has_transparency = mock.MagicMock(return_value=True)
+
+        expect(self.engine.transparent).to_be_true()
+        expect(self.engine.transparent).to_be_true()
+        expect(self.engine.has_transparency.call_count).to_equal(1)
+
     def test_convert_svg_to_png(self):
         buffer = """<svg width="10px" height="20px" viewBox="0 0 10 20"
                     xmlns="http://www.w3.org/2000/svg">
@@ -447,3 +447,37 @@ class WithPreLoadFilterTestCase(BaseFilterTestCase):
             thumbor.filters.PHASE_PRE_LOAD
         ]
         expect(instances[0].params).to_equal(["aaaa"])
+
+
+class CachedParseFilterTestCase(BaseFilterTestCase):
+    def test_should_parse_each_filter_string_once(self):
+        with patch.object(
+            MyFilter, "parse_params", wraps=MyFilter.parse_params
+        ) as parse_params:
+            first = self.factory.create_instances(self.context, "my_filter(1, 2)")
+            second = self.factory.create_instances(self.context, "my_filter(1, 2)")
+
+        parse_params.assert_called_once_with("my_filter(1, 2)")
+        first_instance = first.filter_instances[
+            thumbor.filters.PHASE_POST_TRANSFORM
+        ][0]
+        second_instance = second.filter_instances[
+            thumbor.filters.PHASE_POST_TRANSFORM
+        ][0]
+        expect(first_instance).not_to_equal(second_instance)
+        expect(second_instance.params).to_equal([1, 2.0])
+        expect(second_instance.context).to_equal(self.context)
+
+    def test_should_compile_filters_once(self):
+        with patch.object(MyFilter, "compile_regex") as compile_regex:
+            FiltersFactory([MyFilter])
+
+        expect(compile_regex.called).to_be_false()
+
+
+def test_split_filters_keeps_colons_in_params():
+    expect(
+        list(thumbor.filters.split_filters("a(1):b(c:d):e():f"))
+    ).to_equal(
+        [("a", "a(1)"), ("b", "b(c:d)"), ("e", "e()"), ("f", "f")]
+    )
@@ -8,6 +8,7 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2011 globo.com thumbor@googlegroups.com
 
+import asyncio
 import logging
 import shutil
 import tempfile
@@ -34,6 +35,7 @@ from thumbor.context import Context, ServerParameters
 from thumbor.engines.pil import Engine
 from thumbor.handlers import BaseHandler
 from thumbor.importer import Importer
+from thumbor.loaders import file_loader
 
 JPEGTRAN_AVAILABLE = which("jpegtran") is not None
 EXIFTOOL_AVAILABLE = which("exiftool") is not None
@@ -164,6 +166,73 @@ class ImagingOperationsTestCase(BaseImagingTestCase):
         expect(response.code).to_equal(200)
         expect(response.body).to_be_similar_to(invalid_quantization())
 
+    @gen_test
+    async def test_concurrent_requests_load_original_once(self):
+        load = file_loader.load
+
+        async def slow_load(context, path):
+            await asyncio.sleep(0.05)
+            return await load(context, path)
+
+        with mock.patch(
+            "thumbor.loaders.file_loader.load", side_effect=slow_load
+        ) as load_mock:
+            responses = await asyncio.gather(
+                self.async_fetch("/unsafe/100x100/image.jpg"),
+                self.async_fetch("/unsafe/200x200/image.jpg"),
+            )
+
+        expect([response.code for response in responses]).to_equal([200, 200])
+        expect(load_mock.call_count).to_equal(1)
+
+    @gen_test
+    async def test_concurrent_requests_share_caching_set_by_loader(self):
+        load = file_loader.load
+
+        async def slow_load(context, path):
+            await asyncio.sleep(0.05)
+            context.request.max_age = 600
+            return await load(context, path)
+
+        with mock.patch(
+            "thumbor.loaders.file_loader.load", side_effect=slow_load
+        ):
+            responses = await asyncio.gather(
+                self.async_fetch("/unsafe/100x100/image.jpg"),
+                self.async_fetch("/unsafe/200x200/image.jpg"),
+            )
+
+        expect(
+            [response.headers["Cache-Control"] for response in responses]
+        ).to_equal(["max-age=600,public", "max-age=600,public"])
+
+    @gen_test
+    async def test_identical_requests_generate_result_once(self):
+        load = file_loader.load
+
+        async def slow_load(context, path):
+            await asyncio.sleep(0.05)
+            return await load(context, path)
+
+        with mock.patch(
+            "thumbor.loaders.file_loader.load", side_effect=slow_load
+        ), mock.patch.object(
+            BaseHandler,
+            "_load_results",
+            autospec=True,
+            side_effect=BaseHandler._load_results,
+        ) as load_results_mock:
+            responses = await asyncio.gather(
+                self.async_fetch("/unsafe/100x100/image.jpg"),
+                self.async_fetch("/unsafe/100x100/image.jpg"),
+            )
+
+        expect(responses[0].code).to_equal(200)
+        expect(responses[1].code).to_equal(200)
+        expect(responses[1].body).to_equal(responses[0].body)
+        expect(load_results_mock.call_count).to_equal(1)
+        expect(BaseHandler.result_flights).to_be_empty()
+
     @gen_test
     async def test_getting_invalid_image_returns_bad_request(self):
         response = await self.async_fetch("/unsafe/image_invalid.jpg")
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+from unittest import TestCase, mock
+
+from preggy import expect
+
+from thumbor.handlers import BaseHandler
+
+
+class FakeEngine:
+    """
+    Encodes to quality ** 2 bytes, like real encoders growing faster
+    with high qualities.
+    """
+
+    def __init__(self):
+        self.qualities = []
+
+    def read(self, extension, quality):
+        self.qualities.append(quality)
+        return b"x" * quality**2
+
+
+class ReloadToFitInKbTestCase(TestCase):
+    def fit(self, max_bytes, max_encodes=6, metrics=None):
+        engine = FakeEngine()
+        results = BaseHandler.reload_to_fit_in_kb(
+            engine,
+            engine.read(".jpg", 80),
+            ".jpg",
+            80,
+            max_bytes,
+            max_encodes,
+            metrics,
+        )
+        return results, engine.qualities[1:]
+
+    def test_keeps_results_that_fit(self):
+        results, encodes = self.fit(80**2)
+
+        expect(len(results)).to_equal(80**2)
+        expect(encodes).to_be_empty()
+
+    def test_finds_best_quality_within_budget(self):
+        metrics = mock.Mock()
+        results, encodes = self.fit(50**2, metrics=metrics)
+
+        expect(len(results)).to_equal(50**2)
+        expect(len(encodes)).to_be_lesser_or_equal_to(6)
+        metrics.incr.assert_called_once_with("max_bytes.encodes", len(encodes))
+
+    def test_returns_best_fit_when_budget_is_spent(self):
+        results, encodes = self.fit(50**2, max_encodes=2)
+
+        expect(len(encodes)).to_equal(2)
+        expect(len(results)).to_be_lesser_or_equal_to(50**2)
+
+    def test_returns_initial_results_if_nothing_fits(self):
+        metrics = mock.Mock()
+        results, encodes = self.fit(10, metrics=metrics)
+
+        expect(len(results)).to_equal(80**2)
+        expect(encodes).to_equal([10])
+        metrics.incr.assert_called_with("max_bytes.unfit")
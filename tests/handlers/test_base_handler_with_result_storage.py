@@ -8,6 +8,7 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2011 globo.com thumbor@googlegroups.com
 
+import hashlib
 import json
 import os
 from os.path import dirname
@@ -17,11 +18,15 @@ from unittest.mock import Mock, patch
 from preggy import expect
 from tornado.testing import gen_test
 
-from tests.fixtures.images import animated_image
+from tests.fixtures.images import animated_image, default_image
 from tests.handlers.test_base_handler import BaseImagingTestCase
 from thumbor.config import Config
 from thumbor.context import Context, ServerParameters
+from thumbor.engines import BaseEngine
 from thumbor.importer import Importer
+from thumbor.loaders import LoaderResult
+from thumbor.result_descriptor import ResultDescriptor
+from thumbor.result_storages import ResultStorageResult
 from thumbor.result_storages.file_storage import Storage as FileResultStorage
 
 JPEGTRAN_AVAILABLE = which("jpegtran") is not None
@@ -165,3 +170,197 @@ class ImageOperationsResultStorageOnlyTestCase(BaseImagingTestCase):
         )
         expect(response.code).to_equal(500)
         expect(response.body).to_be_empty()
+
+
+def stale_result(**metadata):
+    return ResultStorageResult(
+        buffer=default_image(),
+        metadata={
+            "ContentType": "image/jpeg",
+            "ContentLength": len(default_image()),
+            "Stale": True,
+            **metadata,
+        },
+    )
+
+
+class ImageOperationsWithStaleResultStorageTestCase(BaseImagingTestCase):
+    def get_context(self):
+        cfg = Config(SECURITY_KEY="ACME-SEC")
+        cfg.LOADER = "thumbor.loaders.file_loader"
+        cfg.FILE_LOADER_ROOT_PATH = self.loader_path
+        cfg.STORAGE = "thumbor.storages.no_storage"
+
+        cfg.RESULT_STORAGE = "thumbor.result_storages.file_storage"
+        cfg.RESULT_STORAGE_FILE_STORAGE_ROOT_PATH = self.root_path
+        cfg.RESULT_STORAGE_STORES_UNSAFE = True
+        cfg.MAX_AGE_TEMP_IMAGE = 5
+
+        importer = Importer(cfg)
+        importer.import_modules()
+        server = ServerParameters(
+            8889, "localhost", "thumbor.conf", None, "info", None
+        )
+        server.security_key = "ACME-SEC"
+        return Context(server, cfg, importer)
+
+    @patch.object(FileResultStorage, "put")
+    @patch.object(FileResultStorage, "get")
+    @gen_test
+    async def test_serves_stale_result_and_revalidates(self, get_mock, put_mock):
+        get_mock.return_value = stale_result(Revalidate=True)
+
+        response = await self.async_fetch("/unsafe/20x20.jpg")
+
+        expect(response.code).to_equal(200)
+        expect(response.body).to_equal(default_image())
+        expect(response.headers["X-Thumbor-Cache-Status"]).to_equal("stale")
+        expect(response.headers["Cache-Control"]).to_equal("max-age=5,public")
+        expect(put_mock.call_count).to_equal(1)
+        expect(put_mock.call_args[0][0]).not_to_equal(default_image())
+
+    @patch.object(FileResultStorage, "put")
+    @patch.object(FileResultStorage, "get")
+    @gen_test
+    async def test_serves_stale_result_without_revalidating(self, get_mock, put_mock):
+        get_mock.return_value = stale_result(Revalidate=False)
+
+        response = await self.async_fetch("/unsafe/20x20.jpg")
+
+        expect(response.code).to_equal(200)
+        expect(response.headers["X-Thumbor-Cache-Status"]).to_equal("stale")
+        expect(put_mock.call_count).to_equal(0)
+
+    @patch("thumbor.loaders.file_loader.load")
+    @patch.object(FileResultStorage, "get")
+    @gen_test
+    async def test_serves_stale_result_if_origin_fails(self, get_mock, load_mock):
+        get_mock.return_value = stale_result(StaleIfError=True)
+        load_mock.return_value = LoaderResult(
+            successful=False, error=LoaderResult.ERROR_UPSTREAM
+        )
+
+        response = await self.async_fetch("/unsafe/20x20.jpg")
+
+        expect(response.code).to_equal(200)
+        expect(response.body).to_equal(default_image())
+        expect(response.headers["X-Thumbor-Cache-Status"]).to_equal("stale")
+
+    @patch.object(FileResultStorage, "get")
+    @gen_test
+    async def test_regenerates_stale_result_if_origin_works(self, get_mock):
+        get_mock.return_value = stale_result(StaleIfError=True)
+
+        response = await self.async_fetch("/unsafe/20x20.jpg")
+
+        expect(response.code).to_equal(200)
+        expect(response.body).not_to_equal(default_image())
+        expect(response.headers["X-Thumbor-Cache-Status"]).to_equal("miss")
+
+
+class ImageOperationsWithStreamedResultStorageTestCase(BaseImagingTestCase):
+    def get_context(self):
+        cfg = Config(SECURITY_KEY="ACME-SEC")
+        cfg.LOADER = "thumbor.loaders.file_loader"
+        cfg.FILE_LOADER_ROOT_PATH = self.loader_path
+        cfg.STORAGE = "thumbor.storages.no_storage"
+
+        cfg.RESULT_STORAGE = "thumbor.result_storages.file_storage_cache_control"
+        cfg.RESULT_STORAGE_FILE_STORAGE_ROOT_PATH = self.root_path
+        cfg.RESULT_STORAGE_STORES_UNSAFE = True
+        cfg.RESULT_STORAGE_STREAMING_MIN_BYTES = 1
+        cfg.RESULT_STORAGE_STREAMING_CHUNK_BYTES = 100
+
+        importer = Importer(cfg)
+        importer.import_modules()
+        server = ServerParameters(
+            8889, "localhost", "thumbor.conf", None, "info", None
+        )
+        server.security_key = "ACME-SEC"
+        return Context(server, cfg, importer)
+
+    async def store(self, url, data, descriptor=None):
+        self.context.request = Mock(
+            accepts_webp=False,
+            accepts=0,
+            url=url,
+            max_age=60,
+            max_age_shared=None,
+            result_descriptor=descriptor,
+        )
+        await self.context.modules.result_storage.put(data)
+
+    @gen_test
+    async def test_streams_result_from_storage(self):
+        await self.store("/unsafe/20x20.jpg", default_image())
+
+        response = await self.async_fetch("/unsafe/20x20.jpg")
+
+        expect(response.code).to_equal(200)
+        expect(response.headers["X-Thumbor-Cache-Status"]).to_equal("hit")
+        expect(response.headers["Accept-Ranges"]).to_equal("bytes")
+        expect(response.headers["Content-Type"]).to_equal("image/jpeg")
+        expect(response.body).to_equal(default_image())
+
+    @gen_test
+    async def test_uses_stored_descriptor_instead_of_sniffing(self):
+        await self.store(
+            "/unsafe/20x20.jpg",
+            default_image(),
+            ResultDescriptor("image/png", False, 20, 20),
+        )
+
+        with patch.object(BaseEngine, "get_mimetype") as get_mimetype_mock:
+            response = await self.async_fetch("/unsafe/20x20.jpg")
+
+        expect(response.code).to_equal(200)
+        expect(response.headers["Content-Type"]).to_equal("image/png")
+        expect(get_mimetype_mock.called).to_be_false()
+
+    @gen_test
+    async def test_answers_304_from_stored_digest(self):
+        await self.store(
+            "/unsafe/20x20.jpg",
+            default_image(),
+            ResultDescriptor("image/jpeg", False, 20, 20),
+        )
+        etag = f'"{hashlib.sha1(default_image()).hexdigest()}"'
+
+        response = await self.async_fetch("/unsafe/20x20.jpg")
+
+        expect(response.code).to_equal(200)
+        expect(response.headers["Etag"]).to_equal(etag)
+
+        response = await self.async_fetch(
+            "/unsafe/20x20.jpg", headers={"If-None-Match": etag}
+        )
+
+        expect(response.code).to_equal(304)
+        expect(response.headers["Etag"]).to_equal(etag)
+        expect(response.body).to_be_empty()
+
+    @gen_test
+    async def test_honors_range_requests(self):
+        await self.store("/unsafe/20x20.jpg", default_image())
+        size = len(default_image())
+
+        response = await self.async_fetch(
+            "/unsafe/20x20.jpg", headers={"Range": "bytes=10-209"}
+        )
+        expect(response.code).to_equal(206)
+        expect(response.headers["Content-Range"]).to_equal(
+            f"bytes 10-209/{size}"
+        )
+        expect(response.body).to_equal(default_image()[10:210])
+
+        response = await self.async_fetch(
+            "/unsafe/20x20.jpg", headers={"Range": "bytes=-5"}
+        )
+        expect(response.code).to_equal(206)
+        expect(response.body).to_equal(default_image()[-5:])
+
+        response = await self.async_fetch(
+            "/unsafe/20x20.jpg", headers={"Range": f"bytes={size}-"}
+        )
+        expect(response.code).to_equal(416)
+        expect(response.headers["Content-Range"]).to_equal(f"bytes */{size}")
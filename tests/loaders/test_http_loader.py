@@ -11,10 +11,12 @@
 # Test file
 # pylint: disable=protected-access
 
+import asyncio
 import re
 import time
 from os.path import abspath, dirname, join
-from urllib.parse import quote
+from unittest import mock
+from urllib.parse import quote, urlparse
 
 import tornado.web
 from preggy import expect
@@ -25,7 +27,12 @@ import thumbor.loaders.http_loader as loader
 from tests.base import TestCase
 from thumbor.config import Config
 from thumbor.context import Context
-from thumbor.loaders import LoaderResult
+from thumbor.loaders import LoaderResult, StaleOriginal
+
+
+IMAGES_PATH = abspath(
+    join(dirname(__file__), "..", "fixtures", "images")
+)
 
 
 def fixture_for(filename):
@@ -43,6 +50,30 @@ class TimeoutHandler(tornado.web.RequestHandler):
         self.write("Hello")
 
 
+class UnavailableHandler(tornado.web.RequestHandler):
+    requests = 0
+
+    async def get(self):
+        UnavailableHandler.requests += 1
+        self.set_status(503)
+
+
+class ImageHandler(tornado.web.RequestHandler):
+    async def get(self, name):
+        with open(join(IMAGES_PATH, name), "rb") as image_file:
+            self.write(image_file.read())
+
+
+class ConditionalHandler(tornado.web.RequestHandler):
+    async def get(self):
+        self.set_header("Cache-Control", "max-age=60")
+        self.set_header("Etag", '"v1"')
+        if self.request.headers.get("If-None-Match") == '"v1"':
+            self.set_status(304)
+        else:
+            self.write("Hello")
+
+
 class EchoUserAgentHandler(tornado.web.RequestHandler):
     async def get(self):
         self.write(self.request.headers["User-Agent"])
@@ -240,6 +271,360 @@ class HttpLoaderTestCase(DummyAsyncHttpClientTestCase):
         expect(result.successful).to_be_true()
 
 
+class HttpLoaderClientPoolTestCase(DummyAsyncHttpClientTestCase):
+    def get_app(self):
+        application = tornado.web.Application([(r"/", MainHandler)])
+
+        return application
+
+    def get_context(self, curl):
+        config = Config()
+        config.HTTP_LOADER_CURL_ASYNC_HTTP_CLIENT = curl
+        ctx = Context(None, config, None)
+        ctx.metrics = mock.Mock()
+
+        return ctx
+
+    def incremented(self, ctx, name):
+        return sum(
+            call.args[1] if len(call.args) > 1 else 1
+            for call in ctx.metrics.incr.call_args_list
+            if call.args[0] == name
+        )
+
+    @gen_test
+    async def test_configures_client_once(self):
+        url = self.get_url("/")
+        ctx = self.get_context(curl=False)
+        loader.POOL.settings = None
+
+        with mock.patch.object(
+            AsyncHTTPClient, "configure", wraps=AsyncHTTPClient.configure
+        ) as configure:
+            await loader.load(ctx, url)
+            await loader.load(ctx, url)
+
+        expect(configure.call_count).to_equal(1)
+        expect(loader._get_prepare_curl_callback(ctx.config)).to_equal(
+            loader._get_prepare_curl_callback(ctx.config)
+        )
+
+    @gen_test
+    async def test_reports_connection_reuse_with_curl(self):
+        url = self.get_url("/")
+        ctx = self.get_context(curl=True)
+
+        for _ in range(3):
+            result = await loader.load(ctx, url)
+            expect(result.successful).to_be_true()
+
+        expect(
+            self.incremented(ctx, "original_image.pool.requests")
+        ).to_equal(3)
+        expect(
+            self.incremented(ctx, "original_image.pool.connections")
+        ).to_equal(1)
+        ctx.metrics.gauge.assert_any_call("original_image.pool.active", 0)
+        expect(
+            [
+                call.args[0]
+                for call in ctx.metrics.timing.call_args_list
+                if call.args[0] == "original_image.pool.queue_wait"
+            ]
+        ).to_length(3)
+
+    @gen_test
+    async def test_default_client_opens_a_connection_per_load(self):
+        url = self.get_url("/")
+        ctx = self.get_context(curl=False)
+
+        await loader.load(ctx, url)
+        await loader.load(ctx, url)
+
+        expect(
+            self.incremented(ctx, "original_image.pool.connections")
+        ).to_equal(2)
+
+
+class HttpLoaderOriginTestCase(DummyAsyncHttpClientTestCase):
+    def get_app(self):
+        application = tornado.web.Application(
+            [(r"/", MainHandler), (r"/unavailable", UnavailableHandler)]
+        )
+
+        return application
+
+    def get_context(self, **settings):
+        config = Config(**settings)
+        ctx = Context(None, config, None)
+        ctx.metrics = mock.Mock()
+
+        return ctx
+
+    def tearDown(self):
+        loader.POOL.origins.clear()
+        super().tearDown()
+
+    @gen_test
+    async def test_fails_fast_while_circuit_is_open(self):
+        url = self.get_url("/unavailable")
+        ctx = self.get_context(HTTP_LOADER_CIRCUIT_BREAKER_FAILURES=2)
+        UnavailableHandler.requests = 0
+
+        for _ in range(3):
+            result = await loader.load(ctx, url)
+            expect(result.successful).to_be_false()
+
+        expect(UnavailableHandler.requests).to_equal(2)
+        expect(result.error).to_equal(LoaderResult.ERROR_UPSTREAM)
+        expect(result.synthetic).to_be_true()
+        netloc = loader.POOL.origin(urlparse(url).netloc).name
+        ctx.metrics.incr.assert_any_call(
+            f"original_image.fetch.circuit_opened.{netloc}"
+        )
+        ctx.metrics.incr.assert_called_with(
+            f"original_image.fetch.circuit_open.{netloc}"
+        )
+
+    @gen_test
+    async def test_probes_host_once_circuit_has_been_open(self):
+        ctx = self.get_context(
+            HTTP_LOADER_CIRCUIT_BREAKER_FAILURES=1,
+            HTTP_LOADER_CIRCUIT_BREAKER_SECONDS=0,
+        )
+        origin = loader.POOL.origin(urlparse(self.get_url("/")).netloc)
+
+        await loader.load(ctx, self.get_url("/unavailable"))
+        expect(origin.open_until).not_to_equal(0)
+
+        result = await loader.load(ctx, self.get_url("/"))
+
+        expect(result.successful).to_be_true()
+        expect(origin.open_until).to_equal(0)
+        ctx.metrics.incr.assert_any_call(origin.metric("circuit_closed"))
+
+    @gen_test
+    async def test_limits_loads_per_host(self):
+        origin = loader.Origin("example.com")
+
+        expect(await origin.acquire(1, 1)).to_equal(0)
+        waiting = asyncio.ensure_future(origin.acquire(1, 1))
+        await asyncio.sleep(0)
+        expect(waiting.done()).to_be_false()
+
+        origin.release()
+
+        expect(await waiting).to_be_greater_than(0)
+        expect(origin.active).to_equal(1)
+        with expect.error_to_happen(asyncio.TimeoutError):
+            await origin.acquire(1, 0.01)
+        origin.release()
+        expect(origin.idle).to_be_true()
+
+    @gen_test
+    async def test_releases_host_when_failing_before_fetch(self):
+        url = self.get_url("/")
+        ctx = self.get_context()
+        origin = loader.POOL.origin(urlparse(url).netloc)
+        origin.probing = True
+
+        with mock.patch.object(
+            loader.tornado.httpclient,
+            "HTTPRequest",
+            side_effect=ValueError("invalid request"),
+        ):
+            with expect.error_to_happen(ValueError):
+                await loader.load(ctx, url)
+
+        expect(origin.active).to_equal(0)
+        expect(origin.probing).to_be_false()
+
+    def test_forgets_origins_whose_circuit_has_been_open(self):
+        pool = loader.ClientPool()
+
+        with mock.patch.object(loader, "MAX_ORIGINS", 2):
+            for i in range(5):
+                pool.origin(f"host{i}.example.com").open_until = 1
+            pool.origin("open.example.com").open_until = time.monotonic() + 60
+            pool.origin("other.example.com")
+
+        expect(pool.origins).to_length(2)
+        expect(pool.origins).to_include("open.example.com")
+
+    def test_adapts_timeout_to_latency(self):
+        config = Config(
+            HTTP_LOADER_REQUEST_TIMEOUT=20,
+            HTTP_LOADER_MIN_REQUEST_TIMEOUT=1,
+        )
+        origin = loader.Origin("example.com")
+
+        for _ in range(loader.MIN_LATENCY_SAMPLES - 1):
+            origin.observe(2)
+        expect(origin.timeout(config)).to_equal(20)
+
+        origin.observe(2)
+        expect(origin.timeout(config)).to_be_greater_than(2)
+        expect(origin.timeout(config)).to_be_lesser_than(20)
+
+        for _ in range(50):
+            origin.observe(0.01)
+        expect(origin.timeout(config)).to_equal(1)
+
+        config.HTTP_LOADER_MIN_REQUEST_TIMEOUT = 0
+        expect(origin.timeout(config)).to_equal(20)
+
+
+class HttpLoaderStreamingTestCase(DummyAsyncHttpClientTestCase):
+    def get_app(self):
+        application = tornado.web.Application(
+            [(r"/images/(.+)", ImageHandler)]
+        )
+
+        return application
+
+    def get_context(self, curl=False, **settings):
+        settings.setdefault("HTTP_LOADER_MAX_BODY_BYTES", 4 * 1024 * 1024)
+        config = Config(HTTP_LOADER_CURL_ASYNC_HTTP_CLIENT=curl, **settings)
+
+        return Context(None, config, None)
+
+    async def assert_streams(self, curl):
+        ctx = self.get_context(curl)
+
+        result = await loader.load(ctx, self.get_url("/images/20x20.jpg"))
+
+        expect(result.successful).to_be_true()
+        with open(join(IMAGES_PATH, "20x20.jpg"), "rb") as image_file:
+            expect(result.buffer).to_equal(image_file.read())
+        expect(result.metadata).to_include("Content-Type")
+
+    async def assert_rejects_large_images(self, curl):
+        ctx = self.get_context(curl, MAX_PIXELS=1e6)
+
+        result = await loader.load(
+            ctx, self.get_url("/images/9643x10328.jpg")
+        )
+
+        expect(result.successful).to_be_false()
+        expect(result.error).to_equal(LoaderResult.ERROR_TOO_LARGE)
+
+    @gen_test
+    async def test_streams_body(self):
+        await self.assert_streams(curl=False)
+
+    @gen_test
+    async def test_streams_body_with_curl(self):
+        await self.assert_streams(curl=True)
+
+    @gen_test
+    async def test_rejects_images_with_too_many_pixels(self):
+        await self.assert_rejects_large_images(curl=False)
+
+    @gen_test
+    async def test_rejects_images_with_too_many_pixels_with_curl(self):
+        await self.assert_rejects_large_images(curl=True)
+
+    @gen_test
+    async def test_rejects_bodies_over_max_bytes(self):
+        ctx = self.get_context(HTTP_LOADER_MAX_BODY_BYTES=1024)
+
+        result = await loader.load(ctx, self.get_url("/images/image.jpg"))
+
+        expect(result.successful).to_be_false()
+        expect(result.error).to_equal(LoaderResult.ERROR_TOO_LARGE)
+
+    def test_assembles_chunks_in_place(self):
+        body = loader.StreamedBody(100, None)
+        body.header_received("HTTP/1.1 200 OK\r\n")
+        body.header_received("Content-Length: 6\r\n")
+        body.header_received("\r\n")
+        buffer = body.buffer
+
+        body.data_received(b"abc")
+        body.data_received(b"def")
+
+        expect(body.buffer is buffer).to_be_true()
+        expect(bytes(body.buffer)).to_equal(b"abcdef")
+
+    def test_stops_sniffing_once_size_is_known(self):
+        with open(join(IMAGES_PATH, "image.jpg"), "rb") as image_file:
+            image = image_file.read()
+        body = loader.StreamedBody(len(image), None)
+
+        with mock.patch.object(
+            loader, "image_size", wraps=loader.image_size
+        ) as image_size:
+            for i in range(0, len(image), 1024):
+                body.data_received(image[i : i + 1024])  # NOQA
+
+        expect(body.size).not_to_be_null()
+        expect(image_size.call_count).to_be_lesser_than(len(image) // 1024)
+        expect(bytes(body.buffer)).to_equal(image)
+
+
+class HttpLoaderRevalidationTestCase(DummyAsyncHttpClientTestCase):
+    def get_app(self):
+        application = tornado.web.Application(
+            [
+                (r"/", ConditionalHandler),
+                (r"/watermark.png", ConditionalHandler),
+            ]
+        )
+
+        return application
+
+    def get_context(self, stale):
+        ctx = Context(None, Config(), None)
+        ctx.request = mock.Mock(stale_original=stale)
+
+        return ctx
+
+    @gen_test
+    async def test_keeps_stale_original_the_origin_did_not_change(self):
+        stale = StaleOriginal(self.get_url("/"), b"stored", etag='"v1"')
+        ctx = self.get_context(stale)
+
+        result = await loader.load(ctx, self.get_url("/"))
+
+        expect(result.successful).to_be_true()
+        expect(result.buffer).to_equal(b"stored")
+        expect(result.metadata["Cache-Control"]).to_equal("max-age=60")
+        expect(stale.not_modified).to_be_true()
+
+    @gen_test
+    async def test_loads_original_the_origin_changed(self):
+        stale = StaleOriginal(self.get_url("/"), b"stored", etag='"v0"')
+        ctx = self.get_context(stale)
+
+        result = await loader.load(ctx, self.get_url("/"))
+
+        expect(result.buffer).to_equal(b"Hello")
+        expect(stale.not_modified).to_be_false()
+
+    @gen_test
+    async def test_ignores_stale_original_of_another_url(self):
+        stale = StaleOriginal(self.get_url("/"), b"stored", etag='"v1"')
+        ctx = self.get_context(stale)
+        await loader.load(ctx, self.get_url("/"))
+
+        result = await loader.load(ctx, self.get_url("/watermark.png"))
+
+        expect(result.buffer).to_equal(b"Hello")
+
+    def test_conditional_headers(self):
+        stale = StaleOriginal(
+            "/", b"", '"v1"', "Tue, 15 Nov 1994 12:45:26 GMT"
+        )
+
+        expect(stale.conditional_headers()).to_equal(
+            {
+                "If-None-Match": '"v1"',
+                "If-Modified-Since": "Tue, 15 Nov 1994 12:45:26 GMT",
+            }
+        )
+        expect(StaleOriginal("/", b"").conditional_headers()).to_be_empty()
+
+
 class HttpLoaderWithHeadersForwardingTestCase(DummyAsyncHttpClientTestCase):
     def get_app(self):
         application = tornado.web.Application([(r"/", EchoAllHeadersHandler)])
@@ -36,3 +36,4 @@ class LoggerMetricsTestCase(TestCase):
         expect(
             self.context.metrics.timing("test.time", 100)
         ).not_to_be_an_error()
+        expect(self.context.metrics.gauge("test.size", 3)).not_to_be_an_error()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import tempfile
+from unittest import mock
+from urllib.parse import unquote
+
+from preggy import expect
+from tornado.testing import gen_test
+
+from thumbor.config import Config
+from thumbor.context import RequestParameters
+from thumbor.result_storages.file_storage_cache_control import Storage
+from thumbor.testing import TestCase
+
+URL = "/unsafe/100x100/image.jpg"
+
+
+class FileStorageCacheControlVariantsTestCase(TestCase):
+    def get_config(self):
+        self.storage_path = (  # pylint: disable=attribute-defined-outside-init
+            tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        )
+        return Config(
+            AUTO_WEBP=True,
+            AUTO_AVIF=True,
+            RESULT_STORAGE_FILE_STORAGE_ROOT_PATH=self.storage_path.name,
+        )
+
+    def tearDown(self):
+        super().tearDown()
+        self.storage_path.cleanup()
+
+    def storage_for(self, accept):
+        request = RequestParameters(
+            request=mock.Mock(path=URL, headers={"Accept": accept})
+        )
+        request.max_age = 60
+        self.context.request = request
+        return Storage(self.context)
+
+    def test_path_prefix_is_negotiated_variant(self):
+        expect(self.storage_for("text/html").path_prefix).to_equal("default")
+        expect(self.storage_for("image/webp").path_prefix).to_equal(
+            "auto_webp"
+        )
+        expect(
+            self.storage_for("image/avif,image/webp,*/*").path_prefix
+        ).to_equal("auto_webp_avif")
+
+    @gen_test
+    async def test_stores_variants_side_by_side(self):
+        await self.storage_for("image/webp").put(b"webp")
+        await self.storage_for("image/avif").put(b"avif")
+
+        expect((await self.storage_for("image/webp").get()).buffer).to_equal(
+            b"webp"
+        )
+        expect((await self.storage_for("image/avif").get()).buffer).to_equal(
+            b"avif"
+        )
+        expect(await self.storage_for("text/html").get()).to_be_null()
+
+    @gen_test
+    async def test_remove_purges_every_variant(self):
+        await self.storage_for("image/webp").put(b"webp")
+        await self.storage_for("image/avif").put(b"avif")
+
+        await self.storage_for("text/html").remove(URL)
+
+        expect(await self.storage_for("image/webp").get()).to_be_null()
+        expect(await self.storage_for("image/avif").get()).to_be_null()
+
+    @gen_test
+    async def test_reads_results_stored_before_variants(self):
+        storage = self.storage_for("image/avif,*/*")
+        storage.cache.put(
+            storage.cache.link_path(unquote(URL), "default"), b"old", 60, None
+        )
+
+        expect(storage.path_prefix).to_equal("auto_avif")
+        expect((await storage.get()).buffer).to_equal(b"old")
+        expect(
+            await self.storage_for("image/webp,*/*").get()
+        ).to_be_null()
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import tempfile
+from unittest import mock
+
+from preggy import expect
+from tornado.testing import gen_test
+
+from thumbor.cache.file_cache import FileCache
+from thumbor.config import Config
+from thumbor.context import RequestParameters
+from thumbor.storages.file_storage_cache_control import Storage
+from thumbor.testing import TestCase
+
+URL = "http://example.com/image.jpg"
+WATERMARK_URL = "http://example.com/watermark.png"
+VALIDATORS = {"Etag": '"v1"'}
+
+
+class FileStorageCacheControlRevalidationTestCase(TestCase):
+    def get_config(self):
+        self.storage_path = (  # pylint: disable=attribute-defined-outside-init
+            tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        )
+        return Config(
+            FILE_STORAGE_ROOT_PATH=self.storage_path.name,
+            STORAGE_REVALIDATION_SECONDS=3600,
+        )
+
+    def tearDown(self):
+        super().tearDown()
+        self.storage_path.cleanup()
+        FileCache.reset()
+
+    def storage(self, max_age):
+        request = RequestParameters()
+        request.max_age = max_age
+        self.context.request = request
+        self.context.metrics = mock.Mock()
+        return Storage(self.context)
+
+    async def store_expired(self, url=URL, buffer=b"original"):
+        storage = self.storage(max_age=-5)
+        self.context.request.original_validators = VALIDATORS
+        await storage.put(url, buffer)
+
+    @gen_test
+    async def test_expired_originals_are_kept_for_revalidation(self):
+        await self.store_expired()
+        storage = self.storage(max_age=60)
+
+        expect(await storage.get(URL)).to_be_null()
+
+        stale = self.context.request.stale_original
+        expect(stale.buffer).to_equal(b"original")
+        expect(stale.conditional_headers()).to_equal({"If-None-Match": '"v1"'})
+
+    @gen_test
+    async def test_not_modified_originals_are_refreshed(self):
+        await self.store_expired()
+        storage = self.storage(max_age=60)
+        await storage.get(URL)
+        self.context.request.stale_original.not_modified = True
+
+        with mock.patch.object(storage.cache, "put_behind") as put_behind:
+            await storage.put(URL, b"original")
+
+        put_behind.assert_not_called()
+        expect(await self.storage(max_age=60).get(URL)).to_equal(b"original")
+
+    @gen_test
+    async def test_stores_watermark_loaded_after_stale_original(self):
+        await self.store_expired(WATERMARK_URL, b"old watermark")
+        await self.store_expired()
+        storage = self.storage(max_age=60)
+        await storage.get(URL)
+        # the original was not modified, the watermark was loaded again
+        self.context.request.stale_original.not_modified = True
+
+        await storage.put(WATERMARK_URL, b"watermark")
+
+        expect(await storage.get(WATERMARK_URL)).to_equal(b"watermark")
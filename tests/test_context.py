@@ -54,6 +54,25 @@ class ContextTestCase(TestCase):
         expect(ctx.modules).not_to_be_null()
         expect(ctx.modules.importer).to_equal(importer)
 
+    @staticmethod
+    def test_can_share_filters_factory():
+        factory = FiltersFactory([])
+        ctx = Context(filters_factory=factory)
+
+        expect(ctx.filters_factory).to_equal(factory)
+
+    @staticmethod
+    def test_exit_shuts_down_thread_pools():
+        ctx = Context()
+
+        with mock.patch.object(ctx, "thread_pool") as thread_pool:
+            with mock.patch.object(ctx, "file_io") as file_io:
+                with ctx:
+                    pass
+
+        thread_pool.cleanup.assert_called_once_with()
+        file_io.cleanup.assert_called_once_with()
+
     @staticmethod
     def test_can_create_context_without_importer_metrics():
         cfg = Config(
@@ -321,3 +340,18 @@ class ContextImporterTestCase(TestCase):
         expect(ctx_importer.filters).to_equal(importer.filters)
         expect(ctx_importer.optimizers).to_equal(importer.optimizers)
         expect(ctx_importer.url_signer).to_equal(importer.url_signer)
+
+    @staticmethod
+    def test_creates_modules_when_first_used():
+        cfg = Config()
+        importer = Importer(cfg)
+        importer.import_modules()
+        ctx = Context(config=cfg, importer=importer)
+
+        ctx_importer = ContextImporter(ctx, importer)
+        expect(ctx_importer.__dict__).not_to_include("engine")
+
+        engine = ctx_importer.engine
+        expect(engine).to_be_instance_of(importer.engine)
+        expect(ctx_importer.engine).to_equal(engine)
+        expect(ctx_importer.compatibility_legacy_storage).to_be_null()
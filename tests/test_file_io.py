@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import threading
+from unittest import mock
+
+import pytest
+from preggy import expect
+
+from thumbor.file_io import FileIO
+
+
+@pytest.mark.asyncio
+async def test_can_get_file_io_instance():
+    instance = FileIO.instance(0)
+    expect(instance.pool).to_be_null()
+
+    instance = FileIO.instance(2)
+    expect(instance.pool).not_to_be_null()
+    expect(FileIO.instance(2)).to_equal(instance)
+    expect(FileIO.instance(3)).not_to_equal(instance)
+
+
+@pytest.mark.asyncio
+async def test_runs_in_foreground_without_pool():
+    instance = FileIO.instance(0)
+
+    result = await instance.run("test.io", threading.current_thread)
+    expect(result).to_equal(threading.current_thread())
+
+
+@pytest.mark.asyncio
+async def test_runs_on_pool_threads():
+    instance = FileIO.instance(2)
+
+    result = await instance.run("test.io", lambda value: (threading.current_thread(), value), 10)
+    expect(result[0]).not_to_equal(threading.current_thread())
+    expect(result[0].name).to_include("thumbor-file-io")
+    expect(result[1]).to_equal(10)
+
+
+@pytest.mark.asyncio
+async def test_reports_latency_even_if_operation_fails():
+    instance = FileIO.instance(2)
+    metrics = mock.Mock()
+
+    def fail():
+        raise IOError("Boom")
+
+    with expect.error_to_happen(IOError, message="Boom"):
+        await instance.run("test.io.fail", fail, metrics=metrics)
+
+    expect(metrics.timing.call_count).to_equal(1)
+    expect(metrics.timing.call_args[0][0]).to_equal("test.io.fail")
+
+
+@pytest.mark.asyncio
+async def test_cleaned_up_instance_is_not_shared_anymore():
+    instance = FileIO.instance(2)
+    instance.cleanup()
+
+    new_instance = FileIO.instance(2)
+    expect(new_instance).not_to_equal(instance)
+
+    result = await new_instance.run("test.io", lambda: 10)
+    expect(result).to_equal(10)
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+from os.path import abspath, dirname, join
+
+from preggy import expect
+
+from thumbor.image_header import image_size
+
+IMAGES_PATH = join(abspath(dirname(__file__)), "fixtures", "images")
+
+
+def image(name):
+    with open(join(IMAGES_PATH, name), "rb") as image_file:
+        return image_file.read()
+
+
+def test_reads_dimensions_from_headers():
+    expect(image_size(image("940x2.png"))).to_equal((940, 2))
+    expect(image_size(image("20x20.jpg"))).to_equal((20, 20))
+    expect(image_size(image("animated.gif"))).to_equal((100, 100))
+    expect(image_size(bytearray(image("9643x10328.jpg")))).to_equal(
+        (9643, 10328)
+    )
+
+
+def test_reads_webp_dimensions():
+    expect(image_size(image("image.webp"))).to_equal((300, 400))
+
+
+def test_needs_more_bytes():
+    expect(image_size(image("20x20.jpg")[:20])).to_be_null()
+    expect(image_size(image("940x2.png")[:20])).to_be_null()
+
+
+def test_unknown_formats_have_no_size():
+    expect(image_size(image("image.avif"))).to_be_null()
+    expect(image_size(b"")).to_be_null()
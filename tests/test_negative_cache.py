@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+from unittest import mock
+
+from preggy import expect
+from tornado.testing import AsyncTestCase, gen_test
+
+from thumbor import negative_cache
+from thumbor.config import Config
+from thumbor.loaders import LoaderResult
+from thumbor.negative_cache import NegativeCache
+
+
+def test_forgets_failures_after_their_ttl():
+    cache = NegativeCache(10)
+    cache.put("a", LoaderResult.ERROR_NOT_FOUND, 60, now=0)
+
+    expect(cache.get("a", now=59)).to_equal(LoaderResult.ERROR_NOT_FOUND)
+    expect(cache.get("a", now=60)).to_be_null()
+    expect(cache).to_length(0)
+
+
+def test_is_bounded():
+    cache = NegativeCache(2)
+    for url in ("a", "b", "c"):
+        cache.put(url, LoaderResult.ERROR_UPSTREAM, 60)
+
+    expect(cache.get("a")).to_be_null()
+    expect(cache.get("c")).to_equal(LoaderResult.ERROR_UPSTREAM)
+    expect(cache).to_length(2)
+
+
+def test_purges_failures():
+    cache = NegativeCache(10)
+    for url in ("a", "b", "c"):
+        cache.put(url, LoaderResult.ERROR_UPSTREAM, 60)
+
+    cache.purge("a")
+    expect(cache.get("a")).to_be_null()
+    expect(cache).to_length(2)
+
+    cache.purge()
+    expect(cache).to_length(0)
+
+
+def test_instances_are_shared():
+    NegativeCache.reset()
+
+    cache = NegativeCache.instance(10)
+
+    expect(NegativeCache.instance(10) is cache).to_be_true()
+
+
+class NegativeCacheLoadTestCase(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        NegativeCache.reset()
+
+    def get_context(self, result, **settings):
+        context = mock.Mock(config=Config(**settings))
+        context.modules.loader.load = mock.AsyncMock(return_value=result)
+
+        return context
+
+    @gen_test
+    async def test_answers_failures_without_loading_again(self):
+        context = self.get_context(
+            LoaderResult(successful=False, error=LoaderResult.ERROR_NOT_FOUND),
+            NEGATIVE_CACHE_NOT_FOUND_SECONDS=60,
+        )
+
+        await negative_cache.load(context, "http://example.com/a.jpg")
+        result = await negative_cache.load(
+            context, "http://example.com/a.jpg"
+        )
+
+        expect(result.successful).to_be_false()
+        expect(result.error).to_equal(LoaderResult.ERROR_NOT_FOUND)
+        expect(context.modules.loader.load.await_count).to_equal(1)
+        context.metrics.incr.assert_called_with(
+            "original_image.negative_cache.hit"
+        )
+
+    @gen_test
+    async def test_only_remembers_errors_with_a_ttl(self):
+        context = self.get_context(
+            LoaderResult(successful=False, error=LoaderResult.ERROR_TIMEOUT),
+            NEGATIVE_CACHE_NOT_FOUND_SECONDS=60,
+        )
+
+        await negative_cache.load(context, "http://example.com/a.jpg")
+        await negative_cache.load(context, "http://example.com/a.jpg")
+
+        expect(context.modules.loader.load.await_count).to_equal(2)
+        expect(negative_cache.for_context(context)).to_length(0)
+
+    @gen_test
+    async def test_does_not_remember_errors_without_origin_reply(self):
+        context = self.get_context(
+            LoaderResult(
+                successful=False,
+                error=LoaderResult.ERROR_TIMEOUT,
+                synthetic=True,
+            ),
+            NEGATIVE_CACHE_TIMEOUT_SECONDS=60,
+        )
+
+        await negative_cache.load(context, "http://example.com/a.jpg")
+        await negative_cache.load(context, "http://example.com/a.jpg")
+
+        expect(context.modules.loader.load.await_count).to_equal(2)
+        expect(negative_cache.for_context(context)).to_length(0)
@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+from preggy import expect
+
+from thumbor.config import Config
+from thumbor.negotiation import (
+    AVIF,
+    JPG,
+    PNG,
+    WEBP,
+    capabilities,
+    parse_accept,
+    variant_key,
+)
+
+
+def test_parses_accept_header():
+    accepts = parse_accept("image/avif,image/webp;q=0.9, */*;q=0.8")
+
+    expect(accepts).to_equal(AVIF | WEBP | JPG)
+    expect(parse_accept("text/html")).to_equal(0)
+    expect(parse_accept("")).to_equal(0)
+
+
+def test_only_keeps_enabled_formats():
+    config = Config(AUTO_WEBP=True, AUTO_PNG=True)
+
+    expect(capabilities(config, AVIF | WEBP | JPG)).to_equal(WEBP)
+    expect(capabilities(config, PNG)).to_equal(PNG)
+    expect(capabilities(Config(), AVIF | WEBP)).to_equal(0)
+
+
+def test_variant_keys():
+    expect(variant_key(0)).to_equal("default")
+    expect(variant_key(WEBP)).to_equal("auto_webp")
+    expect(variant_key(AVIF | WEBP)).to_equal("auto_webp_avif")
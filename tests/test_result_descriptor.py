@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+from os.path import abspath, dirname, join
+
+from preggy import expect
+
+from thumbor.result_descriptor import ResultDescriptor, etag_digests
+
+IMAGES_PATH = join(abspath(dirname(__file__)), "fixtures", "images")
+
+
+def image(name):
+    with open(join(IMAGES_PATH, name), "rb") as image_file:
+        return image_file.read()
+
+
+def test_describes_animated_gif():
+    buffer = image("animated.gif")
+
+    descriptor = ResultDescriptor.for_buffer(buffer, 100, 50)
+
+    expect(descriptor.mime).to_equal("image/gif")
+    expect(descriptor.animated).to_be_true()
+    expect(descriptor.length).to_equal(len(buffer))
+
+
+def test_describes_single_frame_gif():
+    descriptor = ResultDescriptor.for_buffer(image("animated-one-frame.gif"))
+
+    expect(descriptor.animated).to_be_false()
+
+
+def test_round_trips_through_fields():
+    descriptor = ResultDescriptor("image/webp", True, 300, 200, digest=b"ab")
+
+    loaded = ResultDescriptor.from_fields(*descriptor.fields(), length=10)
+
+    expect(loaded.mime).to_equal("image/webp")
+    expect(loaded.animated).to_be_true()
+    expect((loaded.width, loaded.height)).to_equal((300, 200))
+    expect(loaded.length).to_equal(10)
+    expect(loaded.digest).to_equal(b"ab")
+
+
+def test_etag_is_the_digest():
+    descriptor = ResultDescriptor("image/webp", digest=b"\xab\xcd")
+
+    expect(descriptor.etag).to_equal('"abcd"')
+    expect(ResultDescriptor("image/webp").etag).to_be_null()
+
+
+def test_parses_if_none_match():
+    digests = etag_digests('"abcd", W/"0102" , *, "nothex"')
+
+    expect(digests).to_equal(frozenset((b"\xab\xcd", b"\x01\x02")))
+
+
+def test_unknown_mime_is_not_stored():
+    fields = ResultDescriptor("image/unknown").fields()
+
+    expect(ResultDescriptor.from_fields(*fields)).to_be_null()
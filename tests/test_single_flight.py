@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import asyncio
+import os
+
+import pytest
+from preggy import expect
+
+from thumbor.single_flight import FileLock, SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_shares_result_of_running_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def load(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    results = await asyncio.gather(
+        flight.run("a", load, 1),
+        flight.run("a", load, 1),
+        flight.run("b", load, 2),
+    )
+
+    expect(calls).to_equal([1, 2])
+    expect(results).to_equal([(2, False), (2, True), (4, False)])
+    expect(len(flight)).to_equal(0)
+
+
+@pytest.mark.asyncio
+async def test_shares_exception_of_running_call():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise IOError("Boom")
+
+    results = await asyncio.gather(
+        flight.run("a", fail), flight.run("a", fail), return_exceptions=True
+    )
+
+    expect(results[0]).to_be_instance_of(IOError)
+    expect(results[1]).to_equal(results[0])
+
+
+@pytest.mark.asyncio
+async def test_calls_again_once_done():
+    flight = SingleFlight()
+
+    async def load():
+        return "loaded"
+
+    expect(await flight.run("a", load)).to_equal(("loaded", False))
+    expect(await flight.run("a", load)).to_equal(("loaded", False))
+
+
+@pytest.mark.asyncio
+async def test_file_lock_is_exclusive(tmp_path):
+    lock = FileLock(str(tmp_path), "http://example.com/image.jpg")
+    other = FileLock(str(tmp_path), "http://example.com/image.jpg")
+
+    expect(lock.try_acquire()).to_be_true()
+    expect(other.try_acquire()).to_be_false()
+    expect(await other.acquire(0.1)).to_be_false()
+
+    lock.release()
+    expect(os.path.exists(lock.path)).to_be_false()
+    expect(await other.acquire(0.1)).to_be_true()
+    other.release()
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import argparse
+import os
+import sys
+
+from thumbor.cache import prune_cache
+from thumbor.cache.ref_log import FILES_DIR, RefLog
+
+SIZE_UNITS = ("B", "K", "M", "G", "T")
+
+
+def format_size(size):
+    for unit in SIZE_UNITS:
+        if size < 1024 or unit == SIZE_UNITS[-1]:
+            break
+        size /= 1024
+
+    if unit == "B":
+        return f"{int(size)}{unit}"
+
+    return f"{size:.1f}".rstrip("0").rstrip(".") + unit
+
+
+def cache_roots(dir):
+    if os.path.isdir(os.path.join(dir, FILES_DIR)):
+        return [dir]
+
+    with os.scandir(dir) as entries:
+        return sorted(
+            entry.path
+            for entry in entries
+            if entry.is_dir(follow_symlinks=False)
+            and os.path.isdir(os.path.join(entry.path, FILES_DIR))
+        )
+
+
+def print_stats(root, stats, complete):
+    print(root)
+    if not complete:
+        print("  reference log is incomplete, run `thumbor-cache rebuild-refs` for exact numbers")
+
+    print(f"  links: {stats.links}, data files: {stats.blobs}, not linked: {stats.orphans}")
+    print(f"  linked bytes: {stats.logical_bytes}, stored bytes: {stats.stored_bytes}")
+    print(f"  dedup ratio: {stats.dedup_ratio:.2f}, bytes saved: {stats.bytes_saved}")
+    print("  data file sizes:")
+    for bucket in sorted(stats.sizes):
+        print(f"    <= {format_size(1 << bucket):>7}: {stats.sizes[bucket]}")
+
+
+def stats(options):
+    for root in cache_roots(options.dir):
+        ref_log = RefLog(root)
+        print_stats(root, ref_log.stats(), ref_log.is_complete())
+
+
+def rebuild_refs(options):
+    for root in cache_roots(options.dir):
+        print(f"rebuilding reference log of {root}")
+        RefLog(root).rebuild()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="thumbor-cache", description="manage thumbor file caches")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stats_parser = commands.add_parser("stats", help="report how well the cache dedups data files")
+    stats_parser.add_argument("dir", help="cache root, or a directory holding several cache roots")
+    stats_parser.set_defaults(run=stats)
+
+    rebuild_parser = commands.add_parser(
+        "rebuild-refs",
+        help="recreate the reference log from the files on disk, e.g. for caches written by older versions",
+    )
+    rebuild_parser.add_argument("dir", help="cache root, or a directory holding several cache roots")
+    rebuild_parser.set_defaults(run=rebuild_refs)
+
+    prune_parser = commands.add_parser("prune", help="same as python -m thumbor.cache.prune_cache", add_help=False)
+    prune_parser.add_argument("arguments", nargs=argparse.REMAINDER)
+    prune_parser.set_defaults(run=lambda options: prune_cache.main(options.arguments))
+
+    return parser
+
+
+def main(arguments=None):
+    options = get_parser().parse_args(arguments)
+
+    if getattr(options, "dir", None) is not None and not os.path.exists(options.dir):
+        print(f'path {options.dir} does not exist')
+        sys.exit(1)
+
+    options.run(options)
+
+
+if __name__ == "__main__":
+    main()
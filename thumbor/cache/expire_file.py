@@ -8,14 +8,25 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) Mauve Mailorder Software
 
-import os.path
+import math
+import os
+import random
 from datetime import datetime
 
+from thumbor.cache.expire_index import ExpireIndex, ExpireIndexEntry
+
 class ExpireFile:
+    # expiration used to be stored in a sidecar file next to each link,
+    # prune_cache moves those into the index (see migrate). Reads do not
+    # look for them, that would cost every miss a failed open.
+    LEGACY_EXT = ".max_age"
+
     def __init__(self, default_expiration: int = 0):
         self.max_age = default_expiration
         self.max_age_shared = None
         self.change_date = datetime.now()
+        # ResultDescriptor of the entry, if it was stored with one
+        self.descriptor = None
 
 
     def set_max_age(self, val: int):
@@ -27,13 +38,46 @@ class ExpireFile:
 
 
     def load(self, path: str):
-        if not os.path.exists(path):
+        index, name = ExpireIndex.for_link(path)
+        entry = index.get(name)
+        if entry is None:
+            return False
+
+        self.load_entry(entry)
+        return True
+
+
+    def load_entry(self, entry: ExpireIndexEntry):
+        self.change_date = datetime.fromtimestamp(entry.written_at)
+        self.max_age = entry.max_age
+        self.max_age_shared = entry.max_age_shared
+        self.descriptor = entry.descriptor
+
+
+    def migrate(self, path: str):
+        legacy_path = path + self.LEGACY_EXT
+        if not self.load_legacy(legacy_path):
             return False
 
-        self.change_date = datetime.fromtimestamp(os.path.getmtime(path))
+        self.save(path)
 
-        with open(path) as expire_file:
-            content = expire_file.read()
+        try:
+            os.remove(legacy_path)
+        except FileNotFoundError:
+            pass
+
+        return True
+
+
+    def load_legacy(self, path: str):
+        try:
+            with open(path) as expire_file:
+                content = expire_file.read()
+                mtime = os.fstat(expire_file.fileno()).st_mtime
+        except FileNotFoundError:
+            return False
+
+        self.change_date = datetime.fromtimestamp(mtime)
 
         max_ages = content.split(",")
         self.max_age = int(max_ages[0])
@@ -44,26 +88,84 @@ class ExpireFile:
         return True
 
 
-    def save(self, path: str): 
-        with open(path, "wb") as _file:
-            self.__write(_file)
-
-
-    def __write(self, _file):
+    def save(self, path: str):
         max_age = self.max_age
         if max_age is None:
             max_age = 0
 
-        _file.write(str.encode(str(max_age)))
+        index, name = ExpireIndex.for_link(path)
+        index.put(
+            name,
+            ExpireIndexEntry(self.change_date.timestamp(), max_age, self.max_age_shared, self.descriptor),
+        )
 
-        if self.max_age_shared is not None:
-            _file.write(str.encode("," + str(self.max_age_shared)))
 
+    @classmethod
+    def remove(cls, path: str):
+        index, name = ExpireIndex.for_link(path)
+        index.remove(name)
+
+        legacy_path = path + cls.LEGACY_EXT
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+
+    def expires_at(self):
+        ttl = self.max_age_shared if self.max_age_shared is not None else self.max_age
+        if ttl is None:
+            return None
+
+        return self.change_date.timestamp() + ttl
 
-    def is_expired(self):
+
+    def is_expired(self, grace: int = 0):
+        """
+        grace keeps entries that expired less than grace seconds ago.
+        """
         timediff = datetime.now() - self.change_date;
 
         if self.max_age_shared is not None:
-            return timediff.total_seconds() > self.max_age_shared
+            return timediff.total_seconds() > self.max_age_shared + grace
+
+        return self.max_age is None or timediff.total_seconds() > self.max_age + grace
+
+
+    def expired_for(self):
+        """
+        Seconds since the entry expired, 0 while it is fresh.
+        """
+        expires_at = self.expires_at()
+        if expires_at is None:
+            return 0
+
+        return max(datetime.now().timestamp() - expires_at, 0)
+
+
+def expires_early(expires_at: float, window: float, now: float = None):
+    """
+    XFetch: True with a probability that grows as expires_at gets closer,
+    so one reader refreshes the entry before every reader misses at
+    once. window is about how long a refresh takes.
+    """
+    now = now if now is not None else datetime.now().timestamp()
+    # 1 - random() is in (0, 1], so the log is defined
+    return now - window * math.log(1 - random.random()) >= expires_at
+
+
+def jittered(max_age, max_age_shared, jitter: float):
+    """
+    Shortens both ages by the same random fraction, up to jitter, so
+    entries written together do not all expire at the same second.
+    """
+    if jitter <= 0:
+        return max_age, max_age_shared
+
+    factor = 1 - jitter * random.random()
+    return _scaled(max_age, factor), _scaled(max_age_shared, factor)
+
+
+def _scaled(age, factor):
+    if not age or age < 0:
+        return age
 
-        return self.max_age is None or timediff.total_seconds() > self.max_age
+    return max(int(age * factor), 1)
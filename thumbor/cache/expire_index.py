@@ -0,0 +1,288 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import fcntl
+import hashlib
+import os
+import struct
+
+from thumbor.result_descriptor import ResultDescriptor
+
+INDEX_NAME = ".expire_index"
+
+MAGIC = b"TXI1"
+HEADER = struct.Struct("<4sHHII")
+# key, written at, max age, max age shared, then the result
+# descriptor: mime code, flags, digest length, width, height, digest
+SLOT = struct.Struct("<16sdqqBBBxII20s")
+VERSION = 1
+
+EMPTY = bytes(16)
+DELETED = b"\xff" * 16
+NO_VALUE = -(1 << 63)
+NO_DESCRIPTOR = (0, 0, 0, 0, 0, b"")
+
+INITIAL_SLOTS = 16
+
+
+class ExpireIndexEntry:
+    def __init__(self, written_at: float, max_age, max_age_shared, descriptor=None):
+        self.written_at = written_at
+        self.max_age = max_age
+        self.max_age_shared = max_age_shared
+        self.descriptor = descriptor
+
+
+class ExpireIndex:
+    """
+    Open addressing hash table stored in one file per link directory.
+
+    Every slot has a fixed size, so a lookup is an open and two preads
+    (header and slot) instead of a stat, open and parse of a sidecar file
+    per entry. Writers serialize on flock and grow the table by writing a
+    new file and renaming it over the old one.
+    """
+
+    def __init__(self, dir_path: str):
+        self.dir_path = dir_path
+        self.path = os.path.join(dir_path, INDEX_NAME)
+
+
+    @classmethod
+    def for_link(cls, path: str):
+        dir_path, name = os.path.split(path)
+        return cls(dir_path), name
+
+
+    @staticmethod
+    def key(name: str):
+        return hashlib.blake2b(name.encode("utf-8"), digest_size=16).digest()
+
+
+    def get(self, name: str):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+
+        try:
+            header = self._read_header(fd)
+            if header is None:
+                return None
+
+            slot_count, _ = header
+            key = self.key(name)
+            _, slot = self._find(fd, slot_count, key)
+            if slot is None or slot[0] != key:
+                return None
+
+            return self._entry(slot)
+        finally:
+            os.close(fd)
+
+
+    def put(self, name: str, entry: ExpireIndexEntry):
+        fd = self._open_locked()
+        try:
+            header = self._read_header(fd)
+            if header is None:
+                header = self._create(fd)
+
+            slot_count, used = header
+            if (used + 1) * 4 > slot_count * 3:
+                fd = self._grow(fd, slot_count)
+                slot_count, used = self._read_header(fd)
+
+            key = self.key(name)
+            idx, slot = self._find(fd, slot_count, key, for_insert=True)
+            os.pwrite(fd, self._pack(key, entry), self._offset(idx))
+
+            if slot[0] == EMPTY:
+                self._write_header(fd, slot_count, used + 1)
+        finally:
+            os.close(fd)
+
+
+    def remove(self, name: str):
+        if not os.path.exists(self.path):
+            return
+
+        fd = self._open_locked()
+        try:
+            header = self._read_header(fd)
+            if header is None:
+                return
+
+            slot_count, _ = header
+            key = self.key(name)
+            idx, slot = self._find(fd, slot_count, key)
+            if slot is not None and slot[0] == key:
+                # the key comes first in the slot
+                os.pwrite(fd, DELETED, self._offset(idx))
+        finally:
+            os.close(fd)
+
+
+    def entries(self):
+        """
+        Returns every live entry keyed by ExpireIndex.key(name).
+        """
+        try:
+            with open(self.path, "rb") as index_file:
+                data = index_file.read()
+        except FileNotFoundError:
+            return {}
+
+        if len(data) < HEADER.size:
+            return {}
+
+        magic, _, slot_size, slot_count, _ = HEADER.unpack_from(data)
+        if magic != MAGIC or slot_size != SLOT.size:
+            return {}
+
+        result = {}
+        for idx in range(slot_count):
+            offset = self._offset(idx)
+            if offset + SLOT.size > len(data):
+                break
+
+            slot = SLOT.unpack_from(data, offset)
+            if slot[0] in (EMPTY, DELETED):
+                continue
+
+            result[slot[0]] = self._entry(slot)
+
+        return result
+
+
+    def _find(self, fd, slot_count, key, for_insert=False):
+        """
+        Returns the slot holding key, or the slot where key would be
+        inserted. Deleted slots are reused for inserts only.
+        """
+        idx = int.from_bytes(key[:8], "little") % slot_count
+        free = None
+
+        for _ in range(slot_count):
+            slot = SLOT.unpack(os.pread(fd, SLOT.size, self._offset(idx)))
+
+            if slot[0] == key:
+                return idx, slot
+
+            if slot[0] == EMPTY:
+                if for_insert and free is not None:
+                    return free
+
+                return idx, slot
+
+            if slot[0] == DELETED and free is None:
+                free = (idx, slot)
+
+            idx = (idx + 1) % slot_count
+
+        if for_insert and free is not None:
+            return free
+
+        return None, None
+
+
+    def _open_locked(self):
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+            # a concurrent writer may have replaced the file while we waited
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+
+            os.close(fd)
+
+
+    def _read_header(self, fd):
+        data = os.pread(fd, HEADER.size, 0)
+        if len(data) < HEADER.size:
+            return None
+
+        magic, _, slot_size, slot_count, used = HEADER.unpack(data)
+        if magic != MAGIC or slot_size != SLOT.size or slot_count == 0:
+            return None
+
+        return slot_count, used
+
+
+    def _write_header(self, fd, slot_count, used):
+        os.pwrite(fd, HEADER.pack(MAGIC, VERSION, SLOT.size, slot_count, used), 0)
+
+
+    def _create(self, fd):
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, bytes(INITIAL_SLOTS * SLOT.size), HEADER.size)
+        self._write_header(fd, INITIAL_SLOTS, 0)
+        return INITIAL_SLOTS, 0
+
+
+    def _grow(self, fd, slot_count):
+        data = os.pread(fd, slot_count * SLOT.size, HEADER.size)
+        live = [
+            slot
+            for slot in SLOT.iter_unpack(data)
+            if slot[0] not in (EMPTY, DELETED)
+        ]
+
+        # dropping deleted slots may already free enough room
+        new_count = slot_count
+        while (len(live) + 1) * 4 > new_count * 3:
+            new_count *= 2
+
+        table = bytearray(new_count * SLOT.size)
+        for slot in live:
+            idx = int.from_bytes(slot[0][:8], "little") % new_count
+            while table[idx * SLOT.size:idx * SLOT.size + 16] != EMPTY:
+                idx = (idx + 1) % new_count
+            SLOT.pack_into(table, idx * SLOT.size, *slot)
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        new_fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        fcntl.flock(new_fd, fcntl.LOCK_EX)
+        os.pwrite(new_fd, HEADER.pack(MAGIC, VERSION, SLOT.size, new_count, len(live)) + table, 0)
+        os.replace(tmp_path, self.path)
+        os.close(fd)
+
+        return new_fd
+
+
+    @staticmethod
+    def _offset(idx):
+        return HEADER.size + idx * SLOT.size
+
+
+    @staticmethod
+    def _pack(key, entry):
+        return SLOT.pack(
+            key,
+            entry.written_at,
+            NO_VALUE if entry.max_age is None else entry.max_age,
+            NO_VALUE if entry.max_age_shared is None else entry.max_age_shared,
+            *(NO_DESCRIPTOR if entry.descriptor is None else entry.descriptor.fields()),
+        )
+
+
+    @staticmethod
+    def _entry(slot):
+        _, written_at, max_age, max_age_shared, *descriptor = slot
+        return ExpireIndexEntry(
+            written_at,
+            None if max_age == NO_VALUE else max_age,
+            None if max_age_shared == NO_VALUE else max_age_shared,
+            ResultDescriptor.from_fields(*descriptor),
+        )
@@ -8,83 +8,511 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2023 Mauve Mailorder Software 
 
-import hashlib
+import json
 import os
-from thumbor.cache.expire_file import ExpireFile
+import time
+from functools import lru_cache
+from threading import Lock
+from uuid import uuid4
+from thumbor.cache.expire_file import ExpireFile, expires_early, jittered
+from thumbor.cache.hasher import Sha1Hasher
+from thumbor.cache.memory_cache import MemoryCache, MemoryCacheEntry
+from thumbor.cache.ref_log import FILES_DIR, RefLog
 
 from thumbor.utils import logger
 
 class FileCacheResult:
-    def __init__(self, found: bool, data: bytes = bytes(), max_age = None, max_age_shared = None):
+    def __init__(self, found: bool, data: bytes = bytes(), max_age = None, max_age_shared = None, last_modified = None,
+                 stale_for = 0, file = None, size = None, descriptor = None, not_modified = False):
         self.found = found
         self.data = data
         self.max_age = max_age
         self.max_age_shared = max_age_shared
+        self.last_modified = last_modified
+        # seconds since the entry expired, only read with a grace period
+        self.stale_for = stale_for
+        # open file to stream the entry from, data then only holds its head
+        self.file = file
+        self.size = len(data) if size is None else size
+        # ResultDescriptor the entry was put with, if any
+        self.descriptor = None if descriptor is None else descriptor.with_length(self.size)
+        # the entry was not read, the client has it (see read)
+        self.not_modified = not_modified
 
 
 class FileCache:
-    EXPIRE_EXT = ".max_age"
+    EXPIRE_EXT = ExpireFile.LEGACY_EXT
+    TMP_EXT = ".tmp"
+    # number of key -> link path computations remembered per cache
+    LINK_PATH_CACHE_SIZE = 4096
+    # a revalidation not finished after that long may be retried
+    REVALIDATION_TIMEOUT_SECONDS = 60
+    # bytes of a streamed entry read upfront, enough to sniff its type
+    STREAM_HEAD_BYTES = 64
+    # suffix of the small file next to a link holding the validators
+    # of its origin, written and removed along with the link
+    VALIDATORS_EXT = ".validators"
+
+    @classmethod
+    def instance(cls, name: str, base_path: str, default_max_age: int, memory_max_bytes: int = 0,
+                 fsync: bool = False, write_behind=None, link_depth: int = 1, hasher=None,
+                 legacy_hasher=None, jitter: float = 0, early_refresh: float = 0):
+        """
+        Returns the FileCache shared by every request of this process,
+        since storages are recreated for each request.
+        """
+        if not getattr(cls, "_instances", None):
+            cls._instances = {}
+
+        base_path = base_path.rstrip("/")
+        key = (
+            name, base_path, default_max_age, memory_max_bytes, fsync, write_behind, link_depth,
+            getattr(hasher, "name", None), getattr(legacy_hasher, "name", None), jitter, early_refresh,
+        )
+        if key not in cls._instances:
+            cls._instances[key] = FileCache(
+                name, base_path, default_max_age, memory_max_bytes, fsync, write_behind, link_depth,
+                hasher, legacy_hasher, jitter, early_refresh,
+            )
+
+        return cls._instances[key]
+
+
+    @classmethod
+    def reset(cls):
+        cls._instances = None
 
-    def __init__(self, name: str, base_path: str, default_max_age: int):
+
+    def __init__(self, name: str, base_path: str, default_max_age: int, memory_max_bytes: int = 0,
+                 fsync: bool = False, write_behind=None, link_depth: int = 1, hasher=None,
+                 legacy_hasher=None, jitter: float = 0, early_refresh: float = 0):
         self.name = name
-        self.base_path = base_path
+        self.base_path = base_path.rstrip("/")
         self.default_max_age = default_max_age
+        self.fsync = fsync
+        self.write_behind = write_behind
+        self.link_depth = link_depth
+        self.hasher = hasher or Sha1Hasher()
+        # hasher of an older tree in the same root, still read on misses
+        self.legacy_hasher = None
+        if legacy_hasher is not None and legacy_hasher.name != self.hasher.name:
+            self.legacy_hasher = legacy_hasher
+
+        # fraction of the max age entries may be shortened by when written
+        self.jitter = jitter
+        # about how long refreshing an entry takes, see expire_file.expires_early
+        self.early_refresh = early_refresh
+
+        self.ref_log = RefLog(self.base_path)
+        self.ref_log_checked = False
+        self.memory_cache = None
+        if memory_max_bytes:
+            self.memory_cache = MemoryCache.instance(name, self.base_path, memory_max_bytes)
+
+        self.link_path = lru_cache(maxsize=self.LINK_PATH_CACHE_SIZE)(self._link_path)
+        self.revalidations = {}
+        self.revalidations_lock = Lock()
+
+
+    def _link_path(self, key: str, subdir: str = None, hasher=None):
+        """
+        Path of the link for key: the digest of key split into link_depth
+        two character directories and the rest as file name, below
+        subdir if given.
+        """
+        digest = (hasher or self.hasher).hexdigest(key.encode("utf-8"))
+        prefix = self.base_path if subdir is None else f"{self.base_path}/{subdir}"
+        shards = "/".join(digest[i * 2:i * 2 + 2] for i in range(self.link_depth))
+
+        return f"{prefix}/{shards}/{digest[self.link_depth * 2:]}"
+
+
+    def legacy_link_path(self, key: str, subdir: str = None):
+        """
+        Path key had with the legacy hasher, None without one.
+        """
+        if self.legacy_hasher is None:
+            return None
+
+        return self._link_path(key, subdir, self.legacy_hasher)
+
+
+    def claim_revalidation(self, path: str):
+        """
+        Returns True for the one caller that should refresh the stale
+        entry at path. Others get False until it is put again or the
+        claim times out.
+        """
+        now = time.time()
+        with self.revalidations_lock:
+            claimed_at = self.revalidations.get(path)
+            if claimed_at is not None and now - claimed_at < self.REVALIDATION_TIMEOUT_SECONDS:
+                return False
+
+            if len(self.revalidations) >= self.LINK_PATH_CACHE_SIZE:
+                # forget claims of revalidations that failed
+                cutoff = now - self.REVALIDATION_TIMEOUT_SECONDS
+                self.revalidations = {
+                    claimed_path: claimed_at
+                    for claimed_path, claimed_at in self.revalidations.items()
+                    if claimed_at >= cutoff
+                }
+
+            self.revalidations[path] = now
+            return True
+
+
+    def release_revalidation(self, path: str):
+        with self.revalidations_lock:
+            self.revalidations.pop(path, None)
+
+
+    def put(self, path: str, data, max_age: int, max_age_shared, metrics=None, descriptor=None,
+            validators=None):
+        max_age, max_age_shared = jittered(max_age, max_age_shared, self.jitter)
+        expire_file = self.write(path, data, max_age, max_age_shared, descriptor, validators)
+        self.release_revalidation(path)
+
+        if self.memory_cache is not None:
+            self.remember(path, data, expire_file, os.path.getmtime(path), metrics)
+
+
+    def put_behind(self, path: str, data, max_age: int, max_age_shared, metrics=None, descriptor=None,
+                   validators=None):
+        """
+        Like put, but hands the disk write to the write behind threads.
+        The entry is served from memory (if enabled) until it is on disk.
+        Returns False if the write had to be dropped because too many
+        writes are pending.
+        """
+        if self.write_behind is None:
+            self.put(path, data, max_age, max_age_shared, metrics, descriptor, validators)
+            return True
+
+        max_age, max_age_shared = jittered(max_age, max_age_shared, self.jitter)
+        if self.memory_cache is not None:
+            expire_file = ExpireFile(max_age)
+            expire_file.set_max_age_shared(max_age_shared)
+            expire_file.descriptor = descriptor
+            self.remember(path, data, expire_file, time.time(), metrics)
+
+        queued = self.write_behind.submit(
+            self.name, self.write, path, data, max_age, max_age_shared, descriptor, validators
+        )
+        self.release_revalidation(path)
+        if metrics is not None:
+            metrics.incr(f"{self.name.lower()}.write_behind.{'queued' if queued else 'dropped'}")
+
+        return queued
 
 
-    def put(self, path: str, data, max_age: int, max_age_shared):
-        data_file_path = self.data_file_path(data)
+    def write(self, path: str, data, max_age: int, max_age_shared, descriptor=None, validators=None):
+        """
+        Writes the entry at path. validators, when not None, replace the
+        ones of path (see write_validators).
+        """
+        if not self.ref_log_checked:
+            # before the first data file, so a new root gets a complete log
+            self.ref_log.ensure_exists()
+            self.ref_log_checked = True
+
+        digest = self.data_digest(data, descriptor)
+        data_file_path = self.ref_log.data_file_path(digest)
         link_dir = os.path.dirname(path)
         self.ensure_dir(link_dir)
         logger.debug(
             f"[{self.name}] putting at {path} (linked to: {data_file_path})"
         )
         self.ensure_data_file_exists(data_file_path, data)
-        expire_file_path = path + self.EXPIRE_EXT
-        self.write_expire_file(expire_file_path, max_age, max_age_shared)
+        if descriptor is not None:
+            # stored along, so ETags of hits need no hashing
+            descriptor = descriptor.with_digest(digest, self.hasher.name)
+        expire_file = self.write_expire_file(path, max_age, max_age_shared, descriptor)
+        if validators is not None:
+            self.write_validators(path, validators)
+
+        # link under a temporary name and rename over the old link,
+        # so readers either see the old or the new file but never none
+        tmp_path = self.tmp_path(path)
+        os.link(data_file_path, tmp_path)
+        try:
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self.fsync_dir(link_dir)
+        self.ref_log.link(path, digest, len(data))
+        return expire_file
+
+
+    def data_digest(self, data, descriptor=None):
+        """
+        Digest of data, the one of descriptor if it was made by the same
+        hasher: handlers digest new results for their ETag already.
+        """
+        if descriptor is not None and descriptor.digest and descriptor.hasher == self.hasher.name:
+            return descriptor.digest
+
+        return self.hasher.digest(data)
+
+
+    def refresh(self, path: str, max_age: int, max_age_shared, metrics=None, validators=None):
+        """
+        Makes the entry at path fresh for max_age seconds again without
+        writing its data, once its origin said it did not change.
+        Returns False if the entry is gone.
+        """
+        expire_file = ExpireFile(self.default_max_age)
+        if not os.path.exists(path) or not expire_file.load(path):
+            return False
+
+        max_age, max_age_shared = jittered(max_age, max_age_shared, self.jitter)
+        self.write_expire_file(path, max_age, max_age_shared, expire_file.descriptor)
+        if validators is not None:
+            self.write_validators(path, validators)
+        self.release_revalidation(path)
+        if metrics is not None:
+            metrics.incr(f"{self.name.lower()}.refreshed")
+
+        return True
+
+
+    def write_validators(self, path: str, validators: dict):
+        """
+        Stores the headers the origin of the entry at path can revalidate
+        it with (ETag, Last-Modified) in a file next to it. They expire
+        with the entry. Empty validators remove the ones of an older
+        version of the entry, which would not match this one.
+        """
+        validators_path = path + self.VALIDATORS_EXT
+        if not validators:
+            try:
+                os.remove(validators_path)
+            except FileNotFoundError:
+                pass
 
-        if os.path.exists(path):
-            os.remove(path)
+            return
+
+        tmp_path = self.tmp_path(validators_path)
+        try:
+            with open(tmp_path, "w") as validators_file:
+                json.dump(validators, validators_file)
+
+                if self.fsync:
+                    validators_file.flush()
+                    os.fsync(validators_file.fileno())
+
+            os.replace(tmp_path, validators_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
-        os.link(data_file_path, path)
 
+    def get_validators(self, path: str):
+        try:
+            with open(path + self.VALIDATORS_EXT) as validators_file:
+                return json.load(validators_file)
+        except (FileNotFoundError, ValueError):
+            return None
 
-    def get(self, path):
-        exists, max_age, max_age_shared = self.exists(path)
-        if not exists:
+
+    def get(self, path, metrics=None):
+        res = self.get_from_memory(path, metrics)
+        if res is not None:
+            return res
+
+        return self.get_from_disk(path, metrics)
+
+
+    def get_from_memory(self, path, metrics=None):
+        """
+        Returns the entry if the memory tier has it, None otherwise,
+        or a miss if the entry was picked for an early refresh.
+        Never touches the disk, so it is safe to call on the IOLoop.
+        """
+        entry = self.recall(path, metrics)
+        if entry is None:
+            return None
+
+        if self.refreshes_early(path, entry.expires_at, metrics):
             return FileCacheResult(False)
 
-        with open(path, "rb") as source_file:
-            return FileCacheResult(True, source_file.read(), max_age, max_age_shared)
+        return FileCacheResult(
+            True, entry.data, entry.max_age, entry.max_age_shared, entry.last_modified,
+            descriptor=entry.descriptor,
+        )
+
 
+    def get_from_disk(self, path, metrics=None, legacy_path=None, grace=0, stream_min_bytes=0,
+                      if_none_match=frozenset()):
+        """
+        Reads path, or legacy_path (see legacy_link_path) if path is not
+        cached, legacy_path may also be a list of paths read in order.
+        Either way the entry is remembered under path.
+        Entries that expired less than grace seconds ago are returned
+        too, with stale_for set.
+        Fresh entries of at least stream_min_bytes are not read: the
+        result holds the open file instead, which the caller closes.
+        Fresh entries whose digest is in if_none_match are not read
+        either, the result is not_modified and holds no data.
+        """
+        res = self.read(path, path, metrics, grace, stream_min_bytes, if_none_match)
+        legacy_paths = [legacy_path] if isinstance(legacy_path, str) else legacy_path or []
+        for legacy in legacy_paths:
+            if res.found:
+                break
+
+            res = self.read(legacy, path, metrics, grace, stream_min_bytes, if_none_match)
+
+        return res
+
+
+    def read(self, path, memory_path, metrics=None, grace=0, stream_min_bytes=0, if_none_match=frozenset()):
+        expire_file = self.load_expire_file(path, grace)
+        if expire_file is None:
+            return FileCacheResult(False)
+
+        stale_for = expire_file.expired_for() if grace else 0
+        if not stale_for and self.refreshes_early(path, expire_file.expires_at(), metrics):
+            return FileCacheResult(False)
+
+        descriptor = expire_file.descriptor
+        if not stale_for and descriptor is not None and descriptor.digest in if_none_match:
+            try:
+                last_modified = os.path.getmtime(path)
+            except FileNotFoundError:
+                return FileCacheResult(False)
+
+            if metrics is not None:
+                metrics.incr(f"{self.name.lower()}.not_modified")
+
+            return FileCacheResult(
+                True, bytes(), expire_file.max_age, expire_file.max_age_shared, last_modified,
+                descriptor=descriptor, not_modified=True,
+            )
+
+        try:
+            source_file = open(path, "rb")
+        except FileNotFoundError:
+            return FileCacheResult(False)
+
+        try:
+            stat = os.fstat(source_file.fileno())
+            last_modified = stat.st_mtime
+            if stream_min_bytes and stat.st_size >= stream_min_bytes and not stale_for:
+                head = source_file.read(self.STREAM_HEAD_BYTES)
+                res = FileCacheResult(
+                    True, head, expire_file.max_age, expire_file.max_age_shared, last_modified,
+                    file=source_file, size=stat.st_size, descriptor=expire_file.descriptor,
+                )
+                source_file = None
+                return res
+
+            data = source_file.read()
+        finally:
+            if source_file is not None:
+                source_file.close()
+
+        if self.memory_cache is not None and not stale_for:
+            self.remember(memory_path, data, expire_file, last_modified, metrics)
+
+        return FileCacheResult(
+            True, data, expire_file.max_age, expire_file.max_age_shared, last_modified, stale_for,
+            descriptor=expire_file.descriptor,
+        )
 
-    def exists(self, path):
+
+    def exists(self, path, legacy_path=None):
+        if self.memory_cache is not None:
+            entry = self.memory_cache.get(path)
+            if entry is not None:
+                return True, entry.max_age, entry.max_age_shared
+
+        expire_file = self.load_expire_file(path)
+        if expire_file is None or not os.path.exists(path):
+            if legacy_path is not None:
+                return self.exists(legacy_path)
+
+            return False, None, None
+
+        return True, expire_file.max_age, expire_file.max_age_shared
+
+
+    def refreshes_early(self, path, expires_at, metrics=None):
+        if not self.early_refresh or expires_at is None:
+            return False
+
+        if not expires_early(expires_at, self.early_refresh):
+            return False
+
+        logger.debug(f"[{self.name}] refreshing {path} before it expires")
+        if metrics is not None:
+            metrics.incr(f"{self.name.lower()}.early_refresh")
+
+        return True
+
+
+    def recall(self, path, metrics=None):
+        if self.memory_cache is None:
+            return None
+
+        entry = self.memory_cache.get(path)
+        if metrics is not None:
+            metrics.incr(f"{self.name.lower()}.memory_cache.{'hit' if entry else 'miss'}")
+
+        return entry
+
+
+    def remember(self, path, data, expire_file, last_modified, metrics=None):
+        expires_at = expire_file.expires_at()
+        if expires_at is None:
+            return
+
+        entry = MemoryCacheEntry(
+            data,
+            expire_file.max_age,
+            expire_file.max_age_shared,
+            expires_at,
+            last_modified,
+            expire_file.descriptor,
+        )
+        evicted = self.memory_cache.put(path, entry)
+        if evicted and metrics is not None:
+            metrics.incr(f"{self.name.lower()}.memory_cache.eviction", evicted)
+
+
+    def load_expire_file(self, path, grace=0):
         expire_file = ExpireFile(self.default_max_age)
-        if not expire_file.load(path + self.EXPIRE_EXT):
+        if not expire_file.load(path):
             logger.debug(
                 f"[{self.name}] no expire file found for {path}"
             )
-            return False, None, None
+            return None
 
-        if expire_file.is_expired():
+        if expire_file.is_expired(grace):
             logger.debug(
                 f"[{self.name}] cache for {path} is expired"
             )
-            return False, None, None
+            return None
 
         logger.debug(
             f"[{self.name}] found {path} in cache ({expire_file.max_age}, {expire_file.max_age_shared})"
         )
-        return os.path.exists(path), expire_file.max_age, expire_file.max_age_shared
+        return expire_file
 
 
-    def write_expire_file(self, path, max_age, max_age_shared):
+    def write_expire_file(self, path, max_age, max_age_shared, descriptor=None):
         expire_file = ExpireFile(0)
         expire_file.set_max_age(max_age)
+        expire_file.descriptor = descriptor
     
         if max_age_shared is not None:
             expire_file.set_max_age_shared(max_age_shared)
 
         expire_file.save(path)
+        return expire_file
 
 
     def ensure_data_file_exists(self, path, data):
@@ -97,19 +525,44 @@ class FileCache:
         dir = os.path.dirname(path)
         self.ensure_dir(dir)
 
-        with open(path, "wb") as _file:
-            _file.write(data)
+        tmp_path = self.tmp_path(path)
+        try:
+            with open(tmp_path, "wb") as _file:
+                _file.write(data)
 
+                if self.fsync:
+                    _file.flush()
+                    os.fsync(_file.fileno())
 
-    def data_file_path(self, hash_data):
-        digest = hashlib.sha1(hash_data).hexdigest()
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
-        return "%s/files/%s/%s/%s" % (
-            self.base_path,
-            digest[:2],
-            digest[2:4],
-            digest[4:],
-        )
+        self.fsync_dir(dir)
+
+
+    def fsync_dir(self, path):
+        """
+        With fsync, makes the files just renamed into directory path
+        survive a crash as well, not only their contents.
+        """
+        if not self.fsync:
+            return
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def tmp_path(self, path):
+        return f"{path}.{uuid4().hex}{self.TMP_EXT}"
+
+
+    def data_file_path(self, hash_data):
+        return self.ref_log.data_file_path(self.hasher.digest(hash_data))
 
 
     def ensure_dir(self, path):
@@ -123,16 +576,41 @@ class FileCache:
 
 
     def remove_expire_file(self, path):
-        expire_file_path = path + self.EXPIRE_EXT
-        if os.path.exists(expire_file_path):
-            os.remove(expire_file_path)
+        ExpireFile.remove(path)
+
+
+    def remove_variants(self, key: str):
+        """
+        Removes key from every subdir of the root, for caches storing
+        variants of a key side by side in one subdir each.
+        """
+        try:
+            subdirs = [
+                entry.name
+                for entry in os.scandir(self.base_path)
+                if entry.is_dir() and entry.name != FILES_DIR and not entry.name.startswith(".")
+            ]
+        except FileNotFoundError:
+            return
+
+        for subdir in subdirs:
+            self.remove(self.link_path(key, subdir))
+            legacy_path = self.legacy_link_path(key, subdir)
+            if legacy_path is not None:
+                self.remove(legacy_path)
 
 
     def remove(self, path):
         logger.debug(
             f"[{self.name}] delete cache for path {path}"
         )
+        if self.memory_cache is not None:
+            self.memory_cache.remove(path)
+
         if os.path.exists(path):
             os.remove(path)
+            self.ref_log.unlink(path)
 
         self.remove_expire_file(path)
+
+        self.write_validators(path, None)
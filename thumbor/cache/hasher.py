@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import hashlib
+from functools import lru_cache
+
+from thumbor.utils import logger
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+class CacheKeyHasher:
+    """
+    Digest used by FileCache to address link paths and data files.
+    Changing it changes every path, see FileCache's legacy_hasher for
+    reading trees written with another one.
+    """
+
+    name = None
+
+    def digest(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+
+    def hexdigest(self, data: bytes) -> str:
+        return self.digest(data).hex()
+
+
+class Sha1Hasher(CacheKeyHasher):
+    name = "sha1"
+
+    def digest(self, data: bytes) -> bytes:
+        return hashlib.sha1(data).digest()
+
+
+class Blake2bHasher(CacheKeyHasher):
+    name = "blake2b"
+
+    def digest(self, data: bytes) -> bytes:
+        # same length as sha1, so paths keep their shape
+        return hashlib.blake2b(data, digest_size=20).digest()
+
+
+class XXHasher(CacheKeyHasher):
+    name = "xxhash"
+
+    def digest(self, data: bytes) -> bytes:
+        return xxhash.xxh3_128_digest(data)
+
+
+HASHERS = {hasher.name: hasher for hasher in (Sha1Hasher, Blake2bHasher, XXHasher)}
+
+
+@lru_cache(maxsize=None)
+def get_hasher(name: str) -> CacheKeyHasher:
+    """
+    Hasher named name, shared by every FileCache and request: hashers
+    keep no state and the missing xxhash warning is logged only once.
+    """
+    if name is None:
+        return None
+
+    if name not in HASHERS:
+        raise ValueError(f"unknown file cache hasher {name}, use one of {', '.join(HASHERS)}")
+
+    if name == XXHasher.name and xxhash is None:
+        logger.warning("xxhash is not installed, file caches use blake2b instead")
+        return Blake2bHasher()
+
+    return HASHERS[name]()
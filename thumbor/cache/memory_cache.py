@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class MemoryCacheEntry:
+    def __init__(self, data: bytes, max_age, max_age_shared, expires_at, last_modified, descriptor=None):
+        self.data = data
+        self.max_age = max_age
+        self.max_age_shared = max_age_shared
+        self.expires_at = expires_at
+        self.last_modified = last_modified
+        self.descriptor = descriptor
+
+
+    def is_expired(self, now):
+        return self.expires_at is None or now > self.expires_at
+
+
+class MemoryCache:
+    """
+    Byte bounded LRU kept in front of a FileCache, keyed by link path.
+    Instances are shared per process since FileCache objects are not.
+    """
+
+    @classmethod
+    def instance(cls, name: str, base_path: str, max_bytes: int):
+        if not getattr(cls, "_instances", None):
+            cls._instances = {}
+
+        key = (name, base_path, max_bytes)
+        if key not in cls._instances:
+            cls._instances[key] = MemoryCache(max_bytes)
+
+        return cls._instances[key]
+
+
+    @classmethod
+    def reset(cls):
+        cls._instances = None
+
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def get(self, path: str):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.is_expired(time.time()):
+                self._pop(path)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry
+
+
+    def put(self, path: str, entry: MemoryCacheEntry):
+        """
+        Stores entry and returns how many entries were evicted to make room.
+        Entries bigger than the whole budget are not cached at all, but
+        still replace what was cached for path.
+        """
+        size = len(entry.data)
+        evicted = 0
+        with self._lock:
+            self._pop(path)
+            if size > self.max_bytes:
+                return 0
+
+            while self._entries and self.size + size > self.max_bytes:
+                _, oldest = self._entries.popitem(last=False)
+                self.size -= len(oldest.data)
+                evicted += 1
+
+            self._entries[path] = entry
+            self.size += size
+            self.evictions += evicted
+
+        return evicted
+
+
+    def remove(self, path: str):
+        with self._lock:
+            self._pop(path)
+
+
+    def _pop(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.size -= len(entry.data)
@@ -6,73 +6,477 @@
 
 # Licensed under the MIT license:
 # http://www.opensource.org/licenses/mit-license
-# Copyright (c) 2023 Mauve Mailorder Software 
+# Copyright (c) 2023 Mauve Mailorder Software
 
+import argparse
+import json
 import os
-from os.path import isdir
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
 
 from thumbor.cache.expire_file import ExpireFile
+from thumbor.cache.expire_index import INDEX_NAME, ExpireIndex
 from thumbor.cache.file_cache import FileCache
+from thumbor.cache.ref_log import REF_LOG_NAME, RefLog
 
-def prune_file_if_expired(f: str, file_cache: FileCache):
-    expire_file = ExpireFile()
-    if not expire_file.load(f):
-        print(f'could not load expire file: {f}')
-        return
-    
-    if expire_file.is_expired():
-        print(f'delete {f}')
-        file_cache.remove(f.replace(file_cache.EXPIRE_EXT, ""))
+FILES_DIR = "files"
+AGE_BUCKET_SECONDS = 3600
+# temporary files younger than this may still belong to a running write
+TMP_FILE_GRACE_SECONDS = 3600
+MAX_EVICTION_ROUNDS = 3
+SIZE_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
 
 
-def prune_expired_links(dir: str, file_cache: FileCache):
-    print(f'enter directory {dir}')
-    for name in os.listdir(dir):
-        f = os.path.join(dir, name)
+class PruneStats:
+    FIELDS = ("links", "expired", "evicted", "data_files", "orphans", "bytes_freed", "bytes_kept")
 
-        if os.path.isdir(f) and not name == "files":
-            prune_expired_links(f, file_cache)
-            continue
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
 
-        if os.path.isfile(f) and f.endswith(file_cache.EXPIRE_EXT):
-            prune_file_if_expired(f, file_cache)
-            continue
+        # bytes of live links per age bucket, used to find an eviction cutoff
+        self.ages = {}
 
 
-def prune_expired_data_files_in_dir(dir: str):
-    print(f'enter directory {dir}')
-    for name in os.listdir(dir):
-        f = os.path.join(dir, name)
-        if os.path.isdir(f):
-            prune_expired_data_files_in_dir(f)
-            continue
+    def add_age(self, timestamp, size):
+        bucket = int(timestamp // AGE_BUCKET_SECONDS)
+        self.ages[bucket] = self.ages.get(bucket, 0) + size
 
-        stat = os.stat(f)
-        if stat.st_nlink == 1:
-            print(f'delete {f}')
-            os.remove(f)
 
+    def merge(self, other):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
 
-def prune_expired_data_files(dir: str):
-    for name in os.listdir(dir):
-        f = os.path.join(dir, name)
-        if not os.path.isdir(f):
-            continue
+        for bucket, size in other.ages.items():
+            self.ages[bucket] = self.ages.get(bucket, 0) + size
 
-        files_dir = os.path.join(f, "files")
-        if os.path.exists(files_dir):
-            prune_expired_data_files_in_dir(files_dir)
 
+    def to_dict(self):
+        values = {field: getattr(self, field) for field in self.FIELDS}
+        values["ages"] = self.ages
+        return values
 
-dir = sys.argv[1]
-if not os.path.exists(dir):
-    print(f'path {dir} does not exist')
-    os._exit(1)
 
-file_cache = FileCache("", dir, 0)
-print(f'Prune expired links')
-prune_expired_links(dir, file_cache)
+    @classmethod
+    def from_dict(cls, values):
+        stats = cls()
+        for field in cls.FIELDS:
+            setattr(stats, field, values.get(field, 0))
 
-print(f'Prune data files not linked any more')
-prune_expired_data_files(dir)
+        stats.ages = {int(bucket): size for bucket, size in values.get("ages", {}).items()}
+        return stats
+
+
+class Checkpoint:
+    """
+    Append-only log of directories already processed per pass,
+    so an interrupted prune resumes where it stopped.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.done = {}
+        self.lock = Lock()
+
+        if path is None or not os.path.exists(path):
+            return
+
+        with open(path) as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # last line may be truncated if we were killed while writing it
+                    continue
+
+                self.done[(record["pass"], record["dir"])] = PruneStats.from_dict(record["stats"])
+
+
+    def get(self, pass_name, dir):
+        return self.done.get((pass_name, dir))
+
+
+    def mark_done(self, pass_name, dir, stats):
+        if self.path is None:
+            return
+
+        line = json.dumps({"pass": pass_name, "dir": dir, "stats": stats.to_dict()})
+        with self.lock:
+            with open(self.path, "a") as checkpoint_file:
+                checkpoint_file.write(line + "\n")
+
+
+    def clear(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Pruner:
+    def __init__(self, dir: str, workers: int = 4, checkpoint: Checkpoint = None,
+                 max_bytes: int = None, strategy: str = "oldest", verbose: bool = False,
+                 keep_stale: int = 0):
+        self.dir = dir
+        self.workers = workers
+        self.checkpoint = checkpoint or Checkpoint()
+        self.max_bytes = max_bytes
+        self.strategy = strategy
+        self.verbose = verbose
+        # expired entries still served as stale results are kept this long
+        self.keep_stale = keep_stale
+        self.file_caches = {
+            os.path.dirname(files_dir): FileCache("", os.path.dirname(files_dir), 0)
+            for files_dir in self.files_dirs()
+        }
+
+
+    def run(self):
+        total = PruneStats()
+
+        links = self.walk("links", [self.dir], self.prune_links_in_dir)
+        data = self.prune_data_files("data")
+        total.merge(links)
+        total.merge(data)
+        usage = data.bytes_kept
+        ages = links.ages
+
+        rounds = 0
+        while self.max_bytes is not None and usage > self.max_bytes and rounds < MAX_EVICTION_ROUNDS:
+            cutoff = self.eviction_cutoff(ages, usage - self.max_bytes)
+            if cutoff is None:
+                break
+
+            rounds += 1
+            evicted = self.walk(
+                f"evict-{rounds}",
+                [self.dir],
+                lambda dir, cutoff=cutoff: self.prune_links_in_dir(dir, cutoff),
+            )
+            data = self.prune_data_files(f"data-{rounds}")
+
+            total.expired += evicted.expired
+            total.evicted += evicted.evicted
+            total.orphans += data.orphans
+            total.bytes_freed += data.bytes_freed
+            usage = data.bytes_kept
+            ages = evicted.ages
+
+        total.bytes_kept = usage
+        self.checkpoint.clear()
+        return total
+
+
+    def prune_data_files(self, pass_name):
+        """
+        Removes data files no link points to any more. Roots with a
+        complete reference log are collected from the log, the others
+        by walking their files directory.
+        """
+        stats = PruneStats()
+        files_dirs = []
+
+        for root in self.file_caches:
+            ref_log = RefLog(root)
+            if not ref_log.is_complete():
+                files_dirs.append(os.path.join(root, FILES_DIR))
+                ref_log.compact()
+                continue
+
+            deleted, freed = ref_log.compact(collect=True, log=self.log)
+            kept = ref_log.stats()
+            stats.data_files += kept.blobs + deleted
+            stats.orphans += deleted
+            stats.bytes_freed += freed
+            stats.bytes_kept += kept.stored_bytes
+
+        stats.merge(self.walk(pass_name, files_dirs, self.prune_data_files_in_dir))
+        return stats
+
+
+    def walk(self, pass_name, dirs, prune_fn):
+        total = PruneStats()
+        with ThreadPoolExecutor(self.workers) as pool:
+            pending = {pool.submit(self.visit, pass_name, dir, prune_fn) for dir in dirs}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stats, subdirs = future.result()
+                    total.merge(stats)
+                    pending |= {pool.submit(self.visit, pass_name, dir, prune_fn) for dir in subdirs}
+
+        return total
+
+
+    def visit(self, pass_name, dir, prune_fn):
+        stats = self.checkpoint.get(pass_name, dir)
+        if stats is not None:
+            return stats, self.subdirs(dir)
+
+        stats, subdirs = prune_fn(dir)
+        self.checkpoint.mark_done(pass_name, dir, stats)
+        return stats, subdirs
+
+
+    def subdirs(self, dir):
+        with os.scandir(dir) as entries:
+            return [
+                entry.path
+                for entry in entries
+                if entry.is_dir(follow_symlinks=False) and entry.name != FILES_DIR
+            ]
+
+
+    def files_dirs(self):
+        if os.path.isdir(os.path.join(self.dir, FILES_DIR)):
+            return [os.path.join(self.dir, FILES_DIR)]
+
+        with os.scandir(self.dir) as entries:
+            return [
+                os.path.join(entry.path, FILES_DIR)
+                for entry in entries
+                if entry.is_dir(follow_symlinks=False)
+                and os.path.isdir(os.path.join(entry.path, FILES_DIR))
+            ]
+
+
+    def prune_links_in_dir(self, dir, cutoff=None):
+        stats = PruneStats()
+        subdirs = []
+        index_entries = ExpireIndex(dir).entries()
+
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != FILES_DIR:
+                        subdirs.append(entry.path)
+                    continue
+
+                if entry.name.startswith(INDEX_NAME) or entry.name.startswith(REF_LOG_NAME):
+                    continue
+
+                if entry.name.endswith(FileCache.TMP_EXT):
+                    self.remove_stale_tmp_file(entry)
+                    continue
+
+                if entry.name.endswith(ExpireFile.LEGACY_EXT):
+                    link = entry.path[:-len(ExpireFile.LEGACY_EXT)]
+                    expire_file = ExpireFile()
+                    if not expire_file.migrate(link) or not os.path.exists(link):
+                        continue
+                else:
+                    link = entry.path
+                    index_entry = index_entries.get(ExpireIndex.key(entry.name))
+                    if index_entry is None:
+                        continue
+
+                    expire_file = ExpireFile()
+                    expire_file.load_entry(index_entry)
+
+                stats.links += 1
+
+                if expire_file.is_expired(self.keep_stale):
+                    self.remove(link)
+                    stats.expired += 1
+                    continue
+
+                link_stat = None
+                if self.strategy == "lru" or self.max_bytes is not None:
+                    try:
+                        link_stat = os.stat(link)
+                    except FileNotFoundError:
+                        # removed meanwhile by thumbor or another pruner
+                        continue
+
+                timestamp = expire_file.change_date.timestamp()
+                if self.strategy == "lru":
+                    timestamp = link_stat.st_atime
+
+                if cutoff is not None and timestamp < cutoff:
+                    self.remove(link)
+                    stats.evicted += 1
+                    continue
+
+                if self.max_bytes is not None:
+                    stats.add_age(timestamp, link_stat.st_size)
+
+        return stats, subdirs
+
+
+    def prune_data_files_in_dir(self, dir):
+        stats = PruneStats()
+        subdirs = []
+
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+
+                if entry.name.endswith(FileCache.TMP_EXT):
+                    self.remove_stale_tmp_file(entry)
+                    continue
+
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+
+                stats.data_files += 1
+
+                if stat.st_nlink == 1:
+                    self.log(f'delete {entry.path}')
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+
+                    stats.orphans += 1
+                    stats.bytes_freed += stat.st_size
+                else:
+                    stats.bytes_kept += stat.st_size
+
+        return stats, subdirs
+
+
+    def remove_stale_tmp_file(self, entry):
+        try:
+            if entry.stat(follow_symlinks=False).st_mtime > time.time() - TMP_FILE_GRACE_SECONDS:
+                return
+
+            self.log(f'delete {entry.path}')
+            os.remove(entry.path)
+        except FileNotFoundError:
+            # renamed into place or removed by its writer meanwhile
+            pass
+
+
+    def remove(self, link):
+        self.log(f'delete {link}')
+        try:
+            for root, file_cache in self.file_caches.items():
+                if link.startswith(root + "/"):
+                    file_cache.remove(link)
+                    return
+
+            # a link without data files in its root, nothing to account for
+            os.remove(link)
+            ExpireFile.remove(link)
+        except FileNotFoundError:
+            # removed meanwhile by thumbor or another pruner
+            pass
+
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+
+    @staticmethod
+    def eviction_cutoff(ages, excess):
+        """
+        Returns the timestamp before which links have to go to free excess
+        bytes. Links sharing a data file are counted once per link, so a
+        round may free less than expected; run() then does another one.
+        """
+        freed = 0
+        for bucket in sorted(ages):
+            freed += ages[bucket]
+            if freed >= excess:
+                return (bucket + 1) * AGE_BUCKET_SECONDS
+
+        if not ages:
+            return None
+
+        return (max(ages) + 1) * AGE_BUCKET_SECONDS
+
+
+def parse_size(value: str):
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+
+    return int(value)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="prune expired entries from thumbor file caches")
+    parser.add_argument("dir", help="cache root, or a directory holding several cache roots")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of directories pruned in parallel [default: %(default)s].",
+    )
+    parser.add_argument(
+        "-c",
+        "--checkpoint",
+        default=None,
+        help="File used to record progress, so an interrupted run can be resumed "
+        "[default: %(default)s].",
+    )
+    parser.add_argument(
+        "-m",
+        "--max-size",
+        type=parse_size,
+        default=None,
+        help="Evict entries until the data files use less than this size, e.g. 50G "
+        "[default: %(default)s].",
+    )
+    parser.add_argument(
+        "-s",
+        "--strategy",
+        choices=("oldest", "lru"),
+        default="oldest",
+        help="Which entries to evict first when over --max-size. lru relies on "
+        "access times being recorded by the filesystem [default: %(default)s].",
+    )
+    parser.add_argument(
+        "-k",
+        "--keep-stale",
+        type=int,
+        default=0,
+        help="Seconds expired entries are kept for, set it to the larger of "
+        "RESULT_STORAGE_STALE_WHILE_REVALIDATE_SECONDS and "
+        "RESULT_STORAGE_STALE_IF_ERROR_SECONDS [default: %(default)s].",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        default=False,
+        help="Print every deleted file.",
+    )
+    return parser
+
+
+def print_summary(stats: PruneStats, took: float):
+    print(f'links scanned: {stats.links}, expired: {stats.expired}, evicted: {stats.evicted}')
+    print(f'data files scanned: {stats.data_files}, not linked any more: {stats.orphans}')
+    print(f'bytes freed: {stats.bytes_freed}, bytes in use: {stats.bytes_kept}')
+    print(f'took {took:.1f}s')
+
+
+def main(arguments=None):
+    options = get_parser().parse_args(arguments)
+
+    if not os.path.exists(options.dir):
+        print(f'path {options.dir} does not exist')
+        sys.exit(1)
+
+    start = time.time()
+    pruner = Pruner(
+        options.dir,
+        workers=options.workers,
+        checkpoint=Checkpoint(options.checkpoint),
+        max_bytes=options.max_size,
+        strategy=options.strategy,
+        verbose=options.verbose,
+        keep_stale=options.keep_stale,
+    )
+    print_summary(pruner.run(), time.time() - start)
+
+
+if __name__ == "__main__":
+    main()
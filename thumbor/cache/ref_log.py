@@ -0,0 +1,399 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import fcntl
+import hashlib
+import os
+import struct
+from uuid import uuid4
+
+REF_LOG_NAME = ".ref_log"
+FILES_DIR = "files"
+
+MAGIC = b"TRL1"
+HEADER = struct.Struct("<4sHH")
+# op, digest length (0 meaning 20), link key, digest, data file size
+RECORD = struct.Struct("<cB2x16s20sQ")
+
+# the log holds every link of the root, so it can replace a tree walk
+COMPLETE = 1
+
+LINK = b"L"
+UNLINK = b"U"
+BLOB = b"B"
+
+NO_KEY = bytes(16)
+NO_DIGEST = b""
+
+
+def pack(op, key, digest, size):
+    return RECORD.pack(op, len(digest), key, digest, size)
+
+
+class RefStats:
+    def __init__(self):
+        self.links = 0
+        self.blobs = 0
+        self.orphans = 0
+        self.logical_bytes = 0
+        self.stored_bytes = 0
+        # number of blobs per power of two size bucket
+        self.sizes = {}
+
+
+    def add_blob(self, size):
+        self.blobs += 1
+        self.stored_bytes += size
+        bucket = max(size - 1, 0).bit_length()
+        self.sizes[bucket] = self.sizes.get(bucket, 0) + 1
+
+
+    @property
+    def bytes_saved(self):
+        return self.logical_bytes - self.stored_bytes
+
+
+    @property
+    def dedup_ratio(self):
+        if not self.stored_bytes:
+            return 1.0
+
+        return self.logical_bytes / self.stored_bytes
+
+
+class RefState:
+    """
+    Links and blobs of a root, as described by the records of its log.
+    """
+
+    def __init__(self):
+        self.links = {}
+        self.blobs = {}
+        # inode of the log file the records were read from
+        self.inode = None
+
+
+    def apply(self, record):
+        op, digest_size, key, digest, size = record
+        digest = digest[:digest_size or 20]
+
+        if op == LINK:
+            self.links[key] = digest
+            self.blobs[digest] = size
+        elif op == UNLINK:
+            self.links.pop(key, None)
+        elif op == BLOB:
+            self.blobs[digest] = size
+
+
+    def ref_counts(self):
+        counts = dict.fromkeys(self.blobs, 0)
+        for digest in self.links.values():
+            if digest in counts:
+                counts[digest] += 1
+
+        return counts
+
+
+    def records(self):
+        for key, digest in self.links.items():
+            yield pack(LINK, key, digest, self.blobs.get(digest, 0))
+
+        linked = set(self.links.values())
+        for digest, size in self.blobs.items():
+            if digest not in linked:
+                yield pack(BLOB, NO_KEY, digest, size)
+
+
+class RefLog:
+    """
+    Append-only log of the links FileCache creates and removes in a
+    root, and of the data files they point to.
+
+    Replaying it tells which data files are not linked any more without
+    walking the files tree, and how much the dedup saves. Writers append
+    fixed size records under a shared flock; compaction rewrites the log
+    under an exclusive one and renames it into place.
+    """
+
+    def __init__(self, root: str):
+        self.root = root.rstrip("/")
+        self.path = os.path.join(self.root, REF_LOG_NAME)
+        self.files_prefix = os.path.join(self.root, FILES_DIR) + "/"
+
+
+    def key(self, link_path: str):
+        name = os.path.relpath(link_path, self.root)
+        return hashlib.blake2b(name.encode("utf-8"), digest_size=16).digest()
+
+
+    def data_file_path(self, digest: bytes):
+        hex_digest = digest.hex()
+        return f"{self.files_prefix}{hex_digest[:2]}/{hex_digest[2:4]}/{hex_digest[4:]}"
+
+
+    def ensure_exists(self):
+        """
+        Creates the log. It is complete if nothing was cached in the
+        root before, otherwise only `rebuild` can make it complete.
+        """
+        if os.path.exists(self.path):
+            return
+
+        files_dir = os.path.join(self.root, FILES_DIR)
+        complete = not os.path.isdir(files_dir) or not os.listdir(files_dir)
+        self._create(COMPLETE if complete else 0)
+
+
+    def is_complete(self):
+        try:
+            with open(self.path, "rb") as log_file:
+                header = self._read_header(log_file.read(HEADER.size))
+        except FileNotFoundError:
+            return False
+
+        return header is not None and header & COMPLETE == COMPLETE
+
+
+    def link(self, link_path: str, digest: bytes, size: int):
+        self.append(pack(LINK, self.key(link_path), digest, size))
+
+
+    def unlink(self, link_path: str):
+        self.append(pack(UNLINK, self.key(link_path), NO_DIGEST, 0))
+
+
+    def append(self, record: bytes):
+        while True:
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+            except FileNotFoundError:
+                self._create(0)
+                continue
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+
+                # compaction may have replaced the log while we waited
+                try:
+                    if os.stat(self.path).st_ino != os.fstat(fd).st_ino:
+                        continue
+                except FileNotFoundError:
+                    continue
+
+                os.write(fd, record)
+                return
+            finally:
+                os.close(fd)
+
+
+    def replay(self, state=None, offset=None):
+        """
+        Applies the records from offset on to state.
+        Returns the state, the offset it stopped at and the log flags.
+        """
+        state = state or RefState()
+        try:
+            with open(self.path, "rb") as log_file:
+                flags = self._read_header(log_file.read(HEADER.size))
+                if flags is None:
+                    return state, HEADER.size, 0
+
+                if state.inode != os.fstat(log_file.fileno()).st_ino:
+                    # the log was compacted since, start over
+                    state, offset = RefState(), None
+                    state.inode = os.fstat(log_file.fileno()).st_ino
+
+                log_file.seek(offset or HEADER.size)
+                data = log_file.read()
+        except FileNotFoundError:
+            return state, HEADER.size, 0
+
+        # a record may still be being written, leave it for the next replay
+        usable = len(data) - len(data) % RECORD.size
+        for record in RECORD.iter_unpack(data[:usable]):
+            state.apply(record)
+
+        return state, (offset or HEADER.size) + usable, flags
+
+
+    def stats(self):
+        state, _, _ = self.replay()
+        counts = state.ref_counts()
+        stats = RefStats()
+
+        for digest, size in state.blobs.items():
+            stats.add_blob(size)
+            stats.links += counts[digest]
+            stats.logical_bytes += counts[digest] * size
+            if counts[digest] == 0:
+                stats.orphans += 1
+
+        return stats
+
+
+    def compact(self, collect=False, log=None):
+        """
+        Rewrites the log with one record per live link and data file.
+        With collect, data files no link refers to are deleted first.
+        Returns the (count, bytes) of the deleted data files.
+        """
+        state, offset, flags = self.replay()
+
+        deleted, freed = 0, 0
+        if collect:
+            deleted, freed = self._collect(state, log)
+
+        fd = self._open_locked()
+        try:
+            # pick up what was appended while we were collecting
+            state, _, _ = self.replay(state, offset)
+            self._write(state.records(), flags)
+        finally:
+            os.close(fd)
+
+        return deleted, freed
+
+
+    def rebuild(self):
+        """
+        Recreates a complete log from the files on disk, by matching the
+        inodes of links with the inodes of data files.
+        """
+        state, offset, _ = self.replay()
+        inode = state.inode
+        state = RefState()
+        state.inode = inode
+        inodes = {}
+
+        for dir_path, _, names in os.walk(os.path.join(self.root, FILES_DIR)):
+            for name in names:
+                path = os.path.join(dir_path, name)
+                try:
+                    digest = bytes.fromhex(os.path.relpath(path, self.files_prefix).replace("/", ""))
+                    stat = os.stat(path)
+                except ValueError:
+                    continue
+                except FileNotFoundError:
+                    continue
+
+                inodes[stat.st_ino] = digest
+                state.blobs[digest] = stat.st_size
+
+        for dir_path, dir_names, names in os.walk(self.root):
+            if dir_path == self.root and FILES_DIR in dir_names:
+                dir_names.remove(FILES_DIR)
+
+            for name in names:
+                if name.startswith(".") or name.endswith(".tmp"):
+                    continue
+
+                path = os.path.join(dir_path, name)
+                try:
+                    digest = inodes.get(os.stat(path).st_ino)
+                except FileNotFoundError:
+                    continue
+
+                if digest is not None:
+                    state.links[self.key(path)] = digest
+
+        fd = self._open_locked()
+        try:
+            state, _, _ = self.replay(state, offset)
+            self._write(state.records(), COMPLETE)
+        finally:
+            os.close(fd)
+
+
+    def _collect(self, state, log):
+        deleted, freed = 0, 0
+        for digest, count in state.ref_counts().items():
+            if count:
+                continue
+
+            path = self.data_file_path(digest)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                state.blobs.pop(digest)
+                continue
+
+            # linked by something the log did not see, keep it
+            if stat.st_nlink > 1:
+                continue
+
+            if log is not None:
+                log(f"delete {path}")
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            state.blobs.pop(digest)
+            deleted += 1
+            freed += stat.st_size
+
+        return deleted, freed
+
+
+    def _create(self, flags):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.path}.{uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as log_file:
+            log_file.write(HEADER.pack(MAGIC, 1, flags))
+
+        # linking fails if another process created the log meanwhile
+        try:
+            os.link(tmp_path, self.path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+
+
+    def _open_locked(self):
+        while True:
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except FileNotFoundError:
+                self._create(0)
+                continue
+
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+
+            os.close(fd)
+
+
+    def _write(self, records, flags):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as log_file:
+            log_file.write(HEADER.pack(MAGIC, 1, flags))
+            for record in records:
+                log_file.write(record)
+
+        os.replace(tmp_path, self.path)
+
+
+    @staticmethod
+    def _read_header(data):
+        if len(data) < HEADER.size:
+            return None
+
+        magic, _, flags = HEADER.unpack(data)
+        if magic != MAGIC:
+            return None
+
+        return flags
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from thumbor.utils import logger
+
+
+class WriteBehind:
+    """
+    Runs cache writes on dedicated threads. At most queue_size writes may
+    be pending; further writes are refused so callers never wait for disk.
+    """
+
+    @classmethod
+    def instance(cls, threads: int, queue_size: int):
+        if not getattr(cls, "_instances", None):
+            cls._instances = {}
+
+        key = (threads, queue_size)
+        if key not in cls._instances:
+            cls._instances[key] = WriteBehind(threads, queue_size)
+
+        return cls._instances[key]
+
+
+    @classmethod
+    def for_config(cls, config):
+        if not config.FILE_CACHE_WRITE_BEHIND_QUEUE_SIZE:
+            return None
+
+        return cls.instance(
+            config.FILE_CACHE_WRITE_BEHIND_THREADS,
+            config.FILE_CACHE_WRITE_BEHIND_QUEUE_SIZE,
+        )
+
+
+    @classmethod
+    def reset(cls):
+        for instance in (getattr(cls, "_instances", None) or {}).values():
+            instance.shutdown()
+
+        cls._instances = None
+
+
+    def __init__(self, threads: int, queue_size: int):
+        self.queue_size = queue_size
+        self.pending = 0
+        self._lock = Lock()
+        self._pool = ThreadPoolExecutor(
+            max(threads, 1), thread_name_prefix="thumbor-cache-writer"
+        )
+
+
+    def submit(self, name: str, operation, *args):
+        with self._lock:
+            if self.pending >= self.queue_size:
+                return False
+
+            self.pending += 1
+
+        future = self._pool.submit(operation, *args)
+        future.add_done_callback(lambda f: self._done(name, f))
+        return True
+
+
+    def _done(self, name, future):
+        with self._lock:
+            self.pending -= 1
+
+        error = future.exception()
+        if error is not None:
+            logger.error(f"[{name}] error persisting cache item: {error}")
+
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -158,6 +158,15 @@ Config.define(
     "Imaging",
 )
 
+Config.define(
+    "MAX_BYTES_ENCODE_BUDGET",
+    6,
+    "Maximum number of times an image is encoded again to fit the size "
+    "given to the max_bytes filter. The best quality that fit within that "
+    "many attempts is used.",
+    "Imaging",
+)
+
 Config.define(
     "SRGB_PROFILE",
     None,
@@ -325,6 +334,16 @@ Config.define(
     "Imaging",
 )
 
+Config.define(
+    "FILE_IO_THREADPOOL_SIZE",
+    0,
+    "Size of the thread pool the file storages and result storages use to "
+    "read and write to disk, separate from ENGINE_THREADPOOL_SIZE. "
+    "The default value is 0 (disk access happens on the IOLoop). "
+    "Increase this if slow disks are blocking your IOLoop",
+    "Performance",
+)
+
 Config.define(
     "METRICS",
     "thumbor.metrics.logger_metrics",
@@ -397,6 +416,50 @@ Config.define(
     "Set maximum id length for images when stored",
     "Storage",
 )
+Config.define(
+    "ORIGINAL_FETCH_LOCK_DIR",
+    None,
+    "Directory of the lock files worker processes use to take turns "
+    "loading the same original, so it is loaded once per host instead of "
+    "once per process. Requests of the same process always share one "
+    "load. None disables the lock files",
+    "Performance",
+)
+Config.define(
+    "ORIGINAL_FETCH_LOCK_TIMEOUT",
+    20,
+    "Seconds a process waits for another one to load an original before "
+    "loading it itself",
+    "Performance",
+)
+Config.define(
+    "NEGATIVE_CACHE_NOT_FOUND_SECONDS",
+    0,
+    "Seconds a failure to load an original because it was not found is "
+    "remembered for. Requests for it fail at once meanwhile. 0 disables it",
+    "Performance",
+)
+Config.define(
+    "NEGATIVE_CACHE_UPSTREAM_SECONDS",
+    0,
+    "Seconds a failure to load an original because of its origin (a 502) is "
+    "remembered for. 0 disables it",
+    "Performance",
+)
+Config.define(
+    "NEGATIVE_CACHE_TIMEOUT_SECONDS",
+    0,
+    "Seconds a failure to load an original because its origin timed out (a 504) "
+    "is remembered for. 0 disables it",
+    "Performance",
+)
+Config.define(
+    "NEGATIVE_CACHE_MAX_ENTRIES",
+    10000,
+    "Max failures to load originals remembered by each process, the least "
+    "recent ones are forgotten first",
+    "Performance",
+)
 Config.define(
     "GC_INTERVAL",
     None,
@@ -548,6 +611,61 @@ Config.define(
     + "are set, then this is the limit in bytes per second as integer which should "
     + "timeout if the speed is below that limit for HTTP_LOADER_CURL_LOW_SPEED_TIME seconds",
 )
+Config.define(
+    "HTTP_LOADER_MAX_CONNECTIONS_PER_HOST",
+    0,
+    "With HTTP_LOADER_CURL_ASYNC_HTTP_CLIENT, the maximum number of connections "
+    "kept open to one host. Loads beyond it wait for a connection of that host "
+    "to be free. 0 means no limit",
+    "HTTP Loader",
+)
+Config.define(
+    "HTTP_LOADER_KEEP_ALIVE_SECONDS",
+    0,
+    "With HTTP_LOADER_CURL_ASYNC_HTTP_CLIENT, connections idle for longer than "
+    "that are closed instead of being reused. 0 keeps the libcurl default. "
+    "The default client opens a connection per load",
+    "HTTP Loader",
+)
+Config.define(
+    "HTTP_LOADER_MAX_BODY_BYTES",
+    0,
+    "If set, images are downloaded in chunks and loads of images larger than "
+    "that many bytes, or of more than MAX_PIXELS pixels according to their "
+    "header, are aborted as soon as that is known. 0 means no limit",
+    "HTTP Loader",
+)
+Config.define(
+    "HTTP_LOADER_MAX_LOADS_PER_HOST",
+    0,
+    "The maximum number of simultaneous loads from one host. Further loads of "
+    "that host wait without taking one of HTTP_LOADER_MAX_CLIENTS, and time out "
+    "after HTTP_LOADER_REQUEST_TIMEOUT. 0 means no limit",
+    "HTTP Loader",
+)
+Config.define(
+    "HTTP_LOADER_MIN_REQUEST_TIMEOUT",
+    0,
+    "If set, the request timeout of a host adapts to its observed latency, "
+    "from this many seconds up to HTTP_LOADER_REQUEST_TIMEOUT. "
+    "0 always uses HTTP_LOADER_REQUEST_TIMEOUT",
+    "HTTP Loader",
+)
+Config.define(
+    "HTTP_LOADER_CIRCUIT_BREAKER_FAILURES",
+    0,
+    "After that many consecutive 5xx responses or timeouts from a host, loads "
+    "from it fail fast with a 502 or a 504 instead of being requested. "
+    "0 disables it",
+    "HTTP Loader",
+)
+Config.define(
+    "HTTP_LOADER_CIRCUIT_BREAKER_SECONDS",
+    30,
+    "How long loads from a failing host fail fast before a single load is "
+    "requested again to probe it",
+    "HTTP Loader",
+)
 
 # FILE STORAGE GENERIC OPTIONS
 Config.define(
@@ -741,6 +859,135 @@ Config.define(
     "Result Storage",
 )
 
+# FILE CACHE OPTIONS
+Config.define(
+    "STORAGE_MEMORY_CACHE_MAX_BYTES",
+    0,
+    "Max bytes kept in memory by thumbor.storages.file_storage_cache_control "
+    "in front of the files on disk. 0 disables the memory cache",
+    "File Cache",
+)
+Config.define(
+    "RESULT_STORAGE_MEMORY_CACHE_MAX_BYTES",
+    0,
+    "Max bytes kept in memory by thumbor.result_storages.file_storage_cache_control "
+    "in front of the files on disk. 0 disables the memory cache",
+    "File Cache",
+)
+Config.define(
+    "FILE_CACHE_FSYNC",
+    False,
+    "Indicates whether the file caches should fsync data files before "
+    "renaming them into place",
+    "File Cache",
+)
+Config.define(
+    "FILE_CACHE_WRITE_BEHIND_QUEUE_SIZE",
+    0,
+    "Max number of file cache writes waiting for the write behind threads. "
+    "Writes beyond that are dropped instead of blocking the request. "
+    "0 writes synchronously",
+    "File Cache",
+)
+Config.define(
+    "FILE_CACHE_WRITE_BEHIND_THREADS",
+    1,
+    "Number of threads writing file cache entries to disk",
+    "File Cache",
+)
+Config.define(
+    "RESULT_STORAGE_STALE_WHILE_REVALIDATE_SECONDS",
+    0,
+    "For how many seconds after they expired "
+    "thumbor.result_storages.file_storage_cache_control still serves results "
+    "(with X-Thumbor-Cache-Status: stale) while one request per result "
+    "regenerates them in the background. 0 disables it",
+    "File Cache",
+)
+Config.define(
+    "RESULT_STORAGE_STALE_IF_ERROR_SECONDS",
+    0,
+    "For how many seconds after they expired "
+    "thumbor.result_storages.file_storage_cache_control serves results if "
+    "regenerating them fails with a 5xx error. 0 disables it",
+    "File Cache",
+)
+Config.define(
+    "RESULT_STORAGE_STREAMING_MIN_BYTES",
+    0,
+    "Results of at least that many bytes found by "
+    "thumbor.result_storages.file_storage_cache_control are streamed from "
+    "disk in RESULT_STORAGE_STREAMING_CHUNK_BYTES chunks instead of being "
+    "read into memory, and Range requests for them are honored. "
+    "0 disables streaming",
+    "File Cache",
+)
+Config.define(
+    "RESULT_STORAGE_STREAMING_CHUNK_BYTES",
+    64 * 1024,
+    "Size of the chunks streamed results are read and sent in",
+    "File Cache",
+)
+Config.define(
+    "STORAGE_EXPIRATION_JITTER",
+    0,
+    "Fraction (0 to 1) of STORAGE_EXPIRATION_SECONDS that entries written by "
+    "thumbor.storages.file_storage_cache_control may randomly be shortened "
+    "by, so entries written together do not expire together. 0 disables it",
+    "File Cache",
+)
+Config.define(
+    "RESULT_STORAGE_EXPIRATION_JITTER",
+    0,
+    "Fraction (0 to 1) of the max age that results written by "
+    "thumbor.result_storages.file_storage_cache_control may randomly be "
+    "shortened by. 0 disables it",
+    "File Cache",
+)
+Config.define(
+    "STORAGE_EARLY_REFRESH_SECONDS",
+    0,
+    "About how long fetching an original takes. Readers of "
+    "thumbor.storages.file_storage_cache_control entries close to their "
+    "expiration randomly treat them as expired, so one of them refreshes "
+    "the entry before everyone misses at once. Larger values refresh "
+    "earlier. 0 disables it",
+    "File Cache",
+)
+Config.define(
+    "STORAGE_REVALIDATION_SECONDS",
+    0,
+    "How long after they expire originals stored by "
+    "thumbor.storages.file_storage_cache_control are revalidated instead of "
+    "loaded again: thumbor.loaders.http_loader_cache_control asks their origin "
+    "with If-None-Match or If-Modified-Since, and a 304 refreshes them without "
+    "transferring them. Prune with --keep-stale at least that long. 0 disables it",
+    "File Cache",
+)
+Config.define(
+    "RESULT_STORAGE_EARLY_REFRESH_SECONDS",
+    0,
+    "About how long generating a result takes, see "
+    "STORAGE_EARLY_REFRESH_SECONDS. 0 disables it",
+    "File Cache",
+)
+Config.define(
+    "FILE_CACHE_HASHER",
+    "sha1",
+    "Digest the file caches use to name links and data files: sha1, blake2b "
+    "or xxhash (needs the xxhash package, falls back to blake2b). Changing it "
+    "moves every entry to a new path, see FILE_CACHE_LEGACY_HASHER",
+    "File Cache",
+)
+Config.define(
+    "FILE_CACHE_LEGACY_HASHER",
+    "sha1",
+    "Digest of entries written before FILE_CACHE_HASHER was changed. They are "
+    "still read on misses until they expire. Set to None once they are gone "
+    "to save the extra lookup",
+    "File Cache",
+)
+
 # QUEUED DETECTOR REDIS OPTIONS
 Config.define(
     "REDIS_QUEUE_SERVER_HOST",
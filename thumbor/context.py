@@ -10,8 +10,10 @@
 
 from os.path import abspath, exists
 
+from thumbor.file_io import FileIO
 from thumbor.filters import FiltersFactory
 from thumbor.metrics.logger_metrics import Metrics
+from thumbor.negotiation import WEBP, parse_accept
 from thumbor.threadpool import ThreadPool
 
 
@@ -25,11 +27,17 @@ class Context:  # pylint: disable=too-many-instance-attributes
     * Request Parameters (width, height, smart, meta, etc).
 
     Each instance of this class MUST be unique per request.
-    This class should not be cached in the server.
+    This class should not be cached in the server, pass filters_factory
+    to share the one of the server context instead of building it again.
     """
 
     def __init__(
-        self, server=None, config=None, importer=None, request_handler=None
+        self,
+        server=None,
+        config=None,
+        importer=None,
+        request_handler=None,
+        filters_factory=None,
     ):
         self.server = server
         self.config = config
@@ -56,13 +64,16 @@ class Context:  # pylint: disable=too-many-instance-attributes
         ):
             self.app_class = self.server.app_class
 
-        self.filters_factory = FiltersFactory(
+        self.filters_factory = filters_factory or FiltersFactory(
             self.modules.filters if self.modules else []
         )
         self.request_handler = request_handler
         self.thread_pool = ThreadPool.instance(
             getattr(config, "ENGINE_THREADPOOL_SIZE", 0)
         )
+        self.file_io = FileIO.instance(
+            getattr(config, "FILE_IO_THREADPOOL_SIZE", 0)
+        )
         self.headers = {}
 
     def __enter__(self):
@@ -73,6 +84,7 @@ class Context:  # pylint: disable=too-many-instance-attributes
             self.modules.cleanup()
 
         self.thread_pool.cleanup()
+        self.file_io.cleanup()
 
 
 class ServerParameters:  # pylint: disable=too-many-instance-attributes
@@ -244,12 +256,20 @@ class RequestParameters:  # pylint: disable=too-few-public-methods,too-many-inst
         self.bypass_cache = bypass_cache
         self.cache_status = cache_status
         self.headers = None
+        # ResultDescriptor of the generated result
+        self.result_descriptor = None
+        # expired original the loader may revalidate (a StaleOriginal),
+        # and the validators of the loaded one, for the storage
+        self.stale_original = None
+        self.original_validators = None
+
+        # formats of thumbor.negotiation accepted by the client
+        self.accepts = WEBP if accepts_webp else 0
 
         if request:
             self.url = request.path
-            self.accepts_webp = "image/webp" in request.headers.get(
-                "Accept", ""
-            )
+            self.accepts = parse_accept(request.headers.get("Accept", ""))
+            self.accepts_webp = bool(self.accepts & WEBP)
             if request.headers:
                 self.headers = request.headers
 
@@ -259,35 +279,23 @@ class RequestParameters:  # pylint: disable=too-few-public-methods,too-many-inst
 
 
 class ContextImporter:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    # modules instantiated with the context. They are created the first
+    # time they are used, since most requests only need a few of them
+    # (a result storage hit needs neither engine nor storage).
+    LAZY_MODULES = (
+        "engine",
+        "gif_engine",
+        "storage",
+        "result_storage",
+        "upload_photo_storage",
+        "compatibility_legacy_storage",
+        "compatibility_legacy_result_storage",
+    )
+
     def __init__(self, context, importer):
         self.context = context
         self.importer = importer
 
-        self.engine = None
-
-        if importer.engine:
-            self.engine = importer.engine(context)
-
-        self.gif_engine = None
-
-        if importer.gif_engine:
-            self.gif_engine = importer.gif_engine(context)
-
-        self.storage = None
-
-        if importer.storage:
-            self.storage = importer.storage(context)
-
-        self.result_storage = None
-
-        if importer.result_storage:
-            self.result_storage = importer.result_storage(context)
-
-        self.upload_photo_storage = None
-
-        if importer.upload_photo_storage:
-            self.upload_photo_storage = importer.upload_photo_storage(context)
-
         self.loader = importer.loader
         self.detectors = importer.detectors
         self.filters = importer.filters
@@ -296,20 +304,24 @@ class ContextImporter:  # pylint: disable=too-few-public-methods,too-many-instan
 
         self.compatibility_legacy_loader = importer.compatibility_legacy_loader
 
-        self.compatibility_legacy_storage = None
+    def __getattr__(self, name):
+        # only called for attributes not set yet
+        if name not in ContextImporter.LAZY_MODULES:
+            raise AttributeError(name)
 
-        if importer.compatibility_legacy_storage is not None:
-            self.compatibility_legacy_storage = (
-                importer.compatibility_legacy_storage(context)
-            )
+        module = getattr(self.importer, name)
+        instance = None
 
-        self.compatibility_legacy_result_storage = None
+        if module is not None:
+            instance = module(self.context)
 
-        if importer.compatibility_legacy_result_storage is not None:
-            self.compatibility_legacy_result_storage = (
-                importer.compatibility_legacy_result_storage(context)
-            )
+        setattr(self, name, instance)
+
+        return instance
 
     def cleanup(self):
-        if self.engine:
-            self.engine.cleanup()
+        # an engine that was never used has nothing to clean up
+        engine = self.__dict__.get("engine")
+
+        if engine:
+            engine.cleanup()
@@ -105,6 +105,7 @@ class BaseEngine:
         self.icc_profile = None
         self.frame_count = 1
         self.metadata = None
+        self._transparent = None
 
     @classmethod
     def get_mimetype(cls, buffer):
@@ -190,6 +191,7 @@ class BaseEngine:
 
     def load(self, buffer, extension):
         self.extension = extension
+        self._transparent = None
 
         if extension is None:
             mime = self.get_mimetype(buffer)
@@ -225,6 +227,17 @@ class BaseEngine:
         if self.source_height is None:
             self.source_height = self.size[1]
 
+    @property
+    def transparent(self):
+        """
+        has_transparency() of the image, computed once: it may have to
+        read every pixel.
+        """
+        if self._transparent is None:
+            self._transparent = self.has_transparency()
+
+        return self._transparent
+
     @property
     def size(self):
         if self.is_multiple():
@@ -421,7 +434,7 @@ class BaseEngine:
         pass
 
     def can_auto_convert_png_to_jpg(self):
-        can_convert = self.extension == ".png" and not self.has_transparency()
+        can_convert = self.extension == ".png" and not self.transparent
 
         return can_convert
 
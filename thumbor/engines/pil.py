@@ -509,10 +509,11 @@ class Engine(BaseEngine):
         if has_transparency:
             # If the image has alpha channel,
             # we check for any pixels that are not opaque (255)
-            has_transparency = (
-                min(self.image.convert("RGBA").getchannel("A").getextrema())
-                < 255
-            )
+            image = self.image
+            if image.mode not in ("RGBA", "LA"):
+                image = image.convert("RGBA")
+
+            has_transparency = min(image.getchannel("A").getextrema()) < 255
 
         return has_transparency
 
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.ioloop import IOLoop
+
+from thumbor.utils import logger
+
+
+class FileIO:
+    """
+    Thread pool the file based storages run their blocking disk access on,
+    so a slow disk does not stall the IOLoop. Kept apart from the engine
+    thread pool, so disk waits never queue behind image operations.
+    """
+
+    @classmethod
+    def instance(cls, size):
+        if not getattr(cls, "_instance", None):
+            cls._instance = {}
+        if size not in cls._instance:
+            cls._instance[size] = FileIO(size)
+        return cls._instance[size]
+
+    @classmethod
+    def reset(cls):
+        for instance in list((getattr(cls, "_instance", None) or {}).values()):
+            instance.cleanup()
+        cls._instance = None
+
+    def __init__(self, thread_pool_size):
+        self.size = thread_pool_size
+        if thread_pool_size:
+            self.pool = ThreadPoolExecutor(
+                thread_pool_size, thread_name_prefix="thumbor-file-io"
+            )
+        else:
+            self.pool = None
+
+    async def run(self, name, operation, *args, metrics=None):
+        """
+        Runs operation(*args) on the pool and reports how long it took,
+        including the time spent waiting for a free thread, as the
+        `name` timing metric.
+        """
+        start = time.perf_counter()
+        try:
+            if not self.pool:
+                return operation(*args)
+
+            return await IOLoop.current().run_in_executor(
+                self.pool, operation, *args
+            )
+        finally:
+            if metrics is not None:
+                metrics.timing(name, (time.perf_counter() - start) * 1000)
+
+    def cleanup(self):
+        # shared per process: later contexts get a new pool, not this one
+        instances = getattr(FileIO, "_instance", None) or {}
+        if instances.get(self.size) is self:
+            del instances[self.size]
+
+        if self.pool:
+            logger.info("Shutting down file io threads")
+            self.pool.shutdown()
+
+
+class FileIOStorageMixin:
+    """
+    run_io of the storages running their disk access on the FileIO of
+    their context, timed as the `<IO_METRIC>.io.<operation>` metric.
+    """
+
+    IO_METRIC = "storage"
+
+    async def run_io(self, operation, fn, *args):
+        return await self.context.file_io.run(
+            f"{self.IO_METRIC}.io.{operation}",
+            fn,
+            *args,
+            metrics=self.context.metrics,
+        )
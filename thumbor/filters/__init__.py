@@ -10,6 +10,7 @@
 
 import collections
 import re
+from functools import lru_cache
 
 BUILTIN_FILTERS = [
     "thumbor.filters.brightness",
@@ -49,6 +50,9 @@ PHASE_POST_TRANSFORM = "post_transform"
 PHASE_PRE_LOAD = "pre-load"
 PHASE_AFTER_LOAD = "after-load"
 
+# distinct filter strings whose parse a factory remembers
+PARSE_CACHE_SIZE = 1024
+
 
 def filter_method(*args):
     def _filter_deco(filtered_function):
@@ -80,31 +84,61 @@ class FiltersFactory:
             filter_name = cls.pre_compile()
             self.filter_classes_map[filter_name] = cls
 
+        self.parse = lru_cache(maxsize=PARSE_CACHE_SIZE)(self._parse)
+
     def create_instances(self, context, filter_params):
         filter_instances = collections.defaultdict(list)
         if not filter_params:
             return FiltersRunner(filter_instances)
 
-        filter_params = filter_params.split("):")
-        last_idx = len(filter_params) - 1
+        for cls, params in self.parse(filter_params):
+            filter_instances[getattr(cls, "phase", PHASE_POST_TRANSFORM)].append(
+                cls(params, context)
+            )
+
+        return FiltersRunner(filter_instances)
 
-        for i, param in enumerate(filter_params):
-            filter_name = param.split("(")[0]
+    def _parse(self, filter_params):
+        """
+        Returns (filter class, parsed params) for each valid filter of
+        the string, unknown and invalid filters are left out. Urls
+        repeat the same filters, so callers go through the cached parse.
+        """
+        parsed = []
+        for filter_name, param in split_filters(filter_params):
             cls = self.filter_classes_map.get(filter_name, None)
 
             if cls is None:
                 continue
 
-            if i != last_idx:
-                param = param + ")"
-            instance = cls.init_if_valid(param, context)
+            params = cls.parse_params(param)
 
-            if instance:
-                filter_instances[
-                    getattr(cls, "phase", PHASE_POST_TRANSFORM)
-                ].append(instance)
+            if params is not None:
+                parsed.append((cls, tuple(params)))
 
-        return FiltersRunner(filter_instances)
+        return tuple(parsed)
+
+
+def split_filters(filter_params):
+    """
+    Yields (name, filter) for each filter of "name(params):name(params)"
+    in a single pass over the string. Filters end at "):", so params may
+    contain colons.
+    """
+    start = 0
+    end = len(filter_params)
+
+    while start < end:
+        stop = filter_params.find("):", start)
+        if stop == -1:
+            stop = end
+            param = filter_params[start:]
+        else:
+            param = filter_params[start : stop + 1]  # NOQA
+
+        paren = param.find("(")
+        yield (param if paren == -1 else param[:paren]), param
+        start = stop + 2
 
 
 class FiltersRunner:
@@ -144,16 +178,22 @@ class BaseFilter:
 
     @classmethod
     def pre_compile(cls):
+        # filters are compiled once per process, not per factory
+        if "filter_name" in cls.__dict__:
+            return cls.filter_name
+
         meths = [
             f for f in list(cls.__dict__.values()) if hasattr(f, "filter_data")
         ]
         if len(meths) == 0:
+            cls.filter_name = None
             return None
         cls.runnable_method = meths[0]
         filter_data = cls.runnable_method.filter_data
 
         cls.compile_regex(filter_data)
-        return filter_data["name"]
+        cls.filter_name = filter_data["name"]
+        return cls.filter_name
 
     @classmethod
     def compile_regex(cls, filter_data):
@@ -186,15 +226,28 @@ class BaseFilter:
             return instance
         return None
 
-    def __init__(self, params, context=None):
-        params = self.regex.match(params) if self.regex else None
+    @classmethod
+    def parse_params(cls, params):
+        """
+        Returns the parsed params of a "name(params)" string, None if
+        they do not match the filter.
+        """
+        params = cls.regex.match(params) if cls.regex else None
         if params:
             params = [
                 parser(param) if parser else param
-                for parser, param in zip(self.parsers, params.groups())
+                for parser, param in zip(cls.parsers, params.groups())
                 if param
             ]
-        self.params = params
+
+        return params
+
+    def __init__(self, params, context=None):
+        # params come as a string, or already parsed by a FiltersFactory
+        if isinstance(params, str):
+            self.params = self.parse_params(params)
+        else:
+            self.params = list(params)
         self.context = context
         self.engine = (
             context.modules.engine if context and context.modules else None
@@ -15,6 +15,7 @@ import re
 
 import tornado.gen
 
+from thumbor import negative_cache
 from thumbor.ext.filters import _alpha
 from thumbor.filters import BaseFilter, filter_method
 from thumbor.loaders import LoaderResult
@@ -184,9 +185,7 @@ class Filter(BaseFilter):
             if not self.validate(self.url):
                 raise tornado.web.HTTPError(400)
 
-            result = await self.context.modules.loader.load(
-                self.context, self.url
-            )
+            result = await negative_cache.load(self.context, self.url)
 
             if isinstance(result, LoaderResult) and not result.successful:
                 logger.warning(
@@ -8,6 +8,7 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2011 globo.com thumbor@googlegroups.com
 
+import asyncio
 import datetime
 import functools
 import re
@@ -16,15 +17,19 @@ import traceback
 
 import pytz
 import tornado.web
-from tornado.locks import Condition
+from tornado import httputil
+from tornado.iostream import StreamClosedError
 
 import thumbor.filters
-from thumbor import __version__
+from thumbor import __version__, negative_cache, negotiation
+from thumbor.cache.hasher import get_hasher
 from thumbor.context import Context, RequestParameters
 from thumbor.engines import BaseEngine, EngineResult
 from thumbor.engines.json_engine import JSONEngine
 from thumbor.loaders import LoaderResult
+from thumbor.result_descriptor import ResultDescriptor, is_animated_gif
 from thumbor.result_storages import ResultStorageResult
+from thumbor.single_flight import FileLock, SingleFlight
 from thumbor.storages.mixed_storage import Storage as MixedStorage
 from thumbor.storages.no_storage import Storage as NoStorage
 from thumbor.transformer import Transformer
@@ -32,6 +37,16 @@ from thumbor.utils import CONTENT_TYPE, EXTENSION, logger
 
 HTTP_DATE_FMT = "%a, %d %b %Y %H:%M:%S GMT"
 
+# errors a stale result is served instead of (RFC 5861)
+STALE_IF_ERROR_STATUSES = (500, 502, 503, 504)
+
+FORMAT_FILTER_RE = re.compile(r"format\([^)]+\)")
+
+# lowest quality max_bytes() may reduce an image to
+MIN_FIT_QUALITY = 10
+# results using that much of max_bytes() are not encoded again to get closer
+FIT_TOLERANCE = 0.95
+
 # Handlers should not override __init__ pylint: disable=attribute-defined-outside-init,arguments-differ
 # pylint: disable=broad-except,abstract-method,too-many-branches,too-many-return-statements,too-many-statements,too-many-lines
 
@@ -54,7 +69,26 @@ class FetchResult:  # Data Object pylint: disable=too-few-public-methods
 
 
 class BaseHandler(tornado.web.RequestHandler):
-    url_locks = {}
+    # one load of each original at a time per process, see _fetch
+    original_fetches = SingleFlight()
+    # stale result to answer with if regenerating it fails
+    _stale_result = None
+    # a stale result was sent, the rest of the request only refreshes it
+    _revalidating = False
+    # results being generated, by result_flight_key
+    result_flights = {}
+    _result_flight_key = None
+    # formats auto_format picks from, by precedence: the negotiation bit
+    # the client must accept (0 if it does not depend on Accept), the
+    # extension and the method checking the engine can produce it
+    auto_formats = (
+        (negotiation.WEBP, ".webp", "can_auto_convert_to_webp"),
+        (negotiation.AVIF, ".avif", "can_auto_convert_to_avif"),
+        (0, ".jpg", "can_auto_convert_png_to_jpg"),
+        (negotiation.JPG, ".jpg", "can_auto_convert_to_jpg"),
+        (negotiation.HEIF, ".heif", "can_auto_convert_to_heif"),
+        (negotiation.PNG, ".png", "can_auto_convert_to_png"),
+    )
 
     def prepare(self):
         super().prepare()
@@ -70,6 +104,7 @@ class BaseHandler(tornado.web.RequestHandler):
 
     def on_finish(self):
         super().on_finish()
+        self._end_result_flight()
         self.context = getattr(self, "context", None)
 
         if self.context is None:
@@ -109,6 +144,30 @@ class BaseHandler(tornado.web.RequestHandler):
                 )
 
     def _error(self, status, msg=None):
+        if self._revalidating:
+            logger.warning(
+                "[RESULT_STORAGE] could not revalidate %s: %s (%s)",
+                self.context.request.url,
+                status,
+                msg,
+            )
+            return
+
+        if (
+            self._stale_result is not None
+            and status in STALE_IF_ERROR_STATUSES
+        ):
+            if msg is not None:
+                logger.warning(msg)
+
+            self.context.request.cache_status = "stale"
+            self.context.metrics.incr("result_storage.stale_if_error")
+            _, content_type = self.define_image_type(
+                self.context, self._stale_result
+            )
+            self._write_results(self._stale_result, content_type)
+            return
+
         self.set_status(status)
 
         if msg is not None:
@@ -163,18 +222,35 @@ class BaseHandler(tornado.web.RequestHandler):
                 (finish - start).total_seconds() * 1000,
             )
 
+            stale = isinstance(result, ResultStorageResult) and result.stale
+
             if result is None:
                 self.context.metrics.incr("result_storage.miss")
+            elif stale and result.stale_if_error:
+                # only used if regenerating it fails, see _error
+                self._stale_result = result
+                self.context.metrics.incr("result_storage.miss")
             else:
-                self.context.request.cache_status = "hit"
-                self.context.metrics.incr("result_storage.hit")
+                self.context.request.cache_status = "stale" if stale else "hit"
+                self.context.metrics.incr(
+                    "result_storage.stale" if stale else "result_storage.hit"
+                )
                 self.context.metrics.incr(
                     "result_storage.bytes_read", len(result)
                 )
                 logger.debug("[RESULT_STORAGE] IMAGE FOUND: %s", req.url)
                 await self.finish_request(result)
 
-                return
+                if not stale or not result.revalidate:
+                    return
+
+                # the client got the stale result,
+                # carry on to refresh it for the next ones
+                self._revalidating = True
+                self.context.metrics.incr("result_storage.revalidate")
+
+        if not self._revalidating and await self._wait_for_identical_request():
+            return
 
         if (
             conf.MAX_WIDTH
@@ -234,6 +310,12 @@ class BaseHandler(tornado.web.RequestHandler):
 
                     return
 
+                if result.loader_error == LoaderResult.ERROR_TOO_LARGE:
+                    # like images the engine refuses for their size
+                    self._error(400)
+
+                    return
+
                 if isinstance(result.loader_error, int):
                     self._error(result.loader_error)
 
@@ -359,47 +441,11 @@ class BaseHandler(tornado.web.RequestHandler):
             and context.request.engine.can_convert_to_webp()
         )
 
-    def is_animated_gif(self, data):
-        if data[:6] not in [b"GIF87a", b"GIF89a"]:
-            return False
-        i = 10  # skip header
-        frames = 0
-
-        def skip_color_table(i, flags):
-            if flags & 0x80:
-                i += 3 << ((flags & 7) + 1)
-
-            return i
-
-        flags = data[i]
-        i = skip_color_table(i + 3, flags)
-
-        while frames < 2:
-            block = data[i : i + 1]  # NOQA
-            i += 1
+    def can_auto_convert_to_webp(self):
+        return self.is_webp(self.context)
 
-            if block == b"\x3B":
-                break
-
-            if block == b"\x21":
-                i += 1
-            elif block == b"\x2C":
-                frames += 1
-                i += 8
-                i = skip_color_table(i + 1, data[i])
-                i += 1
-            else:
-                return False
-
-            while True:
-                j = data[i]
-                i += 1
-
-                if not j:
-                    break
-                i += j
-
-        return frames > 1
+    def is_animated_gif(self, data):
+        return is_animated_gif(data)
 
     def can_auto_convert_png_to_jpg(self):
         request_override = self.context.request.auto_png_to_jpg
@@ -422,13 +468,18 @@ class BaseHandler(tornado.web.RequestHandler):
 
         return False
 
-    def can_auto_convert_to_avif(self):
-        auto_avif = self.context.config.AUTO_AVIF
-        accepts_avif = self.accepts_mime_type("image/avif")
+    def format_capabilities(self):
+        """
+        Formats of thumbor.negotiation both accepted by the client and
+        enabled by the AUTO_* settings, as a bitmask.
+        """
+        return negotiation.capabilities(
+            self.context.config, self.context.request.accepts
+        )
 
+    def can_auto_convert_to_avif(self):
         if (
-            auto_avif is True
-            and accepts_avif is True
+            self.format_capabilities() & negotiation.AVIF
             and not self.context.request.engine.is_multiple()
         ):
             return self.context.request.engine.can_auto_convert_to_avif()
@@ -436,12 +487,8 @@ class BaseHandler(tornado.web.RequestHandler):
         return False
 
     def can_auto_convert_to_heif(self):
-        auto_heif = self.context.config.AUTO_HEIF
-        accepts_heif = self.accepts_mime_type("image/heif")
-
         if (
-            auto_heif
-            and accepts_heif
+            self.format_capabilities() & negotiation.HEIF
             and not self.context.request.engine.is_multiple()
         ):
             return self.context.request.engine.can_auto_convert_to_heif()
@@ -449,45 +496,49 @@ class BaseHandler(tornado.web.RequestHandler):
         return False
 
     def can_auto_convert_to_jpg(self):
-        auto_jpg = self.context.config.AUTO_JPG
-        accepts_jpg = (
-            self.accepts_mime_type("*/*")
-            or self.accepts_mime_type("image/jpg")
-            or self.accepts_mime_type("image/jpeg")
-        )
-
         if (
-            auto_jpg
-            and accepts_jpg
+            self.format_capabilities() & negotiation.JPG
             and not self.context.request.engine.is_multiple()
-            and not self.context.request.engine.has_transparency()
+            and not self.context.request.engine.transparent
         ):
             return True
 
         return False
 
     def can_auto_convert_to_png(self):
-        auto_png = self.context.config.AUTO_PNG
-        accepts_png = self.accepts_mime_type("image/png")
-
         if (
-            auto_png
-            and accepts_png
+            self.format_capabilities() & negotiation.PNG
             and not self.context.request.engine.is_multiple()
         ):
             return True
 
         return False
 
+    def auto_format(self):
+        """
+        Returns the extension negotiated from the Accept header and the
+        AUTO_* settings, None to keep the one of the engine.
+        """
+        capabilities = self.format_capabilities()
+
+        for bit, extension, can_convert in self.auto_formats:
+            # checked with the engine only if the client takes it
+            if bit and not capabilities & bit:
+                continue
+
+            if getattr(self, can_convert)():
+                return extension
+
+        return None
+
     def define_image_type(self, context, result):
         if result is not None:
             if isinstance(result, ResultStorageResult):
-                buffer = result.buffer
+                # stored with the result, or sniffed by the storage
+                mime = result.mime
             else:
-                buffer = result
-            image_extension = EXTENSION.get(
-                BaseEngine.get_mimetype(buffer), ".jpg"
-            )
+                mime = BaseEngine.get_mimetype(result)
+            image_extension = EXTENSION.get(mime, ".jpg")
             content_type = CONTENT_TYPE.get(
                 image_extension, CONTENT_TYPE[".jpg"]
             )
@@ -499,42 +550,20 @@ class BaseHandler(tornado.web.RequestHandler):
         if image_extension is not None:
             image_extension = f".{image_extension}"
             logger.debug("Image format specified as %s.", image_extension)
-        elif self.is_webp(context):
-            image_extension = ".webp"
-            logger.debug(
-                "Image format set by AUTO_WEBP as %s.", image_extension
-            )
-        elif self.can_auto_convert_to_avif():
-            image_extension = ".avif"
-            logger.debug(
-                "Image format set by AUTO_AVIF as %s.", image_extension
-            )
-        elif (
-            self.can_auto_convert_png_to_jpg()
-            or self.can_auto_convert_to_jpg()
-        ):
-            image_extension = ".jpg"
-            logger.debug(
-                "Image format set by AUTO_PNG_TO_JPG or AUTO_JPG as %s.",
-                image_extension,
-            )
-        elif self.can_auto_convert_to_heif():
-            image_extension = ".heif"
-            logger.debug(
-                "Image format set by AUTO_HEIF as %s.", image_extension
-            )
-        elif self.can_auto_convert_to_png():
-            image_extension = ".png"
-            logger.debug(
-                "Image format set by AUTO_PNG as %s.", image_extension
-            )
         else:
-            image_extension = context.request.engine.extension
-            logger.debug(
-                "No image format specified. Retrieving "
-                "from the image extension: %s.",
-                image_extension,
-            )
+            image_extension = self.auto_format()
+
+            if image_extension is not None:
+                logger.debug(
+                    "Image format negotiated as %s.", image_extension
+                )
+            else:
+                image_extension = context.request.engine.extension
+                logger.debug(
+                    "No image format specified. Retrieving "
+                    "from the image extension: %s.",
+                    image_extension,
+                )
 
         content_type = CONTENT_TYPE.get(image_extension, CONTENT_TYPE[".jpg"])
 
@@ -588,16 +617,40 @@ class BaseHandler(tornado.web.RequestHandler):
                 image_extension,
                 quality,
                 context.request.max_bytes,
+                context.config.MAX_BYTES_ENCODE_BUDGET,
+                context.metrics,
             )
 
-        if not context.request.meta:
-            results = self.optimize(context, image_extension, results)
-            # An optimizer might have modified the image format.
-            content_type = BaseEngine.get_mimetype(results)
+        if context.request.meta:
+            descriptor = ResultDescriptor(content_type, length=len(results))
+
+            return results, self._with_digest(descriptor, results)
+
+        results = self.optimize(context, image_extension, results)
+        # An optimizer might have modified the image format.
+        width, height = context.request.engine.size
+        descriptor = ResultDescriptor.for_buffer(results, width, height)
+
+        return results, self._with_digest(descriptor, results)
+
+    def _with_digest(self, descriptor, results):
+        """
+        Digests new results with the hasher of the file caches, so they
+        get the same ETag as when served from the result storage.
+        """
+        if not self.context.config.ENABLE_ETAGS:
+            return descriptor
+
+        hasher = get_hasher(self.context.config.FILE_CACHE_HASHER)
 
-        return results, content_type
+        return descriptor.with_digest(
+            hasher.digest(self._ensure_bytes(results)), hasher.name
+        )
 
     async def _process_result_from_storage(self, result):
+        """
+        Returns True if the request was answered with a 304.
+        """
         if self.context.config.SEND_IF_MODIFIED_LAST_MODIFIED_HEADERS:
             # Handle If-Modified-Since & Last-Modified header
             try:
@@ -619,7 +672,7 @@ class BaseHandler(tornado.web.RequestHandler):
                             self.set_status(304)
                             self.finish()
 
-                            return
+                            return True
 
                     self.set_header(
                         "Last-Modified",
@@ -632,9 +685,15 @@ class BaseHandler(tornado.web.RequestHandler):
                     "Last-Updated headers support is disabled."
                 )
 
+        return False
+
     async def finish_request(self, result_from_storage=None):
         if result_from_storage is not None:
-            await self._process_result_from_storage(result_from_storage)
+            if await self._process_result_from_storage(result_from_storage):
+                if isinstance(result_from_storage, ResultStorageResult):
+                    result_from_storage.close()
+
+                return
 
             _, content_type = self.define_image_type(
                 self.context, result_from_storage
@@ -675,8 +734,12 @@ class BaseHandler(tornado.web.RequestHandler):
 
             return
 
-        (results, content_type) = result
-        await self._write_results_to_client(results, content_type)
+        (results, descriptor) = result
+        context.request.result_descriptor = descriptor
+        self._end_result_flight((results, descriptor, self._request_state()))
+        await self._write_results_to_client(
+            results, descriptor.mime, descriptor
+        )
 
         if should_store:
             results = self._ensure_bytes(results)
@@ -685,6 +748,76 @@ class BaseHandler(tornado.web.RequestHandler):
         # can't cleanup before storing results as the storage requires context
         self._cleanup()
 
+    def result_flight_key(self):
+        """
+        Concurrent requests with the same key get the same response body:
+        same url and query, and same formats negotiated from Accept.
+        """
+        request = self.context.request
+
+        return (
+            request.url,
+            self.request.query,
+            request.auto_png_to_jpg,
+            negotiation.variant_key(self.format_capabilities()),
+        )
+
+    async def _wait_for_identical_request(self):
+        """
+        The first of identical concurrent requests generates the result,
+        the others wait for it. Returns True if the result of another
+        request was written.
+        """
+        key = self.result_flight_key()
+        flight = BaseHandler.result_flights.get(key)
+
+        if flight is None:
+            self._result_flight_key = key
+            BaseHandler.result_flights[key] = (
+                asyncio.get_running_loop().create_future()
+            )
+
+            return False
+
+        shared = await asyncio.shield(flight)
+
+        if shared is None:
+            # the first request failed, try on our own
+            return False
+
+        results, descriptor, request_state = shared
+
+        for name, value in request_state.items():
+            setattr(self.context.request, name, value)
+
+        self.context.metrics.incr("response.coalesced")
+        self._write_results(results, descriptor.mime, descriptor)
+
+        return True
+
+    def _end_result_flight(self, shared=None):
+        key = self._result_flight_key
+
+        if key is None:
+            return
+
+        self._result_flight_key = None
+        flight = BaseHandler.result_flights.pop(key, None)
+
+        if flight is not None and not flight.done():
+            flight.set_result(shared)
+
+    def _request_state(self):
+        # what _write_results reads besides the results
+        request = self.context.request
+
+        return {
+            "max_age": request.max_age,
+            "max_age_shared": request.max_age_shared,
+            "prevent_result_storage": request.prevent_result_storage,
+            "detection_error": request.detection_error,
+        }
+
     def _ensure_bytes(self, results):
         if isinstance(results, str):
             return results.encode()
@@ -702,7 +835,187 @@ class BaseHandler(tornado.web.RequestHandler):
         self.context.transformer = None
         self.context = None  # Handlers should not override __init__ pylint: disable=attribute-defined-outside-init
 
-    async def _write_results_to_client(self, results, content_type):
+    async def _write_results_to_client(
+        self, results, content_type, descriptor=None
+    ):
+        if isinstance(results, ResultStorageResult) and results.stream:
+            try:
+                await self._stream_results(results, content_type, descriptor)
+            finally:
+                results.close()
+
+            return
+
+        self._write_results(results, content_type, descriptor)
+
+    def _write_results(self, results, content_type, descriptor=None):
+        if self._revalidating:
+            return
+
+        if isinstance(results, ResultStorageResult):
+            buffer = results.buffer
+            descriptor = descriptor or results.descriptor
+        else:
+            buffer = results
+
+        if descriptor is not None:
+            animated = descriptor.animated
+        else:
+            animated = self.is_animated_gif(buffer)
+
+        self._set_result_headers(content_type, animated)
+
+        if self._not_modified(descriptor):
+            return
+
+        if isinstance(results, ResultStorageResult):
+            body_range = self._body_range(len(buffer))
+
+            if body_range is None:
+                buffer = b""
+            elif body_range != (0, len(buffer)):
+                buffer = buffer[body_range[0] : body_range[1]]
+
+        self.context.headers = self._headers.copy()
+        self._response_ext = EXTENSION.get(content_type)
+        self._response_length = len(buffer)
+
+        self.write(buffer)
+        self.finish()
+
+    async def _stream_results(self, result, content_type, descriptor=None):
+        if self._revalidating:
+            return
+
+        descriptor = descriptor or result.descriptor
+        # streamed results are not read, without a descriptor they are
+        # taken as not animated
+        self._set_result_headers(
+            content_type, descriptor is not None and descriptor.animated
+        )
+
+        if self._not_modified(descriptor):
+            return
+
+        body_range = self._body_range(len(result))
+
+        self.context.headers = self._headers.copy()
+        self._response_ext = EXTENSION.get(content_type)
+
+        if body_range is None:
+            self.finish()
+
+            return
+
+        start, end = body_range
+        self._response_length = end - start
+        self.set_header("Content-Length", end - start)
+
+        if self.request.method == "HEAD":
+            self.finish()
+
+            return
+
+        chunk_size = self.context.config.RESULT_STORAGE_STREAMING_CHUNK_BYTES
+        result.stream.seek(start)
+        remaining = end - start
+
+        try:
+            while remaining > 0:
+                chunk = await self.context.file_io.run(
+                    "result_storage.io.stream",
+                    result.stream.read,
+                    min(chunk_size, remaining),
+                )
+
+                if not chunk:
+                    break
+
+                remaining -= len(chunk)
+                self.write(chunk)
+                # wait for the client, so at most a chunk is buffered
+                await self.flush()
+        except StreamClosedError:
+            logger.debug(
+                "[BaseHandler] client went away while streaming %s",
+                self.context.request.url,
+            )
+
+            return
+
+        self.finish()
+
+    def _not_modified(self, descriptor):
+        """
+        Sets the ETag of the result from its digest instead of having
+        tornado hash the body. Returns True, after answering 304, if the
+        client already has the result.
+        """
+        if (
+            not self.context.config.ENABLE_ETAGS
+            or descriptor is None
+            or descriptor.etag is None
+        ):
+            return False
+
+        self.set_header("Etag", descriptor.etag)
+
+        if not self.check_etag_header():
+            return False
+
+        self.context.headers = self._headers.copy()
+        self.set_status(304)
+        self.finish()
+
+        return True
+
+    def _body_range(self, size):
+        """
+        Returns the (start, end) of the body to send for the Range header,
+        or None (and a 416 status) if the range can not be satisfied.
+        """
+        self.set_header("Accept-Ranges", "bytes")
+        range_header = self.request.headers.get("Range")
+
+        if not range_header:
+            return 0, size
+
+        # same parsing as tornado's StaticFileHandler
+        request_range = httputil._parse_request_range(  # pylint: disable=protected-access
+            range_header
+        )
+
+        if request_range is None:
+            return 0, size
+
+        start, end = request_range
+
+        if start is not None and start < 0:
+            start = max(start + size, 0)
+
+        if (
+            start is not None
+            and (start >= size or (end is not None and start >= end))
+        ) or end == 0:
+            self.set_status(416)
+            self.set_header("Content-Range", f"bytes */{size}")
+
+            return None
+
+        start = start or 0
+        end = size if end is None else min(end, size)
+
+        self.set_status(206)
+        self.set_header(
+            "Content-Range",
+            httputil._get_content_range(  # pylint: disable=protected-access
+                start, end, size
+            ),
+        )
+
+        return start, end
+
+    def _set_result_headers(self, content_type, animated):
         max_age = self.context.config.MAX_AGE
 
         if self.context.request.max_age is not None:
@@ -711,6 +1024,7 @@ class BaseHandler(tornado.web.RequestHandler):
         if (
             self.context.request.prevent_result_storage
             or self.context.request.detection_error
+            or self.context.request.cache_status == "stale"
         ):
             max_age = self.context.config.MAX_AGE_TEMP_IMAGE
 
@@ -740,11 +1054,6 @@ class BaseHandler(tornado.web.RequestHandler):
         self.set_header("Content-Type", content_type)
         self.set_header("X-Thumbor-Cache-Status", str(self.context.request.cache_status))
 
-        if isinstance(results, ResultStorageResult):
-            buffer = results.buffer
-        else:
-            buffer = results
-
         # auto-convert configured?
         should_vary = (
             self.context.config.AUTO_WEBP
@@ -757,22 +1066,15 @@ class BaseHandler(tornado.web.RequestHandler):
         should_vary = should_vary and not (
             self.context.request.format
             and bool(  # format is supported by filter
-                re.search(r"format\([^)]+\)", self.context.request.filters)
+                FORMAT_FILTER_RE.search(self.context.request.filters)
             )  # filter is in request
         )
         # our image is not animated gif
-        should_vary = should_vary and not self.is_animated_gif(buffer)
+        should_vary = should_vary and not animated
 
         if should_vary:
             self.set_header("Vary", "Accept")
 
-        self.context.headers = self._headers.copy()
-        self._response_ext = EXTENSION.get(content_type)
-        self._response_length = len(buffer)
-
-        self.write(buffer)
-        self.finish()
-
     async def _store_results(self, result_storage, metrics, results):
         start = datetime.datetime.now()
 
@@ -798,7 +1100,13 @@ class BaseHandler(tornado.web.RequestHandler):
 
     @staticmethod
     def reload_to_fit_in_kb(
-        engine, initial_results, extension, initial_quality, max_bytes
+        engine,
+        initial_results,
+        extension,
+        initial_quality,
+        max_bytes,
+        max_encodes=6,
+        metrics=None,
     ):
         if (
             extension not in [".webp", ".jpg", ".jpeg"]
@@ -806,37 +1114,51 @@ class BaseHandler(tornado.web.RequestHandler):
         ):
             return initial_results
 
-        results = initial_results
-        quality = initial_quality
+        # initial_quality is known to be too big
+        low, high = MIN_FIT_QUALITY, initial_quality - 1
+        # smallest encode that did not fit, the model is seeded from it
+        too_big_quality, too_big_size = initial_quality, len(initial_results)
+        best = None
+        encodes = 0
+
+        while low <= high and encodes < max_encodes:
+            if best is None:
+                # bytes per pixel taken as proportional to the quality
+                quality = int(too_big_quality * max_bytes / too_big_size)
+                quality = min(max(quality, low), high)
+            else:
+                quality = (low + high + 1) // 2
 
-        while len(results) > max_bytes:
-            quality = int(quality * 0.75)
+            logger.debug("Trying to fit image with quality of %d...", quality)
+            results = engine.read(extension, quality)
+            encodes += 1
 
-            if quality < 10:
-                logger.debug(
-                    "Could not find any reduction that matches "
-                    "required size of %d bytes.",
-                    max_bytes,
-                )
+            if len(results) <= max_bytes:
+                best = results
+                low = quality + 1
+
+                if len(results) >= max_bytes * FIT_TOLERANCE:
+                    break
+            else:
+                too_big_quality, too_big_size = quality, len(results)
+                high = quality - 1
 
-                return initial_results
+        if metrics is not None:
+            metrics.incr("max_bytes.encodes", encodes)
 
+        if best is None:
             logger.debug(
-                "Trying to downsize image with quality of %d...", quality
+                "Could not find any reduction that matches "
+                "required size of %d bytes.",
+                max_bytes,
             )
-            results = engine.read(extension, quality)
 
-        prev_result = results
+            if metrics is not None:
+                metrics.incr("max_bytes.unfit")
 
-        while len(results) <= max_bytes and quality < initial_quality:
-            quality = max(initial_quality, int(quality * 1.1))
-            logger.debug(
-                "Trying to upsize image with quality of %d...", quality
-            )
-            prev_result = results
-            results = engine.read(extension, quality)
+            return initial_results
 
-        return prev_result
+        return best
 
     @classmethod
     def translate_crop_coordinates(
@@ -890,43 +1212,100 @@ class BaseHandler(tornado.web.RequestHandler):
 
         storage = self.context.modules.storage
 
-        await self.acquire_url_lock(url)
+        fetch_result.buffer = await storage.get(url)
 
-        try:
-            fetch_result.buffer = await storage.get(url)
-            mime = None
+        if fetch_result.buffer is not None:
+            fetch_result.successful = True
 
-            if fetch_result.buffer is not None:
-                self.release_url_lock(url)
+            self.context.metrics.incr("storage.hit")
+            self.context.request.cache_status = "hit"
 
-                fetch_result.successful = True
+            mime = BaseEngine.get_mimetype(fetch_result.buffer)
+            self.context.request.extension = EXTENSION.get(mime, ".jpg")
 
-                self.context.metrics.incr("storage.hit")
-                self.context.request.cache_status = "hit"
+            if mime == "image/gif" and self.context.config.USE_GIFSICLE_ENGINE:
+                self.context.request.engine = self.context.modules.gif_engine
+            else:
+                self.context.request.engine = self.context.modules.engine
 
-                mime = BaseEngine.get_mimetype(fetch_result.buffer)
-                self.context.request.extension = EXTENSION.get(mime, ".jpg")
+            return fetch_result
 
-                if (
-                    mime == "image/gif"
-                    and self.context.config.USE_GIFSICLE_ENGINE
-                ):
-                    self.context.request.engine = (
-                        self.context.modules.gif_engine
-                    )
-                else:
-                    self.context.request.engine = self.context.modules.engine
+        self.context.metrics.incr("storage.miss")
 
-                return fetch_result
+        (loader_result, lock, stored, loader_state), shared = (
+            await BaseHandler.original_fetches.run(
+                url, self._load_original, url
+            )
+        )
 
-            self.context.metrics.incr("storage.miss")
+        if shared:
+            self.context.metrics.incr("original_image.coalesced")
 
-            loader_result = await self.context.modules.loader.load(
-                self.context, url
+            # the caching the loader derived from the origin's response
+            for name, value in loader_state.items():
+                setattr(self.context.request, name, value)
+
+        try:
+            # only the request that loaded the original stores it
+            return await self._process_loader_result(
+                url, fetch_result, loader_result, not (shared or stored)
             )
         finally:
-            self.release_url_lock(url)
+            if lock is not None and not shared:
+                lock.release()
 
+    async def _load_original(self, url):
+        """
+        Loads url for every request of this process waiting on it.
+        With ORIGINAL_FETCH_LOCK_DIR set, processes take turns as well,
+        and the ones that waited read what the first one stored.
+        Returns the loader result, the lock to release once the original
+        is stored, whether it was already stored and the request state
+        the loader set.
+        """
+        lock_dir = self.context.config.ORIGINAL_FETCH_LOCK_DIR
+        lock = FileLock(lock_dir, url) if lock_dir else None
+
+        try:
+            if lock is not None and not lock.try_acquire():
+                self.context.metrics.incr("original_image.coalesced")
+                # loads it anyway if the other process takes too long
+                await lock.acquire(
+                    self.context.config.ORIGINAL_FETCH_LOCK_TIMEOUT
+                )
+                buffer = await self.context.modules.storage.get(url)
+
+                if buffer is not None:
+                    lock.release()
+
+                    return (
+                        LoaderResult(buffer=buffer),
+                        None,
+                        True,
+                        self._loader_state(),
+                    )
+
+            loader_result = await negative_cache.load(self.context, url)
+        except Exception:
+            if lock is not None:
+                lock.release()
+            raise
+
+        return loader_result, lock, False, self._loader_state()
+
+    def _loader_state(self):
+        # what loaders set on the request besides the buffer, such as
+        # http_loader_cache_control from the origin's Cache-Control
+        request = self.context.request
+
+        return {
+            "max_age": request.max_age,
+            "max_age_shared": request.max_age_shared,
+        }
+
+    async def _process_loader_result(
+        self, url, fetch_result, loader_result, should_store
+    ):
         if isinstance(loader_result, LoaderResult):
             # TODO _fetch should probably return a result object vs a list to
             # to allow returning metadata
@@ -947,8 +1326,7 @@ class BaseHandler(tornado.web.RequestHandler):
 
         fetch_result.successful = True
 
-        if mime is None:
-            mime = BaseEngine.get_mimetype(fetch_result.buffer)
+        mime = BaseEngine.get_mimetype(fetch_result.buffer)
 
         self.context.request.extension = extension = EXTENSION.get(
             mime, ".jpg"
@@ -983,10 +1361,16 @@ class BaseHandler(tornado.web.RequestHandler):
                 storage.file_storage, NoStorage
             )
 
-            if not (is_no_storage or is_mixed_no_file_storage):
-                await storage.put(url, fetch_result.buffer)
+            if should_store:
+                if not (is_no_storage or is_mixed_no_file_storage):
+                    await storage.put(url, fetch_result.buffer)
+
+                await storage.put_crypto(url)
 
-            await storage.put_crypto(url)
+            # only meant for storing this original, not the ones
+            # filters load later on for the same request
+            self.context.request.stale_original = None
+            self.context.request.original_validators = None
         except Exception as error:
             fetch_result.successful = False
             fetch_result.exception = error
@@ -1010,19 +1394,6 @@ class BaseHandler(tornado.web.RequestHandler):
 
         return ""
 
-    async def acquire_url_lock(self, url):
-        if url not in BaseHandler.url_locks:
-            BaseHandler.url_locks[url] = Condition()
-        else:
-            return await BaseHandler.url_locks[url].wait()
-
-    def release_url_lock(self, url):
-        try:
-            BaseHandler.url_locks[url].notify_all()
-            del BaseHandler.url_locks[url]
-        except KeyError:
-            pass
-
 
 class ContextHandler(BaseHandler):
     def initialize(self, context):
@@ -1031,6 +1402,7 @@ class ContextHandler(BaseHandler):
             config=context.config,
             importer=context.modules.importer,
             request_handler=self,
+            filters_factory=context.filters_factory,
         )
         self.context.metrics.initialize(self)
 
@@ -1108,3 +1480,5 @@ class ImageApiHandler(ContextHandler):
     async def write_file(self, file_id, body):
         storage = self.context.modules.upload_photo_storage
         await storage.put(file_id, body)
+        # it may have failed to load before it was uploaded
+        negative_cache.for_context(self.context).purge(file_id)
@@ -9,6 +9,7 @@
 # Copyright (c) 2011 globo.com thumbor@googlegroups.com
 import datetime
 
+from thumbor import negative_cache
 from thumbor.engines import BaseEngine
 from thumbor.handlers import ImageApiHandler
 
@@ -69,6 +70,7 @@ class ImageResourceHandler(ImageApiHandler):
         exists = await self.context.modules.storage.exists(file_id)
         if exists:
             await self.context.modules.storage.remove(file_id)
+            negative_cache.for_context(self.context).purge(file_id)
             self.set_status(204)
         else:
             self._error(404, "Image not found at the given URL")
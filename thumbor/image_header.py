@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import struct
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# JPEG start of frame markers, the ones followed by the dimensions
+JPEG_FRAMES = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# JPEG markers without a length
+JPEG_STANDALONE = frozenset(range(0xD0, 0xDA)) | {0x01}
+JPEG_START_OF_SCAN = 0xDA
+
+
+def image_size(header):
+    """
+    Width and height of the image the bytes start with, read from its
+    header only. None when the format is not one of PNG, GIF, JPEG and
+    WebP, or when more bytes are needed.
+    """
+    if header[:8] == PNG_SIGNATURE:
+        return _png_size(header)
+
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return _gif_size(header)
+
+    if header[:2] == b"\xff\xd8":
+        return _jpeg_size(header)
+
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return _webp_size(header)
+
+    return None
+
+
+def _png_size(header):
+    if len(header) < 24:
+        return None
+
+    return struct.unpack_from(">II", header, 16)
+
+
+def _gif_size(header):
+    if len(header) < 10:
+        return None
+
+    return struct.unpack_from("<HH", header, 6)
+
+
+def _jpeg_size(header):
+    i = 2
+    while i + 4 <= len(header):
+        if header[i] != 0xFF:
+            return None
+
+        marker = header[i + 1]
+        if marker == 0xFF:
+            # fill byte
+            i += 1
+            continue
+
+        if marker in JPEG_STANDALONE:
+            i += 2
+            continue
+
+        if marker in JPEG_FRAMES:
+            if i + 9 > len(header):
+                return None
+
+            height, width = struct.unpack_from(">HH", header, i + 5)
+
+            return width, height
+
+        if marker == JPEG_START_OF_SCAN:
+            return None
+
+        (length,) = struct.unpack_from(">H", header, i + 2)
+        i += 2 + length
+
+    return None
+
+
+def _webp_size(header):
+    chunk = header[12:16]
+
+    if chunk == b"VP8 " and len(header) >= 30:
+        width, height = struct.unpack_from("<HH", header, 26)
+
+        return width & 0x3FFF, height & 0x3FFF
+
+    if chunk == b"VP8L" and len(header) >= 25:
+        (bits,) = struct.unpack_from("<I", header, 21)
+
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+
+    if chunk == b"VP8X" and len(header) >= 30:
+        return (
+            int.from_bytes(header[24:27], "little") + 1,
+            int.from_bytes(header[27:30], "little") + 1,
+        )
+
+    return None
@@ -16,6 +16,7 @@ class LoaderResult:
     ERROR_UPSTREAM = "upstream"
     ERROR_TIMEOUT = "timeout"
     ERROR_BAD_REQUEST = "bad_request"
+    ERROR_TOO_LARGE = "too_large"
 
     def __init__(
         self,
@@ -24,6 +25,7 @@ class LoaderResult:
         error: str = None,
         metadata: Dict[str, any] = None,
         extras: Dict[str, any] = None,
+        synthetic: bool = False,
     ):
         """
         :param buffer: The media buffer
@@ -39,6 +41,11 @@ class LoaderResult:
 
         :param extras: Dictionary of extra information about the error
         :type metadata: dict
+
+        :param synthetic: True when the loader failed without asking the
+        origin, e.g. while throttling it. Such errors say nothing about the
+        url and are not remembered by the negative cache.
+        :type synthetic: bool
         """
 
         if metadata is None:
@@ -52,3 +59,40 @@ class LoaderResult:
         self.error = error
         self.metadata = metadata
         self.extras = extras
+        self.synthetic = synthetic
+
+
+class StaleOriginal:
+    """
+    An expired original a storage still has, with the validators its
+    origin sent. Loaders may ask the origin whether it changed instead
+    of loading it again, and set not_modified when it did not. Loads
+    and stores of other urls of the request (watermarks, frames) must
+    ignore it, see is_for.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        buffer: bytes,
+        etag: str = None,
+        last_modified: str = None,
+    ):
+        # url of the original, and the one its loader requested it at
+        self.urls = {url}
+        self.buffer = buffer
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = False
+
+    def is_for(self, url: str) -> bool:
+        return url in self.urls
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        return headers
@@ -8,24 +8,403 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2011 globo.com thumbor@googlegroups.com
 
+import asyncio
+import collections
 import datetime
 import re
 import socket
+import time
+import weakref
+from functools import lru_cache
+from io import BytesIO
 from typing import Pattern
 from urllib.parse import quote, unquote, urlparse
 
 import tornado.httpclient
+import tornado.httputil
 
+from thumbor.image_header import image_size
 from thumbor.loaders import LoaderResult
 from thumbor.utils import logger
 
 try:
+    import pycurl
     import tornado.curl_httpclient  # pylint: disable=ungrouped-imports
 except (ImportError, ValueError):
+    pycurl = None
     logger.warning(
         "pycurl usage is advised. It could not be loaded properly. Verify install..."
     )
 
+CURL_HTTP_CLIENT = "tornado.curl_httpclient.CurlAsyncHTTPClient"
+
+# hosts whose state is kept, idle ones are forgotten beyond it
+MAX_ORIGINS = 1024
+
+# loads of a host observed before its timeout adapts to them
+MIN_LATENCY_SAMPLES = 5
+
+# streamed bytes the image dimensions are looked for in
+MAX_HEADER_BYTES = 256 * 1024
+
+
+class ClientPool:
+    """
+    What every load shares of the HTTP client: its configuration, set
+    once instead of on each load, and the counters of its metrics.
+    """
+
+    def __init__(self):
+        # (implementation, max clients) AsyncHTTPClient is configured with
+        self.settings = None
+        # clients whose connection limits are set, one per IOLoop
+        self.limited_clients = weakref.WeakSet()
+        # loads waiting for or running a fetch
+        self.active = 0
+        # connections opened, and how many of them were reported
+        self.connections = 0
+        self.reported_connections = 0
+        # Origin of each host loaded from, least recently used first
+        self.origins = collections.OrderedDict()
+
+    def client(self, config, implementation):
+        settings = (implementation, config.HTTP_LOADER_MAX_CLIENTS)
+        if settings != self.settings:
+            tornado.httpclient.AsyncHTTPClient.configure(
+                implementation,
+                max_clients=config.HTTP_LOADER_MAX_CLIENTS,
+            )
+            self.settings = settings
+
+        client = tornado.httpclient.AsyncHTTPClient()
+        if client not in self.limited_clients:
+            self.limit_connections(client, config)
+            self.limited_clients.add(client)
+
+        return client
+
+    @staticmethod
+    def limit_connections(client, config):
+        # only the curl client keeps connections alive
+        multi = getattr(client, "_multi", None)
+        if multi is None or not config.HTTP_LOADER_MAX_CONNECTIONS_PER_HOST:
+            return
+
+        multi.setopt(
+            pycurl.M_MAX_HOST_CONNECTIONS,
+            config.HTTP_LOADER_MAX_CONNECTIONS_PER_HOST,
+        )
+
+    def origin(self, netloc):
+        origin = self.origins.get(netloc)
+        if origin is not None:
+            self.origins.move_to_end(netloc)
+            return origin
+
+        origin = self.origins[netloc] = Origin(netloc)
+        if len(self.origins) > MAX_ORIGINS:
+            for name, forgotten in self.origins.items():
+                if forgotten.idle:
+                    del self.origins[name]
+                    break
+
+        return origin
+
+    def connection_opened(self, *_):
+        # also the SOCKOPTFUNCTION of curl, called for new connections
+        self.connections += 1
+
+        return 0
+
+    def started(self, metrics, max_clients):
+        self.active += 1
+        metrics.gauge("original_image.pool.active", self.active)
+        metrics.gauge(
+            "original_image.pool.queued", max(self.active - max_clients, 0)
+        )
+
+    def finished(self, metrics, response, elapsed):
+        self.active -= 1
+        metrics.gauge("original_image.pool.active", self.active)
+        metrics.incr("original_image.pool.requests")
+
+        # connections are not attributed to loads, the ratio of both
+        # counters is what matters: 1 - connections / requests is reuse
+        opened = self.connections - self.reported_connections
+        self.reported_connections = self.connections
+        if opened:
+            metrics.incr("original_image.pool.connections", opened)
+
+        if response is not None and response.request_time is not None:
+            # the time before the client started the request,
+            # waiting for one of HTTP_LOADER_MAX_CLIENTS
+            metrics.timing(
+                "original_image.pool.queue_wait",
+                max(elapsed - response.request_time, 0) * 1000,
+            )
+
+
+class Origin:
+    """
+    What the loads of one upstream host know about it: how many of them
+    are fetching, how fast it answers and whether it keeps failing.
+    """
+
+    def __init__(self, netloc):
+        # as in the original_image.fetch.{code}.{netloc} metrics
+        self.name = netloc.replace(".", "_")
+        self.active = 0
+        # futures of the loads waiting for one of the active ones
+        self.waiting = collections.deque()
+        # smoothed latency and its mean deviation, in seconds
+        self.latency = None
+        self.deviation = 0.0
+        self.samples = 0
+        # consecutive 5xx and timeouts, and the error of the last one
+        self.failures = 0
+        self.error = None
+        # monotonic time the circuit stays open until, 0 when closed
+        self.open_until = 0
+        # whether the load probing a host whose circuit opened is running
+        self.probing = False
+
+    @property
+    def idle(self):
+        # a circuit that has been open long enough is as good as closed
+        return (
+            not self.active
+            and not self.waiting
+            and self.open_until <= time.monotonic()
+        )
+
+    def metric(self, kind):
+        return f"original_image.fetch.{kind}.{self.name}"
+
+    def admit(self, now):
+        """
+        False while the circuit is open. Once it has been open for long
+        enough, a single load is let through to probe the host.
+        """
+        if not self.open_until:
+            return True
+
+        if now < self.open_until or self.probing:
+            return False
+
+        self.probing = True
+
+        return True
+
+    async def acquire(self, limit, timeout):
+        """
+        Waits until fewer than limit loads of the host are fetching, and
+        returns for how many seconds. Raises asyncio.TimeoutError if that
+        takes longer than timeout.
+        """
+        if not limit or (self.active < limit and not self.waiting):
+            self.active += 1
+            return 0
+
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # released to this load as it stopped waiting
+                self.release()
+            raise
+
+        return time.perf_counter() - start
+
+    def release(self):
+        # hands the slot over to the first load still waiting
+        while self.waiting:
+            future = self.waiting.popleft()
+            if not future.done() and not future.get_loop().is_closed():
+                future.set_result(None)
+                return
+
+        self.active -= 1
+
+    def timeout(self, config):
+        """
+        Request timeout of the next load: the smoothed latency plus four
+        deviations, between HTTP_LOADER_MIN_REQUEST_TIMEOUT and
+        HTTP_LOADER_REQUEST_TIMEOUT.
+        """
+        ceiling = config.HTTP_LOADER_REQUEST_TIMEOUT
+        floor = config.HTTP_LOADER_MIN_REQUEST_TIMEOUT
+        if not floor or self.samples < MIN_LATENCY_SAMPLES:
+            return ceiling
+
+        return min(max(self.latency + 4 * self.deviation, floor), ceiling)
+
+    def observe(self, seconds):
+        if self.latency is None:
+            self.latency = seconds
+            self.deviation = seconds / 2
+        else:
+            error = seconds - self.latency
+            self.latency += error / 8
+            self.deviation += (abs(error) - self.deviation) / 4
+
+        self.samples += 1
+
+    def finished(self, config, metrics, response, timeout):
+        self.release()
+
+        if response is None:
+            # cancelled or never fetched, nothing was learned about the host
+            self.probing = False
+        elif response.code == 599 or response.code >= 500:
+            if response.code == 599:
+                # took at least that long, lets timeouts grow back
+                self.observe(timeout)
+                error = LoaderResult.ERROR_TIMEOUT
+            else:
+                error = LoaderResult.ERROR_UPSTREAM
+
+            if self.failed(error, config):
+                metrics.incr(self.metric("circuit_opened"))
+        else:
+            if response.request_time is not None:
+                self.observe(response.request_time)
+
+            if self.open_until:
+                metrics.incr(self.metric("circuit_closed"))
+
+            self.failures = 0
+            self.open_until = 0
+            self.probing = False
+
+        metrics.gauge(self.metric("active"), self.active)
+        metrics.gauge(self.metric("circuit"), 1 if self.open_until else 0)
+        if self.latency is not None:
+            metrics.gauge(self.metric("latency"), self.latency * 1000)
+
+    def failed(self, error, config):
+        """
+        Counts a 5xx or a timeout, returns True if that opened the circuit.
+        """
+        self.failures += 1
+        self.error = error
+
+        threshold = config.HTTP_LOADER_CIRCUIT_BREAKER_FAILURES
+        if not self.probing and (
+            self.open_until or not threshold or self.failures < threshold
+        ):
+            return False
+
+        self.probing = False
+        self.open_until = (
+            time.monotonic() + config.HTTP_LOADER_CIRCUIT_BREAKER_SECONDS
+        )
+
+        return True
+
+
+POOL = ClientPool()
+
+
+class BodyTooLarge(tornado.httpclient.HTTPClientError):
+    def __init__(self, message):
+        super().__init__(413, message)
+
+
+class StreamedBody:
+    """
+    Assembles a response body from the chunks it is downloaded in, into
+    a single buffer sized by its Content-Length. The download is aborted
+    as soon as the body is larger than max_size bytes, or as soon as its
+    header shows an image of more than max_pixels pixels.
+    """
+
+    def __init__(self, max_size, max_pixels):
+        self.max_size = max_size
+        self.max_pixels = max_pixels
+        self.code = None
+        self.headers = tornado.httputil.HTTPHeaders()
+        self.buffer = bytearray()
+        self.length = 0
+        self.size = None
+        # until the image size is known or MAX_HEADER_BYTES were read
+        self.sniffing = True
+        # the BodyTooLarge the download was aborted with
+        self.rejected = None
+
+    def reject(self, message):
+        self.rejected = BodyTooLarge(message)
+
+        raise self.rejected
+
+    def header_received(self, line):
+        if line.startswith("HTTP/"):
+            # headers of another response, after a redirect
+            status = line.split(None, 2)[1]
+            self.code = int(status) if status.isdigit() else None
+            self.headers = tornado.httputil.HTTPHeaders()
+        elif line.strip():
+            self.headers.parse_line(line)
+        elif self.code is not None and 200 <= self.code < 300:
+            self.expect(int(self.headers.get("Content-Length", 0)))
+
+    def expect(self, length):
+        if length > self.max_size:
+            self.reject(f"Content-Length {length} over {self.max_size}")
+
+        if length > len(self.buffer):
+            self.buffer = bytearray(length)
+
+    def data_received(self, chunk):
+        end = self.length + len(chunk)
+        if end > self.max_size:
+            self.reject(f"body over {self.max_size} bytes")
+
+        # in place within Content-Length, extends the buffer beyond it
+        self.buffer[self.length : end] = chunk  # NOQA
+        self.length = end
+
+        if self.sniffing:
+            self.sniff(end)
+
+    def sniff(self, end):
+        # through views, the buffer must not be copied for every chunk;
+        # released right away, a buffer with views cannot be resized
+        with memoryview(self.buffer) as view, view[
+            : min(end, MAX_HEADER_BYTES)
+        ] as header:
+            self.size = image_size(header)
+
+        if self.size is None:
+            self.sniffing = end < MAX_HEADER_BYTES
+            return
+
+        self.sniffing = False
+        width, height = self.size
+        if self.max_pixels and width * height > self.max_pixels:
+            self.reject(
+                f"{width}x{height} image over {self.max_pixels} pixels"
+            )
+
+    def response(self, response):
+        del self.buffer[self.length :]  # NOQA
+
+        return tornado.httpclient.HTTPResponse(
+            response.request,
+            response.code,
+            # the curl client leaves them to the header_callback
+            headers=response.headers or self.headers,
+            buffer=BytesIO(bytes(self.buffer)),
+            effective_url=response.effective_url,
+            error=response.error,
+            request_time=response.request_time,
+            time_info=response.time_info,
+            reason=response.reason,
+            start_time=response.start_time,
+        )
+
 
 def encode_url(url):
     if url == unquote(url):
@@ -72,6 +451,15 @@ def validate(context, url, normalize_url_func=_normalize_url):
     return False
 
 
+def _stale_original(context, url):
+    # contexts loading outside of a request have none
+    stale = getattr(getattr(context, "request", None), "stale_original", None)
+    if stale is None or not stale.is_for(url):
+        return None
+
+    return stale
+
+
 def return_contents(response, url, context, req_start=None):
     res = urlparse(url)
     netloc = res.netloc.replace(".", "_")
@@ -90,7 +478,13 @@ def return_contents(response, url, context, req_start=None):
     result = LoaderResult()
     context.metrics.incr(f"original_image.status.{code}")
     context.metrics.incr(f"original_image.status.{code}.{netloc}")
-    if response.error:
+    stale = _stale_original(context, url)
+    if code == 304 and stale is not None:
+        # the expired original the storage has is still current
+        stale.not_modified = True
+        result.buffer = stale.buffer
+        result.metadata.update(response.headers)
+    elif response.error:
         result.successful = False
         if response.code == 599:
             # Return a Gateway Timeout status downstream if upstream times out
@@ -139,19 +533,13 @@ async def load(
         and context.config.HTTP_LOADER_PROXY_PORT
     )
     if using_proxy or context.config.HTTP_LOADER_CURL_ASYNC_HTTP_CLIENT:
-        http_client_implementation = (
-            "tornado.curl_httpclient.CurlAsyncHTTPClient"
-        )
+        http_client_implementation = CURL_HTTP_CLIENT
         prepare_curl_callback = _get_prepare_curl_callback(context.config)
     else:
         http_client_implementation = None  # default
         prepare_curl_callback = None
 
-    tornado.httpclient.AsyncHTTPClient.configure(
-        http_client_implementation,
-        max_clients=context.config.HTTP_LOADER_MAX_CLIENTS,
-    )
-    client = tornado.httpclient.AsyncHTTPClient()
+    client = POOL.client(context.config, http_client_implementation)
 
     user_agent = None
     headers = {"Accept": "image/*;q=0.9,*/*;q=0.1"}
@@ -175,65 +563,183 @@ async def load(
     if user_agent is None and "User-Agent" not in headers:
         user_agent = context.config.HTTP_LOADER_DEFAULT_USER_AGENT
 
+    stale = _stale_original(context, url)
     url = normalize_url_func(url)
-    req = tornado.httpclient.HTTPRequest(
+    headers = _with_conditional_headers(headers, stale, url)
+
+    origin = POOL.origin(urlparse(url).netloc)
+    if not origin.admit(time.monotonic()):
+        # fails fast with a 502 or a 504, like its last failure
+        context.metrics.incr(origin.metric("circuit_open"))
+        return LoaderResult(
+            successful=False, error=origin.error, synthetic=True
+        )
+
+    try:
+        waited = await origin.acquire(
+            context.config.HTTP_LOADER_MAX_LOADS_PER_HOST,
+            context.config.HTTP_LOADER_REQUEST_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        origin.probing = False
+        context.metrics.incr(origin.metric("throttled"))
+        return LoaderResult(
+            successful=False, error=LoaderResult.ERROR_TIMEOUT, synthetic=True
+        )
+
+    request_timeout = origin.timeout(context.config)
+    response = None
+    try:
+        if waited:
+            context.metrics.timing(origin.metric("queued"), waited * 1000)
+
+        body = _streamed_body(context.config)
+        req = tornado.httpclient.HTTPRequest(
+            url=url,
+            headers=headers,
+            connect_timeout=context.config.HTTP_LOADER_CONNECT_TIMEOUT,
+            request_timeout=request_timeout,
+            follow_redirects=context.config.HTTP_LOADER_FOLLOW_REDIRECTS,
+            max_redirects=context.config.HTTP_LOADER_MAX_REDIRECTS,
+            user_agent=user_agent,
+            proxy_host=encode_fn(context.config.HTTP_LOADER_PROXY_HOST),
+            proxy_port=context.config.HTTP_LOADER_PROXY_PORT,
+            proxy_username=encode_fn(
+                context.config.HTTP_LOADER_PROXY_USERNAME
+            ),
+            proxy_password=encode_fn(
+                context.config.HTTP_LOADER_PROXY_PASSWORD
+            ),
+            ca_certs=encode_fn(context.config.HTTP_LOADER_CA_CERTS),
+            client_key=encode_fn(context.config.HTTP_LOADER_CLIENT_KEY),
+            client_cert=encode_fn(context.config.HTTP_LOADER_CLIENT_CERT),
+            validate_cert=context.config.HTTP_LOADER_VALIDATE_CERTS,
+            prepare_curl_callback=prepare_curl_callback,
+            header_callback=body.header_received if body else None,
+            streaming_callback=body.data_received if body else None,
+        )
+
+        if http_client_implementation is None:
+            # the default client never reuses connections
+            POOL.connection_opened()
+
+        response, start = await _fetch(client, req, context, body)
+    finally:
+        # also when failing before the fetch, the slot of the host
+        # must be released and a probe must not stay running
+        origin.finished(
+            context.config, context.metrics, response, request_timeout
+        )
+
+    if body is not None and body.rejected is not None:
+        return _rejected_result(context, origin, url, body.rejected)
+
+    if body is not None:
+        response = body.response(response)
+
+    return return_contents_fn(
+        response=response,
         url=url,
-        headers=headers,
-        connect_timeout=context.config.HTTP_LOADER_CONNECT_TIMEOUT,
-        request_timeout=context.config.HTTP_LOADER_REQUEST_TIMEOUT,
-        follow_redirects=context.config.HTTP_LOADER_FOLLOW_REDIRECTS,
-        max_redirects=context.config.HTTP_LOADER_MAX_REDIRECTS,
-        user_agent=user_agent,
-        proxy_host=encode_fn(context.config.HTTP_LOADER_PROXY_HOST),
-        proxy_port=context.config.HTTP_LOADER_PROXY_PORT,
-        proxy_username=encode_fn(context.config.HTTP_LOADER_PROXY_USERNAME),
-        proxy_password=encode_fn(context.config.HTTP_LOADER_PROXY_PASSWORD),
-        ca_certs=encode_fn(context.config.HTTP_LOADER_CA_CERTS),
-        client_key=encode_fn(context.config.HTTP_LOADER_CLIENT_KEY),
-        client_cert=encode_fn(context.config.HTTP_LOADER_CLIENT_CERT),
-        validate_cert=context.config.HTTP_LOADER_VALIDATE_CERTS,
-        prepare_curl_callback=prepare_curl_callback,
+        context=context,
+        req_start=start,
     )
 
+
+async def _fetch(client, req, context, body):
+    POOL.started(context.metrics, context.config.HTTP_LOADER_MAX_CLIENTS)
     start = datetime.datetime.now()
+    response = None
     try:
         response = await client.fetch(req, raise_error=True)
     except tornado.httpclient.HTTPClientError as err:
-        response = tornado.httpclient.HTTPResponse(
-            req, err.code, reason=err.message, start_time=start
-        )
+        # curl reports the streaming callbacks raising as a write error
+        err = getattr(body, "rejected", None) or err
+        response = _error_response(req, err, start)
     except socket.gaierror as err:
         response = tornado.httpclient.HTTPResponse(
             req, 599, reason=str(err), start_time=start
         )
+    finally:
+        POOL.finished(
+            context.metrics,
+            response,
+            (datetime.datetime.now() - start).total_seconds(),
+        )
 
-    return return_contents_fn(
-        response=response,
-        url=url,
-        context=context,
-        req_start=start,
+    return response, start
+
+
+def _with_conditional_headers(headers, stale, url):
+    if stale is None:
+        return headers
+
+    # return_contents gets the url as requested
+    stale.urls.add(url)
+    # a copy, forwarded headers are the ones of the request
+    headers = tornado.httputil.HTTPHeaders(headers)
+    headers.update(stale.conditional_headers())
+
+    return headers
+
+
+def _error_response(request, err, start):
+    # keeps the headers of the response, those of a 304 in particular
+    if err.response is None:
+        return tornado.httpclient.HTTPResponse(
+            request, err.code, reason=err.message, start_time=start
+        )
+
+    return tornado.httpclient.HTTPResponse(
+        request,
+        err.code,
+        headers=err.response.headers,
+        reason=err.message,
+        start_time=start,
+        request_time=err.response.request_time,
     )
 
 
-def _get_prepare_curl_callback(config):
-    if (
-        config.HTTP_LOADER_CURL_LOW_SPEED_TIME == 0
-        or config.HTTP_LOADER_CURL_LOW_SPEED_LIMIT == 0
-    ):
+def _streamed_body(config):
+    if not config.HTTP_LOADER_MAX_BODY_BYTES:
         return None
 
-    class CurlOpts:
-        def __init__(self, config):
-            self.config = config
+    return StreamedBody(config.HTTP_LOADER_MAX_BODY_BYTES, config.MAX_PIXELS)
 
-        def prepare_curl_callback(self, curl):
-            curl.setopt(
-                curl.LOW_SPEED_TIME,
-                self.config.HTTP_LOADER_CURL_LOW_SPEED_TIME,
-            )
-            curl.setopt(
-                curl.LOW_SPEED_LIMIT,
-                self.config.HTTP_LOADER_CURL_LOW_SPEED_LIMIT,
-            )
 
-    return CurlOpts(config).prepare_curl_callback
+def _rejected_result(context, origin, url, rejection):
+    logger.warning("ERROR retrieving image %s: %s", url, rejection)
+    context.metrics.incr(origin.metric("too_large"))
+
+    return LoaderResult(successful=False, error=LoaderResult.ERROR_TOO_LARGE)
+
+
+def _get_prepare_curl_callback(config):
+    return _curl_opts(
+        config.HTTP_LOADER_CURL_LOW_SPEED_TIME,
+        config.HTTP_LOADER_CURL_LOW_SPEED_LIMIT,
+        config.HTTP_LOADER_KEEP_ALIVE_SECONDS,
+    ).prepare_curl_callback
+
+
+@lru_cache(maxsize=None)
+def _curl_opts(low_speed_time, low_speed_limit, keep_alive_seconds):
+    # built once per settings, not for every load
+    return CurlOpts(low_speed_time, low_speed_limit, keep_alive_seconds)
+
+
+class CurlOpts:
+    def __init__(self, low_speed_time, low_speed_limit, keep_alive_seconds):
+        self.low_speed_time = low_speed_time
+        self.low_speed_limit = low_speed_limit
+        self.keep_alive_seconds = keep_alive_seconds
+
+    def prepare_curl_callback(self, curl):
+        if self.low_speed_time and self.low_speed_limit:
+            curl.setopt(curl.LOW_SPEED_TIME, self.low_speed_time)
+            curl.setopt(curl.LOW_SPEED_LIMIT, self.low_speed_limit)
+
+        curl.setopt(curl.TCP_KEEPALIVE, 1)
+        if self.keep_alive_seconds:
+            curl.setopt(curl.MAXAGE_CONN, self.keep_alive_seconds)
+
+        curl.setopt(curl.SOCKOPTFUNCTION, POOL.connection_opened)
@@ -22,6 +22,15 @@ def _return_contents(response, url, context, req_start=None):
     if cacheTTL is not None:
         context.request.max_age_shared = int(cacheTTL)
         
+    validators = {
+        name: result.metadata[name]
+        for name in ("Etag", "Last-Modified")
+        if name in result.metadata
+    }
+    # for the storage to revalidate the original with once expired,
+    # the ones of an earlier load of the request must not be stored
+    context.request.original_validators = validators or None
+
     cache_control = result.metadata.get("Cache-Control")
     if cache_control is not None:
         _update_max_age(context, cache_control)
@@ -21,3 +21,9 @@ class BaseMetrics:
 
     def timing(self, metricname, value):
         raise NotImplementedError()
+
+    def gauge(self, metricname, value):
+        """
+        Reports the current value of something, like a pool size.
+        Not required, metrics backends without gauges ignore them.
+        """
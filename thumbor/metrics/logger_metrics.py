@@ -18,3 +18,6 @@ class Metrics(BaseMetrics):
 
     def timing(self, metricname, value):
         logger.debug("METRICS: timing: %s:%d", metricname, value)
+
+    def gauge(self, metricname, value):
+        logger.debug("METRICS: gauge: %s:%d", metricname, value)
@@ -48,3 +48,9 @@ class Metrics(BaseMetrics):
 
         cl.timing(metricname, value)
 
+    def gauge(self, metricname, value):
+        cl = Metrics.client(self.config)
+        if cl == None:
+            return
+
+        cl.gauge(metricname, value)
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import time
+from collections import OrderedDict
+
+from thumbor.loaders import LoaderResult
+
+# setting of how long each loader error is remembered
+TTL_SETTINGS = {
+    LoaderResult.ERROR_NOT_FOUND: "NEGATIVE_CACHE_NOT_FOUND_SECONDS",
+    LoaderResult.ERROR_UPSTREAM: "NEGATIVE_CACHE_UPSTREAM_SECONDS",
+    LoaderResult.ERROR_TIMEOUT: "NEGATIVE_CACHE_TIMEOUT_SECONDS",
+}
+
+
+class NegativeCache:
+    """
+    Loader failures remembered per url for a little while, so requests
+    for a broken source fail at once instead of loading it again. The
+    urls that failed least recently are forgotten first.
+    """
+
+    @classmethod
+    def instance(cls, max_entries):
+        """
+        Returns the NegativeCache shared by every request of this process.
+        """
+        if not getattr(cls, "_instances", None):
+            cls._instances = {}
+
+        if max_entries not in cls._instances:
+            cls._instances[max_entries] = NegativeCache(max_entries)
+
+        return cls._instances[max_entries]
+
+    @classmethod
+    def reset(cls):
+        cls._instances = None
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        # url -> (loader error, monotonic time it is forgotten at)
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, url, now=None):
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+
+        error, expires_at = entry
+        if (time.monotonic() if now is None else now) >= expires_at:
+            del self.entries[url]
+            return None
+
+        return error
+
+    def put(self, url, error, ttl, now=None):
+        self.entries.pop(url, None)
+        self.entries[url] = (
+            error,
+            (time.monotonic() if now is None else now) + ttl,
+        )
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def purge(self, url=None):
+        """
+        Forgets the failure of url, or every failure without a url.
+        """
+        if url is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(url, None)
+
+
+def for_context(context):
+    return NegativeCache.instance(context.config.NEGATIVE_CACHE_MAX_ENTRIES)
+
+
+async def load(context, url):
+    """
+    Loads url with the loader of context, unless loading it failed less
+    than the TTL of that error ago: the same error is returned then.
+    """
+    cache = for_context(context)
+    error = cache.get(url)
+    if error is not None:
+        context.metrics.incr("original_image.negative_cache.hit")
+
+        return LoaderResult(successful=False, error=error)
+
+    result = await context.modules.loader.load(context, url)
+
+    if (
+        isinstance(result, LoaderResult)
+        and not result.successful
+        # throttled or failing fast, the origin was not asked
+        and not result.synthetic
+    ):
+        setting = TTL_SETTINGS.get(result.error)
+        ttl = getattr(context.config, setting) if setting else 0
+        if ttl:
+            cache.put(url, result.error, ttl)
+            context.metrics.incr("original_image.negative_cache.put")
+
+    return result
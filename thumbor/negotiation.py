@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+from functools import lru_cache
+
+# output formats a request can negotiate through its Accept header
+WEBP = 1
+AVIF = 2
+HEIF = 4
+JPG = 8
+PNG = 16
+
+ACCEPTED_TYPES = {
+    "image/webp": WEBP,
+    "image/avif": AVIF,
+    "image/heif": HEIF,
+    "image/jpg": JPG,
+    "image/jpeg": JPG,
+    "*/*": JPG,
+    "image/png": PNG,
+}
+
+# setting enabling each format, and its name in variant keys
+FORMATS = (
+    (WEBP, "AUTO_WEBP", "webp"),
+    (AVIF, "AUTO_AVIF", "avif"),
+    (HEIF, "AUTO_HEIF", "heif"),
+    (JPG, "AUTO_JPG", "jpg"),
+    (PNG, "AUTO_PNG", "png"),
+)
+
+
+@lru_cache(maxsize=1024)
+def parse_accept(header):
+    """
+    Returns the formats accepted by the Accept header as a bitmask.
+    Clients send a handful of distinct headers, so they are cached.
+    """
+    accepts = 0
+    for media_range in header.split(","):
+        media_type = media_range.split(";", 1)[0].strip().lower()
+        accepts |= ACCEPTED_TYPES.get(media_type, 0)
+
+    return accepts
+
+
+def capabilities(config, accepts):
+    """
+    Formats both accepted by the client and enabled by the config.
+    """
+    enabled = 0
+    for bit, setting, _ in FORMATS:
+        if getattr(config, setting, False):
+            enabled |= bit
+
+    return accepts & enabled
+
+
+@lru_cache(maxsize=None)
+def variant_key(capability_mask):
+    """
+    Canonical name of what a request negotiated: requests with the same
+    key get the same result for the same url.
+    """
+    if capability_mask == 0:
+        return "default"
+
+    return "auto_" + "_".join(
+        name for bit, _, name in FORMATS if capability_mask & bit
+    )
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import re
+
+from thumbor.engines import BaseEngine
+
+# mime types are stored as their position in this tuple, only append to it
+MIMES = (
+    None,
+    "image/jpeg",
+    "image/png",
+    "image/gif",
+    "image/webp",
+    "image/avif",
+    "image/heif",
+    "image/svg+xml",
+    "image/tiff",
+    "image/jp2",
+    "video/mp4",
+    "video/webm",
+    "application/json",
+    "text/javascript",
+)
+MIME_CODES = {mime: code for code, mime in enumerate(MIMES)}
+
+ANIMATED = 1
+
+ETAG_RE = re.compile(r'(?:W/)?"((?:[0-9a-f]{2})+)"')
+
+
+class ResultDescriptor:
+    """
+    What writing a result needs to know about its bytes. Computed once
+    when the result is encoded and stored along with it, so serving it
+    again does not sniff the bytes.
+    """
+
+    def __init__(
+        self,
+        mime,
+        animated=False,
+        width=0,
+        height=0,
+        length=0,
+        digest=None,
+        hasher=None,
+    ):
+        self.mime = mime
+        self.animated = animated
+        self.width = width
+        self.height = height
+        self.length = length
+        # digest of the bytes by the file cache hasher, the ETag
+        self.digest = digest
+        # name of the hasher of digest, not stored: only known for new
+        # results, whose digest the file cache then does not compute again
+        self.hasher = hasher
+
+    @classmethod
+    def for_buffer(cls, buffer, width=0, height=0):
+        mime = BaseEngine.get_mimetype(buffer)
+
+        return cls(
+            mime,
+            mime == "image/gif" and is_animated_gif(buffer),
+            width,
+            height,
+            len(buffer),
+        )
+
+    @classmethod
+    def from_fields(
+        cls, mime_code, flags, digest_length, width, height, digest, length=0
+    ):
+        """
+        Reverse of fields, None if nothing was stored.
+        """
+        if not mime_code or mime_code >= len(MIMES):
+            return None
+
+        return cls(
+            MIMES[mime_code],
+            bool(flags & ANIMATED),
+            width,
+            height,
+            length,
+            digest[:digest_length] if digest_length else None,
+        )
+
+    def fields(self):
+        """
+        Returns (mime code, flags, digest length, width, height, digest),
+        the length is the size of what is stored.
+        """
+        digest = self.digest or b""
+
+        return (
+            MIME_CODES.get(self.mime, 0),
+            ANIMATED if self.animated else 0,
+            len(digest),
+            self.width,
+            self.height,
+            digest,
+        )
+
+    @property
+    def etag(self):
+        if not self.digest:
+            return None
+
+        return f'"{self.digest.hex()}"'
+
+    def with_length(self, length):
+        return ResultDescriptor(
+            self.mime,
+            self.animated,
+            self.width,
+            self.height,
+            length,
+            self.digest,
+            self.hasher,
+        )
+
+    def with_digest(self, digest, hasher=None):
+        return ResultDescriptor(
+            self.mime,
+            self.animated,
+            self.width,
+            self.height,
+            self.length,
+            digest,
+            hasher,
+        )
+
+
+def etag_digests(if_none_match):
+    """
+    Digests of the ETags listed by an If-None-Match header, weak or not.
+    Only ETags tornado's check_etag_header would match are listed.
+    """
+    return frozenset(
+        bytes.fromhex(etag) for etag in ETAG_RE.findall(if_none_match)
+    )
+
+
+def is_animated_gif(data):
+    if data[:6] not in [b"GIF87a", b"GIF89a"]:
+        return False
+    i = 10  # skip header
+    frames = 0
+
+    def skip_color_table(i, flags):
+        if flags & 0x80:
+            i += 3 << ((flags & 7) + 1)
+
+        return i
+
+    flags = data[i]
+    i = skip_color_table(i + 3, flags)
+
+    while frames < 2:
+        block = data[i : i + 1]  # NOQA
+        i += 1
+
+        if block == b"\x3B":
+            break
+
+        if block == b"\x21":
+            i += 1
+        elif block == b"\x2C":
+            frames += 1
+            i += 8
+            i = skip_color_table(i + 1, data[i])
+            i += 1
+        else:
+            return False
+
+        while True:
+            j = data[i]
+            i += 1
+
+            if not j:
+                break
+            i += j
+
+    return frames > 1
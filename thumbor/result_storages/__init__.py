@@ -36,6 +36,64 @@ class ResultStorageResult(LoaderResult):
             else BaseEngine.get_mimetype(self.buffer)
         )
 
+    @property
+    def descriptor(self):
+        """
+        ResultDescriptor the result was stored with, if available
+        :return:
+        """
+        return self.metadata.get("Descriptor", None)
+
+    @property
+    def stale(self):
+        """
+        Whether the result expired but may still be served
+        :return:
+        """
+        return self.metadata.get("Stale", False)
+
+    @property
+    def revalidate(self):
+        """
+        Whether the request serving a stale result should regenerate it
+        :return:
+        """
+        return self.metadata.get("Revalidate", False)
+
+    @property
+    def stale_if_error(self):
+        """
+        Whether the stale result may only be served if regenerating it fails
+        :return:
+        """
+        return self.metadata.get("StaleIfError", False)
+
+    @property
+    def not_modified(self):
+        """
+        Whether the storage did not read the result since the client
+        has it, buffer is then empty
+        :return:
+        """
+        return self.metadata.get("NotModified", False)
+
+    @property
+    def stream(self):
+        """
+        Open file to stream the result from, if the storage did not read
+        it. buffer then only holds the first bytes.
+        :return:
+        """
+        return self.metadata.get("Stream", None)
+
+    def close(self):
+        """
+        Closes the stream, if any
+        :return:
+        """
+        if self.stream is not None:
+            self.stream.close()
+
     def __len__(self):
         return (
             self.metadata["ContentLength"]
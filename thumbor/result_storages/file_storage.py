@@ -18,12 +18,14 @@ from uuid import uuid4
 import pytz
 
 from thumbor.engines import BaseEngine
+from thumbor.file_io import FileIOStorageMixin
 from thumbor.result_storages import BaseStorage, ResultStorageResult
 from thumbor.utils import deprecated, logger
 
 
-class Storage(BaseStorage):
+class Storage(FileIOStorageMixin, BaseStorage):
     PATH_FORMAT_VERSION = "v2"
+    IO_METRIC = "result_storage"
 
     @property
     def is_auto_webp(self):
@@ -39,20 +41,8 @@ class Storage(BaseStorage):
                 file_abspath,
             )
             return
-        temp_abspath = f"{file_abspath}.{str(uuid4()).replace('-', '')}"
-        file_dir_abspath = dirname(file_abspath)
-        logger.debug(
-            "[RESULT_STORAGE] putting at %s (%s)",
-            file_abspath,
-            file_dir_abspath,
-        )
 
-        self.ensure_dir(file_dir_abspath)
-
-        with open(temp_abspath, "wb") as _file:
-            _file.write(image_bytes)
-
-        move(temp_abspath, file_abspath)
+        await self.run_io("put", self.write_file, file_abspath, image_bytes)
 
     async def get(self):
         path = self.context.request.url
@@ -67,6 +57,45 @@ class Storage(BaseStorage):
 
         logger.debug("[RESULT_STORAGE] getting from %s", file_abspath)
 
+        found = await self.run_io("get", self.read_file, path, file_abspath)
+        if found is None:
+            return None
+
+        buffer, mtime = found
+        result = ResultStorageResult(
+            buffer=buffer,
+            metadata={
+                "LastModified": datetime.fromtimestamp(mtime).replace(
+                    tzinfo=pytz.utc
+                ),
+                "ContentLength": len(buffer),
+                "ContentType": BaseEngine.get_mimetype(buffer),
+            },
+        )
+
+        return result
+
+    def write_file(self, file_abspath, image_bytes):
+        temp_abspath = f"{file_abspath}.{str(uuid4()).replace('-', '')}"
+        file_dir_abspath = dirname(file_abspath)
+        logger.debug(
+            "[RESULT_STORAGE] putting at %s (%s)",
+            file_abspath,
+            file_dir_abspath,
+        )
+
+        self.ensure_dir(file_dir_abspath)
+
+        with open(temp_abspath, "wb") as _file:
+            _file.write(image_bytes)
+
+        move(temp_abspath, file_abspath)
+
+    def read_file(self, path, file_abspath):
+        """
+        Returns the stored image and its mtime, or None if there is no
+        fresh image for path.
+        """
         if isdir(file_abspath):
             logger.warning(
                 "[RESULT_STORAGE] cache location is a directory: %s",
@@ -96,18 +125,7 @@ class Storage(BaseStorage):
         with open(file_abspath, "rb") as image_file:
             buffer = image_file.read()
 
-        result = ResultStorageResult(
-            buffer=buffer,
-            metadata={
-                "LastModified": datetime.fromtimestamp(
-                    getmtime(file_abspath)
-                ).replace(tzinfo=pytz.utc),
-                "ContentLength": len(buffer),
-                "ContentType": BaseEngine.get_mimetype(buffer),
-            },
-        )
-
-        return result
+        return buffer, getmtime(file_abspath)
 
     def validate_path(self, path):
         return abspath(path).startswith(
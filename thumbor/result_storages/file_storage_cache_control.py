@@ -8,7 +8,6 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2011 globo.com thumbor@googlegroups.com
 
-import hashlib
 from datetime import datetime
 from os.path import getmtime
 from urllib.parse import unquote
@@ -16,18 +15,36 @@ from urllib.parse import unquote
 import pytz
 
 from thumbor.engines import BaseEngine
+from thumbor.file_io import FileIOStorageMixin
+from thumbor.negotiation import capabilities, variant_key
+from thumbor.result_descriptor import etag_digests
 from thumbor.result_storages import BaseStorage, ResultStorageResult
 from thumbor.utils import deprecated, logger
-from thumbor.cache.file_cache import FileCache 
+from thumbor.cache.file_cache import FileCache
+from thumbor.cache.hasher import get_hasher
+from thumbor.cache.write_behind import WriteBehind 
 
-class Storage(BaseStorage):
+class Storage(FileIOStorageMixin, BaseStorage):
     PATH_FORMAT_VERSION = "v2"
+    IO_METRIC = "result_storage"
+    _cache = None
 
     @property
     def cache(self):
-        return FileCache("RESULT_STORAGE", 
-                         self.context.config.RESULT_STORAGE_FILE_STORAGE_ROOT_PATH.rstrip("/"),
-                         0)
+        if self._cache is None:
+            self._cache = FileCache.instance("RESULT_STORAGE",
+                                             self.context.config.RESULT_STORAGE_FILE_STORAGE_ROOT_PATH,
+                                             0,
+                                             self.context.config.RESULT_STORAGE_MEMORY_CACHE_MAX_BYTES,
+                                             self.context.config.FILE_CACHE_FSYNC,
+                                             WriteBehind.for_config(self.context.config),
+                                             link_depth=2,
+                                             hasher=get_hasher(self.context.config.FILE_CACHE_HASHER),
+                                             legacy_hasher=get_hasher(self.context.config.FILE_CACHE_LEGACY_HASHER),
+                                             jitter=self.context.config.RESULT_STORAGE_EXPIRATION_JITTER,
+                                             early_refresh=self.context.config.RESULT_STORAGE_EARLY_REFRESH_SECONDS)
+
+        return self._cache
 
     @property
     def is_auto_webp(self):
@@ -43,10 +60,14 @@ class Storage(BaseStorage):
 
         symlink_abspath = self.normalize_path(self.context.request.url)
         try:
-            self.cache.put(symlink_abspath, 
-                           image_bytes, 
-                           self.context.request.max_age,
-                           self.context.request.max_age_shared)
+            await self.run_io("put",
+                              self.cache.put_behind,
+                              symlink_abspath,
+                              image_bytes,
+                              self.context.request.max_age,
+                              self.context.request.max_age_shared,
+                              self.context.metrics,
+                              self.context.request.result_descriptor)
         except IOError as e:
             logger.error("[RESULT_STORAGE] error persisting item to result cache: %s", e.strerror)
 
@@ -58,7 +79,20 @@ class Storage(BaseStorage):
 
         path = self.context.request.url
         file_abspath = self.normalize_path(path)
-        res = self.cache.get(file_abspath)
+        stale_while_revalidate = self.context.config.RESULT_STORAGE_STALE_WHILE_REVALIDATE_SECONDS
+        stale_if_error = self.context.config.RESULT_STORAGE_STALE_IF_ERROR_SECONDS
+
+        res = self.cache.get_from_memory(file_abspath, self.context.metrics)
+        if res is None:
+            res = await self.run_io("get",
+                                    self.cache.get_from_disk,
+                                    file_abspath,
+                                    self.context.metrics,
+                                    self.legacy_paths(path),
+                                    max(stale_while_revalidate, stale_if_error),
+                                    self.context.config.RESULT_STORAGE_STREAMING_MIN_BYTES,
+                                    self.if_none_match())
+
         if not res.found:
             return None
 
@@ -66,28 +100,85 @@ class Storage(BaseStorage):
             self.context.request.max_age = res.max_age
             self.context.request.max_age_shared = res.max_age_shared
 
-        return ResultStorageResult(
-            buffer=res.data,
-            metadata={
-                "LastModified": datetime.fromtimestamp(getmtime(file_abspath)).replace(
-                    tzinfo=pytz.utc
-                ),
-                "ContentLength": len(res.data),
-                "ContentType": BaseEngine.get_mimetype(res.data),
-            },
-        )
+        metadata = {
+            "LastModified": datetime.fromtimestamp(res.last_modified).replace(
+                tzinfo=pytz.utc
+            ),
+            "ContentLength": res.size,
+        }
+
+        if res.descriptor is not None:
+            metadata["ContentType"] = res.descriptor.mime
+            metadata["Descriptor"] = res.descriptor
+        else:
+            metadata["ContentType"] = BaseEngine.get_mimetype(res.data)
+
+        if res.not_modified:
+            metadata["NotModified"] = True
+
+        if res.file is not None:
+            self.context.metrics.incr("result_storage.streamed")
+            metadata["Stream"] = res.file
+
+        if res.stale_for:
+            metadata["Stale"] = True
+            if res.stale_for <= stale_while_revalidate:
+                metadata["Revalidate"] = self.cache.claim_revalidation(file_abspath)
+            else:
+                metadata["StaleIfError"] = True
+
+        return ResultStorageResult(buffer=res.data, metadata=metadata)
+
+
+    def if_none_match(self):
+        """
+        Digests the client has the result for, their entries are not read.
+        """
+        handler = self.context.request_handler
+        if not self.context.config.ENABLE_ETAGS or handler is None:
+            return frozenset()
+
+        header = handler.request.headers.get("If-None-Match")
+        if not header:
+            return frozenset()
+
+        return etag_digests(header)
+
+
+    async def remove(self, path):
+        """
+        Purges every stored variant of path.
+        """
+        await self.run_io("remove", self.cache.remove_variants, unquote(path))
 
 
     def normalize_path(self, path):
-        digest = hashlib.sha1(unquote(path).encode("utf-8")).hexdigest()
-
-        return "%s/%s/%s/%s/%s" % (
-            self.context.config.RESULT_STORAGE_FILE_STORAGE_ROOT_PATH.rstrip("/"),
-            "auto_webp" if self.is_auto_webp else "default",
-            digest[:2],
-            digest[2:4],
-            digest[4:],
-        )
+        return self.cache.link_path(unquote(path), self.path_prefix)
+
+
+    def legacy_paths(self, path):
+        """
+        Where path may have been stored before: with the legacy hasher and
+        under "auto_webp" or "default", the only directories of the layout
+        before negotiated variants. Without them, enabling AUTO_JPG, say,
+        would move every browser sending */* to a cold directory.
+        """
+        key = unquote(path)
+        paths = [self.cache.legacy_link_path(key, self.path_prefix)]
+
+        previous_prefix = "auto_webp" if self.is_auto_webp else "default"
+        if previous_prefix != self.path_prefix:
+            paths.append(self.cache.link_path(key, previous_prefix))
+            paths.append(self.cache.legacy_link_path(key, previous_prefix))
+
+        return [legacy_path for legacy_path in paths if legacy_path is not None]
+
+
+    @property
+    def path_prefix(self):
+        # one directory per negotiated format class, "default" and
+        # "auto_webp" are the ones of the previous layout
+        return variant_key(capabilities(self.context.config, self.context.request.accepts))
 
 
     @deprecated("Use result's last_modified instead")
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor imaging service
+# https://github.com/thumbor/thumbor/wiki
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2023 Mauve Mailorder Software
+
+import asyncio
+import fcntl
+import hashlib
+import os
+import time
+
+# how often a process waiting on another one's lock checks it again
+LOCK_POLL_SECONDS = 0.05
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time. Callers asking for a key while its
+    call is running get that call's result, or its exception, instead of
+    making their own.
+    """
+
+    def __init__(self):
+        self.calls = {}
+
+    def __len__(self):
+        return len(self.calls)
+
+    async def run(self, key, operation, *args):
+        """
+        Returns the result of operation(*args) and whether it was shared
+        with a call another caller started.
+        """
+        future = self.calls.get(key)
+        if future is not None:
+            # a waiter giving up must not cancel the call for the others
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        try:
+            result = await operation(*args)
+        except Exception as error:
+            future.set_exception(error)
+            # nobody may be waiting, do not warn about it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self.calls[key]
+            # cancelled, the waiters are cancelled too
+            if not future.done():
+                future.cancel()
+
+
+class FileLock:
+    """
+    flock on a file per key, so worker processes of the same host can
+    take turns. Files are removed on release; acquiring checks that the
+    locked file is still the one at the path.
+    """
+
+    def __init__(self, dir_path, key):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        self.path = os.path.join(dir_path, f"{name}.lock")
+        self.fd = None
+
+    def try_acquire(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    self.fd = fd
+                    return True
+            except FileNotFoundError:
+                pass
+
+            # released and removed while we were opening it
+            os.close(fd)
+
+    async def acquire(self, timeout):
+        """
+        Waits up to timeout seconds for the lock, without blocking the
+        IOLoop. Returns False if it could not be acquired in time.
+        """
+        deadline = time.monotonic() + timeout
+        while not self.try_acquire():
+            if time.monotonic() >= deadline:
+                return False
+
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+        os.close(self.fd)
+        self.fd = None
@@ -17,24 +17,14 @@ from shutil import move
 from uuid import uuid4
 
 from thumbor import storages
+from thumbor.file_io import FileIOStorageMixin
 from thumbor.utils import logger
 
 
-class Storage(storages.BaseStorage):
+class Storage(FileIOStorageMixin, storages.BaseStorage):
     async def put(self, path, file_bytes):
         file_abspath = self.path_on_filesystem(path)
-        temp_abspath = f"{file_abspath}.{str(uuid4()).replace('-', '')}"
-        file_dir_abspath = dirname(file_abspath)
-
-        logger.debug("creating tempfile for %s in %s...", path, temp_abspath)
-
-        self.ensure_dir(file_dir_abspath)
-
-        with open(temp_abspath, "wb") as _file:
-            _file.write(file_bytes)
-
-        logger.debug("moving tempfile %s to %s...", temp_abspath, file_abspath)
-        move(temp_abspath, file_abspath)
+        await self.run_io("put", self.write_file, file_abspath, file_bytes)
 
         return path
 
@@ -43,9 +33,6 @@ class Storage(storages.BaseStorage):
             return
 
         file_abspath = self.path_on_filesystem(path)
-        file_dir_abspath = dirname(file_abspath)
-
-        self.ensure_dir(file_dir_abspath)
 
         if not self.context.server.security_key:
             raise RuntimeError(
@@ -54,15 +41,12 @@ class Storage(storages.BaseStorage):
             )
 
         crypto_path = f"{splitext(file_abspath)[0]}.txt"
-        temp_abspath = f"{crypto_path}.{str(uuid4()).replace('-', '')}"
-        with open(temp_abspath, "wb") as _file:
-            try:
-                security_key = self.context.server.security_key.encode()
-            except (UnicodeDecodeError, AttributeError):
-                security_key = self.context.server.security_key
-            _file.write(security_key)
+        try:
+            security_key = self.context.server.security_key.encode()
+        except (UnicodeDecodeError, AttributeError):
+            security_key = self.context.server.security_key
 
-        move(temp_abspath, crypto_path)
+        await self.run_io("put_crypto", self.write_file, crypto_path, security_key)
         logger.debug(
             "Stored crypto at %s (security key: %s)",
             crypto_path,
@@ -75,51 +59,61 @@ class Storage(storages.BaseStorage):
         file_abspath = self.path_on_filesystem(path)
 
         path = f"{splitext(file_abspath)[0]}.detectors.txt"
-        temp_abspath = f"{path}.{str(uuid4()).replace('-', '')}"
-
-        file_dir_abspath = dirname(file_abspath)
-        self.ensure_dir(file_dir_abspath)
-
-        with open(temp_abspath, "w", encoding="utf-8") as _file:
-            _file.write(dumps(data))
-
-        move(temp_abspath, path)
+        await self.run_io(
+            "put_detector_data",
+            self.write_file,
+            path,
+            dumps(data).encode("utf-8"),
+        )
 
         return file_abspath
 
     async def get(self, path):
         abs_path = self.path_on_filesystem(path)
-
-        resource_available = await self.exists(
-            path, path_on_filesystem=abs_path
-        )
-        if not resource_available:
-            return None
-
-        with open(self.path_on_filesystem(path), "rb") as source_file:
-            return source_file.read()
+        return await self.run_io("get", self.read_file, abs_path)
 
     async def get_crypto(self, path):
         file_abspath = self.path_on_filesystem(path)
         crypto_file = f"{splitext(file_abspath)[0]}.txt"
 
-        if not exists(crypto_file):
+        crypto = await self.run_io("get_crypto", self.read_file, crypto_file, False)
+        if crypto is None:
             return None
 
-        with open(crypto_file, "r", encoding="utf-8") as crypto_f:
-            return crypto_f.read()
+        return crypto.decode("utf-8")
 
     async def get_detector_data(self, path):
         file_abspath = self.path_on_filesystem(path)
         path = f"{splitext(file_abspath)[0]}.detectors.txt"
 
-        resource_available = await self.exists(path, path_on_filesystem=path)
+        data = await self.run_io("get_detector_data", self.read_file, path)
+        if data is None:
+            return None
 
-        if not resource_available:
+        return loads(data.decode("utf-8"))
+
+    def write_file(self, file_abspath, data):
+        temp_abspath = f"{file_abspath}.{str(uuid4()).replace('-', '')}"
+
+        logger.debug("creating tempfile for %s...", temp_abspath)
+
+        self.ensure_dir(dirname(file_abspath))
+
+        with open(temp_abspath, "wb") as _file:
+            _file.write(data)
+
+        logger.debug("moving tempfile %s to %s...", temp_abspath, file_abspath)
+        move(temp_abspath, file_abspath)
+
+    def read_file(self, file_abspath, check_expiration=True):
+        if not exists(file_abspath):
             return None
 
-        with open(path, "r", encoding="utf-8") as detector_file:
-            return loads(detector_file.read())
+        if check_expiration and self.__is_expired(file_abspath):
+            return None
+
+        with open(file_abspath, "rb") as source_file:
+            return source_file.read()
 
     def path_on_filesystem(self, path):
         digest = hashlib.sha1(path.encode("utf-8")).hexdigest()
@@ -131,13 +125,16 @@ class Storage(storages.BaseStorage):
     ):  # pylint: disable=arguments-differ
         if path_on_filesystem is None:
             path_on_filesystem = self.path_on_filesystem(path)
-        return os.path.exists(path_on_filesystem) and not self.__is_expired(
-            path_on_filesystem
+        return await self.run_io(
+            "exists", self.is_available, path_on_filesystem
         )
 
     async def remove(self, path):
         n_path = self.path_on_filesystem(path)
-        return os.remove(n_path)
+        return await self.run_io("remove", os.remove, n_path)
+
+    def is_available(self, path):
+        return os.path.exists(path) and not self.__is_expired(path)
 
     def __is_expired(self, path):
         if self.context.config.STORAGE_EXPIRATION_SECONDS is None:
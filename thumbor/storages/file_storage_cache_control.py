@@ -8,24 +8,38 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2011 globo.com thumbor@googlegroups.com
 
-import hashlib
 from json import dumps, loads
 from os.path import dirname, splitext
 from shutil import move
 from uuid import uuid4
 
 from thumbor.cache.file_cache import FileCache
+from thumbor.cache.hasher import get_hasher
+from thumbor.cache.write_behind import WriteBehind
+from thumbor.file_io import FileIOStorageMixin
+from thumbor.loaders import StaleOriginal
 import thumbor.storages as storages
 from thumbor.utils import logger
 
 
-class Storage(storages.BaseStorage):
+class Storage(FileIOStorageMixin, storages.BaseStorage):
+    _cache = None
 
     @property
     def cache(self):
-        return FileCache("STORAGE", 
-                         self.context.config.FILE_STORAGE_ROOT_PATH.rstrip("/"), 
-                         self.context.config.get("STORAGE_EXPIRATION_SECONDS", None))
+        if self._cache is None:
+            self._cache = FileCache.instance("STORAGE",
+                                             self.context.config.FILE_STORAGE_ROOT_PATH,
+                                             self.context.config.get("STORAGE_EXPIRATION_SECONDS", None),
+                                             self.context.config.STORAGE_MEMORY_CACHE_MAX_BYTES,
+                                             self.context.config.FILE_CACHE_FSYNC,
+                                             WriteBehind.for_config(self.context.config),
+                                             hasher=get_hasher(self.context.config.FILE_CACHE_HASHER),
+                                             legacy_hasher=get_hasher(self.context.config.FILE_CACHE_LEGACY_HASHER),
+                                             jitter=self.context.config.STORAGE_EXPIRATION_JITTER,
+                                             early_refresh=self.context.config.STORAGE_EARLY_REFRESH_SECONDS)
+
+        return self._cache
 
 
     async def put(self, path, file_bytes):
@@ -36,11 +50,36 @@ class Storage(storages.BaseStorage):
             return
 
         file_abspath = self.path_on_filesystem(path)
+        max_age = self.context.request.max_age
+        max_age_shared = self.context.request.max_age_shared
+        stale = self.context.request.stale_original
+        validators = None
+        if self.context.config.STORAGE_REVALIDATION_SECONDS:
+            # none removes the ones of the original this one replaces
+            validators = self.context.request.original_validators or {}
+
         try:
-            self.cache.put(file_abspath, 
-                           file_bytes, 
-                           self.context.request.max_age, 
-                           self.context.request.max_age_shared)
+            refreshed = False
+            if stale is not None and stale.is_for(path) and stale.not_modified:
+                # unchanged at the origin, only its expiration is written
+                refreshed = await self.run_io("refresh",
+                                              self.cache.refresh,
+                                              file_abspath,
+                                              max_age,
+                                              max_age_shared,
+                                              self.context.metrics,
+                                              validators)
+
+            if not refreshed:
+                await self.run_io("put",
+                                  self.cache.put_behind,
+                                  file_abspath,
+                                  file_bytes,
+                                  max_age,
+                                  max_age_shared,
+                                  self.context.metrics,
+                                  None,
+                                  validators)
         except IOError as e:
             logger.error("[STORAGE] error persisting cache item: %s", e.strerror)
             return
@@ -54,56 +93,71 @@ class Storage(storages.BaseStorage):
             return None
 
         abs_path = self.path_on_filesystem(path)
-        res = self.cache.get(abs_path)
+        revalidation_seconds = self.context.config.STORAGE_REVALIDATION_SECONDS
+        res = self.cache.get_from_memory(abs_path, self.context.metrics)
+        if res is None:
+            res = await self.run_io("get",
+                                    self.cache.get_from_disk,
+                                    abs_path,
+                                    self.context.metrics,
+                                    self.cache.legacy_link_path(path),
+                                    revalidation_seconds)
+
         if not res.found:
             return None
 
+        if res.stale_for:
+            # expired, the loader may revalidate it instead of loading it
+            validators = await self.run_io("get_validators",
+                                           self.cache.get_validators,
+                                           abs_path)
+            if validators:
+                self.context.metrics.incr("storage.revalidate")
+                self.context.request.stale_original = StaleOriginal(
+                    path, res.data, validators.get("Etag"), validators.get("Last-Modified")
+                )
+
+            return None
+
         return res.data
 
 
     def path_on_filesystem(self, hash_data):
-        digest = hashlib.sha1(hash_data.encode("utf-8")).hexdigest()
-        return "%s/%s/%s" % (
-            self.context.config.FILE_STORAGE_ROOT_PATH.rstrip("/"),
-            digest[:2],
-            digest[2:],
-        )
+        return self.cache.link_path(hash_data)
 
 
     async def exists(self, path, path_on_filesystem=None):  # pylint: disable=arguments-differ
+        legacy_path = None
         if path_on_filesystem is None:
             path_on_filesystem = self.path_on_filesystem(path)
+            legacy_path = self.cache.legacy_link_path(path)
 
-        found, _, _ = self.cache.exists(path_on_filesystem)
+        found, _, _ = await self.run_io("exists", self.cache.exists, path_on_filesystem, legacy_path)
         return found
 
 
     async def remove(self, path):
         n_path = self.path_on_filesystem(path)
-        self.cache.remove(n_path)
+        await self.run_io("remove", self.cache.remove, n_path)
+
+        legacy_path = self.cache.legacy_link_path(path)
+        if legacy_path is not None:
+            await self.run_io("remove", self.cache.remove, legacy_path)
 
 
     async def put_crypto(self, path):
         if not self.context.config.STORES_CRYPTO_KEY_FOR_EACH_IMAGE:
             return
 
-        file_abspath = self.path_on_filesystem(path)
-        file_dir_abspath = dirname(file_abspath)
-
-        self.ensure_dir(file_dir_abspath)
-
         if not self.context.server.security_key:
             raise RuntimeError(
                 "STORES_CRYPTO_KEY_FOR_EACH_IMAGE can't be "
                 "True if no SECURITY_KEY specified"
             )
 
+        file_abspath = self.path_on_filesystem(path)
         crypto_path = "%s.txt" % splitext(file_abspath)[0]
-        temp_abspath = "%s.%s" % (crypto_path, str(uuid4()).replace("-", ""))
-        with open(temp_abspath, "wb") as _file:
-            _file.write(self.context.server.security_key.encode())
-
-        move(temp_abspath, crypto_path)
+        await self.run_io("put_crypto", self.write_file, crypto_path, self.context.server.security_key.encode())
         logger.debug(
             "Stored crypto at %s (security key: %s)",
             crypto_path,
@@ -117,15 +171,7 @@ class Storage(storages.BaseStorage):
         file_abspath = self.path_on_filesystem(path)
 
         path = "%s.detectors.txt" % splitext(file_abspath)[0]
-        temp_abspath = "%s.%s" % (path, str(uuid4()).replace("-", ""))
-
-        file_dir_abspath = dirname(file_abspath)
-        self.ensure_dir(file_dir_abspath)
-
-        with open(temp_abspath, "w") as _file:
-            _file.write(dumps(data))
-
-        move(temp_abspath, path)
+        await self.run_io("put_detector_data", self.write_file, path, dumps(data).encode())
 
         return file_abspath
 
@@ -139,4 +185,26 @@ class Storage(storages.BaseStorage):
         if not resource_available:
             return None
 
-        return loads(open(path, "r").read())
+        data = await self.run_io("get_detector_data", self.read_file, path)
+        if data is None:
+            return None
+
+        return loads(data)
+
+
+    def write_file(self, path, data):
+        self.ensure_dir(dirname(path))
+
+        temp_abspath = "%s.%s" % (path, str(uuid4()).replace("-", ""))
+        with open(temp_abspath, "wb") as _file:
+            _file.write(data)
+
+        move(temp_abspath, path)
+
+
+    def read_file(self, path):
+        try:
+            with open(path, "rb") as _file:
+                return _file.read()
+        except FileNotFoundError:
+            return None